@@ -0,0 +1,54 @@
+from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.utils.translation import ugettext_lazy as _
+
+from .base.metrics import get_task_metrics, get_tasks_metrics
+from .base.models import RegularTask, JobMetricsModel
+
+
+class MetricsChangeList(ChangeList):
+    '''Reads metrics of tasks of the page once, not per column.'''
+
+    def get_results(self, request):
+        super(MetricsChangeList, self).get_results(request)
+        metrics = get_tasks_metrics(self.result_list)
+        for task in self.result_list:
+            task._metrics = metrics[task.pk]
+
+
+def _metric_column(name, p, description):
+    def column(obj):
+        # Metrics are set by MetricsChangeList
+        if not hasattr(obj, '_metrics'):
+            obj._metrics = get_task_metrics(obj)
+        value = obj._metrics[name]['p%s' % p]
+        if value is None:
+            return '-'
+        if name == 'max_rss':
+            return '%.1f MB' % (value / 1024.0 ** 2)
+        return '%.3f s' % value
+    column.short_description = description
+    return column
+
+
+@admin.register(RegularTask)
+class RegularTaskAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'public', 'updated',
+                    _metric_column('wall_time', 50, _('Wall time p50')),
+                    _metric_column('wall_time', 95, _('Wall time p95')),
+                    _metric_column('wall_time', 99, _('Wall time p99')),
+                    _metric_column('cpu_time', 95, _('CPU time p95')),
+                    _metric_column('queue_wait', 95, _('Queue wait p95')),
+                    _metric_column('max_rss', 95, _('Peak RSS p95')),
+                    )
+
+    def get_changelist(self, request, **kwargs):
+        return MetricsChangeList
+
+
+@admin.register(JobMetricsModel)
+class JobMetricsAdmin(admin.ModelAdmin):
+    list_display = ('task', 'status', 'queue_wait', 'wall_time', 'cpu_time',
+                    'max_rss', 'created')
+    list_filter = ('status',)
+    date_hierarchy = 'created'
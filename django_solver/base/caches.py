@@ -0,0 +1,112 @@
+'''
+In-process caches used by django_solver.
+'''
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    '''
+    Thread safe mapping with limited size.
+
+    When the size limit is reached, least recently used items are evicted.
+    '''
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class SizedLRUCache(object):
+    '''
+    Thread safe mapping with limited total size of values.
+
+    Size of each value is measured by sizeof(value); values bigger than
+    the limit aren't stored. Least recently used items are evicted first.
+    '''
+
+    def __init__(self, maxsize, sizeof=len):
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                item = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = item
+            return item[0]
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            self._pop(key)
+            if size > self.maxsize:
+                return
+            self._data[key] = (value, size)
+            self.size += size
+            while self.size > self.maxsize:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.size -= evicted
+
+    def _pop(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.size -= item[1]
+        return item
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._pop(key)
+            return default if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,109 @@
+'''
+Cache of compiled python code of tasks.
+
+Code objects are keyed by SHA1 of the source and kept in-process
+(LRU, DJSOLVER_CODE_CACHE_SIZE items). If DJSOLVER_CODE_CACHE_DIR is defined,
+they are also stored there with marshal, so they could be shared by
+processes and survive restarts. Entries on disk are addressed by the source
+content (and the interpreter magic number), so they are never stale.
+'''
+
+import hashlib
+import marshal
+import os
+import tempfile
+import threading
+
+try:
+    from importlib.util import MAGIC_NUMBER
+except ImportError:
+    from imp import get_magic
+    MAGIC_NUMBER = get_magic()
+
+from django.conf import settings
+
+from .caches import LRUCache
+
+
+_cache = LRUCache(maxsize=settings.DJSOLVER_CODE_CACHE_SIZE)
+
+# Model pk -> keys of the code compiled for it; only keys of cached entries
+# are kept, so it is bounded as the cache is
+_owners = LRUCache(maxsize=settings.DJSOLVER_CODE_CACHE_SIZE)
+_owners_lock = threading.Lock()
+
+
+def get_code_key(source, filename):
+    key = hashlib.sha1(filename.encode('utf-8') + b'\0' + source.encode('utf-8'))
+    return key.hexdigest()
+
+
+def _get_disk_path(key):
+    cache_dir = getattr(settings, 'DJSOLVER_CODE_CACHE_DIR', None)
+    if not cache_dir:
+        return None
+    magic = hashlib.sha1(MAGIC_NUMBER).hexdigest()[:8]
+    return os.path.join(cache_dir, '%s.%s.marshal' % (key, magic))
+
+
+def _load_from_disk(key):
+    path = _get_disk_path(key)
+    if path is None or not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return marshal.load(f)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def _store_to_disk(key, code):
+    path = _get_disk_path(key)
+    if path is None:
+        return
+    dirname = os.path.dirname(path)
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmppath = tempfile.mkstemp(dir=dirname)
+        with os.fdopen(fd, 'wb') as f:
+            marshal.dump(code, f)
+        os.rename(tmppath, path)
+    except (IOError, OSError):
+        pass
+
+
+def compile_code(source, filename='<code>', owner=None):
+    '''
+    Returns the code object compiled from the source.
+
+    :param owner: pk of the PythonCodeModel instance the source belongs to;
+                  the entry is evicted when the instance is saved or deleted.
+    '''
+    key = get_code_key(source, filename)
+    code = _cache.get(key)
+    if code is None:
+        code = _load_from_disk(key)
+        if code is None:
+            code = compile(source, filename, 'exec')
+            _store_to_disk(key, code)
+        _cache.set(key, code)
+    if owner is not None:
+        with _owners_lock:
+            keys = set(owned for owned in _owners.get(owner, ()) if owned in _cache)
+            keys.add(key)
+            _owners.set(owner, keys)
+    return code
+
+
+def invalidate_owner(owner):
+    '''Evicts in-process entries compiled for the PythonCodeModel instance.'''
+    with _owners_lock:
+        keys = _owners.pop(owner, ())
+    for key in keys:
+        _cache.pop(key)
+
+
+def clear():
+    _cache.clear()
+    _owners.clear()
@@ -0,0 +1,543 @@
+'''
+Job engine: the task stack and a pool of worker processes solving it.
+
+A job is a task together with validated input values. Jobs are put to
+the task stack by :meth:`JobEngine.submit` and solved by worker processes;
+the number of simultaneously solved jobs is limited by
+``DJSOLVER_RESTRICTIONS_GLOBAL['MAX_PROCESSES']``.
+'''
+
+import importlib
+import json
+import logging
+import multiprocessing
+import threading
+import time
+import traceback
+import uuid
+from functools import partial
+
+from django.conf import settings
+from django.utils import six
+
+from .codecache import compile_code
+from .metrics import record_job_metrics
+from .resultcache import get_result_key, get_cached_result, set_cached_result
+from .scheduler import FairScheduler
+from .stack import get_task_stack
+from .sandbox import run_sandboxed, get_limits, SANDBOX_OK, SANDBOX_ERROR
+from .utils import get_task_sources
+
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+def compile_sources(sources):
+    '''Returns compiled preamble, code and postamble of the task.'''
+    ids = sources.get('ids', {})
+    return [compile_code(sources[part], '<%s>' % part, owner=ids.get(part))
+            for part in ('preamble', 'code', 'postamble') if sources.get(part)]
+
+
+def execute_codes(codes, inputs):
+    '''Executes compiled code of the task.
+
+    Python code of the task communicates through two dictionaries:
+    INPUTS (input values of the task) and OUTPUTS (results of the solution).
+    Returns the OUTPUTS dictionary.
+    '''
+    namespace = {'INPUTS': inputs, 'OUTPUTS': dict()}
+    for code in codes:
+        exec(code, namespace)
+    return namespace['OUTPUTS']
+
+
+def execute_sources(sources, inputs):
+    '''Executes preamble, code and postamble of the task.'''
+    return execute_codes(compile_sources(sources), inputs)
+
+
+def _jsonable(outputs):
+    '''Converts outputs to json compatible values, that could be sent to client.'''
+    return json.loads(json.dumps(outputs, default=str))
+
+
+def _solve(codes, inputs):
+    return _jsonable(execute_codes(codes, inputs))
+
+
+def _solve_sandboxed(codes, inputs, limits):
+    res = run_sandboxed(_solve, (codes, inputs), **limits)
+    return {'status': res['status'], 'outputs': res['result'], 'error': res['error'],
+            'usage': res['usage']}
+
+
+# Queue to report progress of batch jobs; it is inherited by worker processes.
+_progress_queue = None
+
+
+def _init_worker(progress_queue, preload=()):
+    '''Worker process initializer.
+
+    Worker is a parent of sandboxed processes solving jobs, so modules
+    imported here (DJSOLVER_WORKER_PRELOAD) are available to all of them
+    without being imported again. Modules which fail to import are logged
+    and skipped.
+    '''
+    global _progress_queue
+    _progress_queue = progress_queue
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            logger.exception('Preloading of module %s failed', name)
+
+
+def _run_job(sources, inputs, limits):
+    '''Job entry point; it is executed in a worker process.
+
+    Code is compiled in the worker, so compiled code is cached between jobs,
+    and is run in the sandbox, so a runaway task could not take the worker down.
+    '''
+    try:
+        codes = compile_sources(sources)
+    except Exception:
+        return {'status': SANDBOX_ERROR, 'outputs': None, 'error': traceback.format_exc(),
+                'usage': None}
+    return _solve_sandboxed(codes, inputs, limits)
+
+
+def _run_batch(job_id, sources, items, limits):
+    '''Batch job entry point; it is executed in a worker process.
+
+    The code is compiled once and solved for each of (index, inputs) items.
+    Results of items are sent to the progress queue as soon as they are ready.
+    '''
+    try:
+        codes = compile_sources(sources)
+    except Exception:
+        return {'status': SANDBOX_ERROR, 'outputs': None, 'error': traceback.format_exc(),
+                'usage': None}
+    for index, inputs in items:
+        _progress_queue.put((job_id, index, _solve_sandboxed(codes, inputs, limits)))
+    return {'status': SANDBOX_OK, 'outputs': None, 'error': None, 'usage': None}
+
+
+def _item_state(index, result, cached=False):
+    return {'index': index,
+            'status': JOB_DONE if result['status'] == SANDBOX_OK else JOB_FAILED,
+            'result': result['outputs'],
+            'message': result['error'],
+            'reason': result['status'],
+            'cached': cached,
+            }
+
+
+def _owner_key(owner):
+    # Owners are stored as text by shared task stacks
+    return '' if owner is None else '%s' % owner
+
+
+class Job(object):
+    '''A single task solution request.
+
+    Batch jobs solve the task for a list of inputs; their `items`
+    hold states of solved items in order of completion.
+    '''
+
+    def __init__(self, task_id, inputs, cache_key=None, batch=False, owner=None):
+        self.id = uuid.uuid4().hex
+        self.task_id = task_id
+        self.inputs = inputs
+        self.owner = owner
+        self.cache_key = cache_key
+        self.cached = False
+        self.items = [] if batch else None
+        # Batch jobs: (index, inputs) items to solve and their cache keys
+        self.todo = []
+        self.keys = []
+        self.status = JOB_QUEUED
+        self.outputs = None
+        self.error = None
+        self.reason = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # Incremented on every change of the job state
+        self.version = 0
+
+    @property
+    def elapsed_time(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def as_dict(self):
+        res = {'hash': self.id,
+                'task': self.task_id,
+                'status': self.status,
+                'result': self.outputs,
+                'message': self.error,
+                'reason': self.reason,
+                'elapsed_time': self.elapsed_time,
+                'cached': self.cached,
+                'version': self.version,
+                }
+        if self.items is not None:
+            res['total'] = len(self.inputs)
+            res['items'] = list(self.items)
+        return res
+
+
+class JobEngine(object):
+    '''
+    Task stack and the pool of worker processes.
+
+    Jobs are taken from the stack by fair-share scheduling between
+    their owners; the number of running jobs of an owner is limited by
+    ``DJSOLVER_RESTRICTIONS_GLOBAL['MAX_PROCESSES_PER_USER']``. Finished jobs are
+    kept for DJSOLVER_JOB_LIFETIME seconds, so their results could be queried.
+    Solutions are cached, jobs with cached solutions are done at once.
+
+    The stack is stored by the DJSOLVER_TASK_STACK backend. Shared backends
+    also keep job states, so jobs could be submitted, run and queried by
+    different processes; the stack is polled every
+    DJSOLVER_TASK_STACK_POLL_INTERVAL seconds for jobs of other processes.
+    Shared backends don't notify about state changes, so waiting for a job
+    state (:meth:`wait`, :meth:`iter_items`) polls the stored state at the
+    same interval for each waiting client.
+    '''
+
+    def __init__(self, processes=None):
+        restrictions = settings.DJSOLVER_RESTRICTIONS_GLOBAL
+        if processes is None:
+            processes = restrictions['MAX_PROCESSES']
+        self.processes = processes
+        self._jobs = {}
+        self._storage = get_task_stack()
+        self._stack = FairScheduler(restrictions.get('MAX_PROCESSES_PER_USER'),
+                                    storage=self._storage)
+        self._running = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pool = None
+        self._progress_queue = None
+        self._closed = False
+        if self._storage.shared:
+            poller = threading.Thread(target=self._poll_stack)
+            poller.daemon = True
+            poller.start()
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._progress_queue = multiprocessing.Queue()
+            preload = tuple(settings.DJSOLVER_WORKER_PRELOAD)
+            self._pool = multiprocessing.Pool(processes=self.processes,
+                                              initializer=_init_worker,
+                                              initargs=(self._progress_queue, preload))
+            collector = threading.Thread(target=self._collect_progress,
+                                         args=(self._progress_queue,))
+            collector.daemon = True
+            collector.start()
+        return self._pool
+
+    def submit(self, task, inputs, owner=None, weight=1):
+        '''Puts the task with (validated) inputs to the task stack.
+
+        :param owner: key of the job owner, e.g. RegularUserModel pk
+        :param weight: share of workers the owner is entitled to
+
+        Returns id of the created job.
+        '''
+        owner = _owner_key(owner)
+        sources = get_task_sources(task)
+        job = Job(task.pk, inputs, cache_key=get_result_key(task, inputs, sources), owner=owner)
+        outputs = get_cached_result(job.cache_key)
+        if outputs is not None:
+            job.started = job.finished = time.time()
+            job.outputs = outputs
+            job.reason = SANDBOX_OK
+            job.status = JOB_DONE
+            job.cached = True
+            with self._lock:
+                self._track(job)
+            return job.id
+        with self._lock:
+            self._track(job)
+            self._stack.push(owner, (job, sources), weight)
+            self._dispatch()
+        return job.id
+
+    def submit_batch(self, task, inputs_list, owner=None, weight=1):
+        '''Puts a batch job to the task stack.
+
+        The task is loaded once and solved for each of (validated) inputs
+        by a single worker; cached solutions are taken from the cache.
+        Returns id of the created job.
+        '''
+        owner = _owner_key(owner)
+        job = Job(task.pk, inputs_list, batch=True, owner=owner)
+        sources = get_task_sources(task)
+        job.keys = [get_result_key(task, inputs, sources) for inputs in inputs_list]
+        for index, inputs in enumerate(inputs_list):
+            outputs = get_cached_result(job.keys[index])
+            if outputs is None:
+                job.todo.append((index, inputs))
+            else:
+                job.items.append(_item_state(index, {'status': SANDBOX_OK, 'outputs': outputs,
+                                                     'error': None}, cached=True))
+        if not job.todo:
+            job.started = job.finished = time.time()
+            job.status = JOB_DONE
+            job.reason = SANDBOX_OK
+        with self._lock:
+            self._track(job)
+            if job.todo:
+                self._stack.push(owner, (job, sources), weight)
+                self._dispatch()
+        return job.id
+
+    def iter_items(self, job_id, timeout=None):
+        '''Yields states of batch job items as soon as they are solved.'''
+        if self._storage.shared:
+            for item in self._iter_stored_items(job_id, timeout):
+                yield item
+            return
+        deadline = None if timeout is None else time.time() + timeout
+        sent = 0
+        while True:
+            with self._changed:
+                job = self._jobs.get(job_id)
+                if job is None or job.items is None:
+                    return
+                while len(job.items) == sent and job.finished is None:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        return
+                    self._changed.wait(remaining)
+                items = job.items[sent:]
+                finished = job.finished is not None
+            for item in items:
+                yield item
+            sent += len(items)
+            if finished and sent == len(job.items):
+                return
+
+    def status(self, job_id):
+        '''Returns the job state as a dictionary or None if job is not found.'''
+        if self._storage.shared:
+            return self._storage.load_state(job_id) if job_id else None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.as_dict() if job else None
+
+    def wait(self, job_id, version=0, timeout=None):
+        '''Waits until the job state changes.
+
+        Returns the job state as soon as its version is greater than `version`,
+        the job is finished or timeout is exceeded; None if job is not found.
+        '''
+        if self._storage.shared:
+            return self._wait_stored(job_id, version, timeout)
+        deadline = None if timeout is None else time.time() + timeout
+        with self._changed:
+            job = self._jobs.get(job_id)
+            while job is not None and job.version <= version and job.finished is None:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+                job = self._jobs.get(job_id)
+            return job.as_dict() if job else None
+
+    def iter_states(self, job_id, timeout=None):
+        '''Yields job states on every change until the job is finished.'''
+        deadline = None if timeout is None else time.time() + timeout
+        version = -1
+        while True:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return
+            state = self.wait(job_id, version, remaining)
+            if state is None or state['version'] == version:
+                return
+            yield state
+            version = state['version']
+            if state['status'] in (JOB_DONE, JOB_FAILED):
+                return
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            pool, progress_queue = self._pool, self._progress_queue
+            self._pool = self._progress_queue = None
+        # The pool is terminated without the lock: its result handler
+        # thread could wait for it.
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+            progress_queue.put(None)
+
+    def _dispatch(self):
+        # Should be called with the lock acquired
+        while self._running < self.processes:
+            entry = self._stack.pop()
+            if entry is None:
+                break
+            job, sources = entry[1]
+            # Jobs of the memory stack are tracked since submission and
+            # updated in place; jobs of shared stacks are tracked from now on
+            job = self._jobs.setdefault(job.id, job)
+            job.status = JOB_RUNNING
+            job.started = time.time()
+            self._running += 1
+            if job.items is None:
+                func, args = _run_job, (sources, job.inputs, get_limits())
+            else:
+                func, args = _run_batch, (job.id, sources, job.todo, get_limits())
+            callbacks = {'callback': partial(self._finish, job.id)}
+            if not six.PY2:
+                # Errors outside of the sandbox, e.g. unpicklable inputs
+                callbacks['error_callback'] = partial(self._fail, job.id)
+            self._get_pool().apply_async(func, args, **callbacks)
+            self._touch(job)
+
+    def _finish(self, job_id, result):
+        # Called from the result handler thread of the pool
+        job = self._jobs.get(job_id)
+        if job is not None and job.items is None:
+            if result['status'] == SANDBOX_OK:
+                set_cached_result(job.cache_key, result['outputs'])
+            self._record_metrics(job, result)
+        with self._lock:
+            self._running -= 1
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._stack.release(job.owner)
+            # Successful batch jobs are finished by the progress collector
+            if job is not None and (job.items is None or result['status'] != SANDBOX_OK):
+                job.finished = time.time()
+                job.outputs = result['outputs']
+                job.error = result['error']
+                job.reason = result['status']
+                job.status = JOB_DONE if result['status'] == SANDBOX_OK else JOB_FAILED
+                self._touch(job)
+            self._dispatch()
+
+    def _fail(self, job_id, error):
+        # Called from the result handler thread of the pool if the job
+        # could not be passed to a worker or its result could not be returned
+        self._finish(job_id, {'status': SANDBOX_ERROR, 'outputs': None,
+                              'error': '%s: %s' % (type(error).__name__, error),
+                              'usage': None})
+
+    def _collect_progress(self, progress_queue):
+        # Collects results of batch items; it is run in a separate thread
+        while True:
+            message = progress_queue.get()
+            if message is None:
+                return
+            job_id, index, result = message
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            if result['status'] == SANDBOX_OK:
+                set_cached_result(job.keys[index], result['outputs'])
+            self._record_metrics(job, result)
+            with self._lock:
+                job.items.append(_item_state(index, result))
+                if len(job.items) == len(job.inputs):
+                    job.finished = time.time()
+                    job.reason = SANDBOX_OK
+                    job.status = JOB_DONE
+                self._touch(job)
+
+    def _record_metrics(self, job, result):
+        queue_wait = job.started - job.submitted if job.started else None
+        record_job_metrics(job.task_id, result['status'], queue_wait, result['usage'])
+
+    def _touch(self, job):
+        # Should be called with the lock acquired on every change of the job
+        job.version += 1
+        self._save(job)
+        self._changed.notify_all()
+
+    def _track(self, job):
+        # Should be called with the lock acquired on submission of the job.
+        # States of jobs are kept by shared stacks, and the job is tracked
+        # only by the process which takes it from the stack.
+        self._purge()
+        if not self._storage.shared:
+            self._jobs[job.id] = job
+        self._save(job)
+
+    def _save(self, job):
+        # Should be called with the lock acquired
+        if self._storage.shared:
+            self._storage.save_state(job.id, job.as_dict())
+
+    def _poll_stack(self):
+        # Takes jobs pushed by other processes; it is run in a separate thread
+        while True:
+            time.sleep(settings.DJSOLVER_TASK_STACK_POLL_INTERVAL)
+            with self._lock:
+                if self._closed:
+                    return
+                try:
+                    self._dispatch()
+                except Exception:
+                    # The storage could be temporarily unavailable
+                    logger.exception('Polling of the task stack failed')
+
+    def _wait_stored(self, job_id, version, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            state = self.status(job_id)
+            if state is None or state['version'] > version \
+                    or state['status'] in (JOB_DONE, JOB_FAILED):
+                return state
+            if deadline is not None and time.time() >= deadline:
+                return state
+            time.sleep(settings.DJSOLVER_TASK_STACK_POLL_INTERVAL)
+
+    def _iter_stored_items(self, job_id, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        sent, version = 0, 0
+        while True:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            state = self._wait_stored(job_id, version, remaining)
+            if state is None or 'items' not in state:
+                return
+            for item in state['items'][sent:]:
+                yield item
+            sent = len(state['items'])
+            finished = state['status'] in (JOB_DONE, JOB_FAILED)
+            if finished or state['version'] == version:
+                return
+            version = state['version']
+
+    def _purge(self):
+        # Should be called with the lock acquired
+        deadline = time.time() - settings.DJSOLVER_JOB_LIFETIME
+        expired = [key for key, job in self._jobs.items()
+                   if job.finished is not None and job.finished < deadline]
+        for key in expired:
+            del self._jobs[key]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    '''Returns the job engine of the current process.'''
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = JobEngine()
+        return _engine
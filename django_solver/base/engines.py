@@ -0,0 +1,187 @@
+'''
+Template engines of task templates.
+
+Templates are rendered according to TemplateModel.type: 'J' templates are
+rendered by Jinja2 if it is installed (otherwise by the Django template
+engine, that understands the same simple templates, and a warning is
+logged). If DJSOLVER_JINJA_BYTECODE_CACHE_DIR is defined, compiled Jinja2
+templates are stored there, so they survive restarts and are shared by
+processes.
+
+'M' templates are converted from Markdown to HTML (if markdown is installed)
+when they are compiled, so rendering is only a substitution of values.
+Template tags are protected from the conversion.
+'''
+
+import logging
+import os
+import re
+import threading
+
+try:
+    import jinja2
+except ImportError:
+    jinja2 = None
+
+try:
+    import markdown
+except ImportError:
+    markdown = None
+
+from django.conf import settings
+from django.template import Context, Template
+
+
+logger = logging.getLogger(__name__)
+
+
+DJANGO_ENGINE = 'django'
+JINJA_ENGINE = 'jinja'
+MARKDOWN_ENGINE = 'markdown'
+
+_tag_pat = re.compile(r'\{\{.*?\}\}|\{%.*?%\}|\{#.*?#\}', re.S)
+
+_placeholder_pat = re.compile(r'djsolvertag(\d+)x')
+
+_jinja_env = None
+_jinja_env_lock = threading.Lock()
+
+# Template types rendered without their engine, that were logged
+_fallback_types = set()
+
+
+def get_jinja_environment():
+    '''Returns Jinja2 environment used to render 'J' templates.'''
+    global _jinja_env
+    with _jinja_env_lock:
+        if _jinja_env is None:
+            cache_dir = getattr(settings, 'DJSOLVER_JINJA_BYTECODE_CACHE_DIR', None)
+            bytecode_cache = None
+            if cache_dir:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+            _jinja_env = jinja2.Environment(autoescape=True, bytecode_cache=bytecode_cache)
+        return _jinja_env
+
+
+def _log_fallback(template_type, module):
+    # Once per process, since it is called on every rendering
+    if template_type not in _fallback_types:
+        _fallback_types.add(template_type)
+        logger.warning("%s is not installed, templates of type '%s' are rendered "
+                       "by the Django template engine", module, template_type)
+
+
+def get_engine_name(template_type):
+    '''
+    Returns the name of the engine rendering templates of the type.
+
+    A warning is logged if the engine of the type isn't installed.
+    '''
+    if template_type == 'J':
+        if jinja2 is not None:
+            return JINJA_ENGINE
+        _log_fallback(template_type, 'jinja2')
+    elif template_type == 'M':
+        if markdown is not None:
+            return MARKDOWN_ENGINE
+        _log_fallback(template_type, 'markdown')
+    return DJANGO_ENGINE
+
+
+def markdown_to_template(source):
+    '''Converts Markdown source to HTML, leaving template tags as is.'''
+    tags = []
+
+    def _protect(match):
+        tags.append(match.group(0))
+        return 'djsolvertag%sx' % (len(tags) - 1)
+
+    def _restore(match):
+        index = int(match.group(1))
+        return tags[index] if index < len(tags) else match.group(0)
+
+    html = markdown.markdown(_tag_pat.sub(_protect, source))
+    return _placeholder_pat.sub(_restore, html)
+
+
+def _compile_jinja(source, name):
+    # The same as jinja2 loaders do, but for sources stored in the database
+    env = get_jinja_environment()
+    bcc = env.bytecode_cache
+    bucket = bcc.get_bucket(env, name, None, source) if bcc is not None else None
+    code = bucket.code if bucket is not None else None
+    if code is None:
+        code = env.compile(source, name)
+        if bucket is not None:
+            bucket.code = code
+            bcc.set_bucket(bucket)
+    return env.template_class.from_code(env, code, env.make_globals(None))
+
+
+def compile_template(source, engine=DJANGO_ENGINE, name='template'):
+    '''
+    Compiles the template source.
+
+    :param name: name of the template; Jinja2 bytecode is stored by the name
+                 and the source checksum
+    '''
+    if engine == MARKDOWN_ENGINE:
+        # Values are substituted by the engine of 'J' templates
+        source = markdown_to_template(source)
+        engine = JINJA_ENGINE if jinja2 is not None else DJANGO_ENGINE
+    if engine == JINJA_ENGINE:
+        return _compile_jinja(source, name)
+    return Template(source)
+
+
+def render_template(template, context):
+    '''Renders the compiled template with a dictionary of values.'''
+    if isinstance(template, Template):
+        return template.render(Context(context))
+    return template.render(context)
+
+
+def _iter_django(template, context):
+    # The same as Template.render, but yields output of top level nodes;
+    # output of a node (e.g. of a whole {% for %} loop) is rendered at once
+    context = Context(context)
+    render_context = context.render_context
+    if hasattr(render_context, 'push_state'):
+        state = render_context.push_state(template)
+    else:
+        state = render_context.push()
+    with state:
+        with context.bind_template(template):
+            for node in template.nodelist:
+                if hasattr(node, 'render_annotated'):
+                    yield node.render_annotated(context)
+                else:
+                    yield node.render(context)
+
+
+def stream_template(template, context):
+    '''
+    Renders the compiled template by parts.
+
+    Yields chunks of about DJSOLVER_STREAM_CHUNK_SIZE characters,
+    so the whole output isn't kept in memory. Jinja2 templates are
+    generated statement by statement, but Django templates are rendered
+    by top level nodes: output of a loop or a block is kept in memory as
+    a whole, so loops over large tables are streamed by Jinja2 only.
+    '''
+    if isinstance(template, Template):
+        parts = _iter_django(template, context)
+    else:
+        parts = template.generate(context)
+    chunk_size = settings.DJSOLVER_STREAM_CHUNK_SIZE
+    chunk, size = [], 0
+    for part in parts:
+        chunk.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk)
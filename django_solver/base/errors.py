@@ -3,3 +3,21 @@ from django.utils.translation import ugettext as _
 PYCODE_ERROR = _('Error in Python code: it could not be parsed')
 
 DEFAULT_DICT_ERROR = _('Dictionary of default variables could not be parsed')
+
+TASK_NOT_FOUND_ERROR = _('Task not found')
+
+INPUTS_ERROR = _('Input values could not be validated')
+
+JOB_NOT_FOUND_ERROR = _('Job not found')
+
+REQUEST_METHOD_ERROR = _('Only POST requests are allowed')
+
+BATCH_SIZE_ERROR = _('Too many input sets in the batch')
+
+BATCH_TIMEOUT_ERROR = _('Batch job was not solved in time')
+
+INPUT_VALUE_ERROR = _('Invalid value in row %(row)s, column %(col)s')
+
+INPUT_SIZE_ERROR = _('Input data are too large')
+
+INPUT_TYPE_ERROR = _('Input data of this type could not be converted')
@@ -0,0 +1,73 @@
+'''
+Cache of contents of template and code files.
+
+Decoded contents of files stored by TemplateModel and PythonCodeModel are
+kept per process and keyed by the file path in the storage. Each entry is
+validated by the modification time and size of the file, so a changed file
+is read again. The total size of cached contents is limited by
+DJSOLVER_FILE_CACHE_MAX_SIZE (characters); files of
+DJSOLVER_FILE_CACHE_MMAP_THRESHOLD bytes and bigger are read through mmap.
+
+Storages without local paths aren't cached.
+'''
+
+import codecs
+import mmap
+import os
+
+from django.conf import settings
+
+from .caches import SizedLRUCache
+
+
+_cache = SizedLRUCache(maxsize=settings.DJSOLVER_FILE_CACHE_MAX_SIZE,
+                       sizeof=lambda entry: len(entry[1]))
+
+
+def _get_path(fieldfile):
+    try:
+        return fieldfile.storage.path(fieldfile.name)
+    except NotImplementedError:
+        return None
+
+
+def _read_path(path, size):
+    with open(path, 'rb') as f:
+        threshold = settings.DJSOLVER_FILE_CACHE_MMAP_THRESHOLD
+        if threshold is None or size < threshold or not size:
+            return f.read().decode('utf-8')
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return codecs.decode(mapped, 'utf-8')
+        finally:
+            mapped.close()
+
+
+def read_file_content(fieldfile):
+    '''
+    Returns decoded (utf-8) content of the file of a model instance.
+
+    Raises IOError if the file could not be read.
+    '''
+    path = _get_path(fieldfile)
+    if path is None:
+        fieldfile.open('rb')
+        try:
+            return fieldfile.read().decode('utf-8')
+        finally:
+            fieldfile.close()
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        raise IOError(e)
+    version = (getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size)
+    entry = _cache.get(path)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    content = _read_path(path, stat.st_size)
+    _cache.set(path, (version, content))
+    return content
+
+
+def clear():
+    _cache.clear()
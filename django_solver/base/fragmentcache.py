@@ -0,0 +1,131 @@
+'''
+Cache of rendered task formulations.
+
+Public tasks are rendered from their formulation template and defaults only,
+so rendered HTML fragments are stored in Django cache DJSOLVER_FRAGMENT_CACHE
+and keyed by the task pk and the task revision (its `updated` field).
+Fragments are stored with a hash of the formulation template type and
+source, so they aren't used if the template is changed without saving the
+model (e.g. its file is replaced or it is updated in bulk). Fragments are
+deleted when the task or its formulation template is saved or deleted.
+
+Rendered solutions are stored in the same cache and keyed by the task
+revision, the solution template source and outputs of the task code.
+'''
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+# Kinds of rendered fragments: render_simple and render_with_inputs
+FRAGMENT_KINDS = ('simple', 'inputs')
+
+
+def _get_cache():
+    alias = getattr(settings, 'DJSOLVER_FRAGMENT_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def get_fragment_key(task, kind):
+    revision = task.updated.isoformat() if task.updated else ''
+    return 'djsolver:fragment:%s:%s:%s' % (kind, task.pk, revision)
+
+
+def get_template_digest(task, source):
+    '''Returns hash of the formulation template of the task with the source.'''
+    data = '%s\0%s' % (task.formulation_template.type, source)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def _get_html(entry, digest):
+    # Entries are (template digest, html)
+    if isinstance(entry, tuple) and entry[0] == digest:
+        return entry[1]
+    return None
+
+
+def get_cached_fragment(task, kind, source):
+    '''Returns fragment of the task rendered from the template source or None.'''
+    cache = _get_cache()
+    if cache is None or task.pk is None:
+        return None
+    return _get_html(cache.get(get_fragment_key(task, kind)), get_template_digest(task, source))
+
+
+def set_cached_fragment(task, kind, source, html):
+    cache = _get_cache()
+    if cache is None or task.pk is None:
+        return
+    cache.set(get_fragment_key(task, kind), (get_template_digest(task, source), html),
+              settings.DJSOLVER_FRAGMENT_CACHE_TIMEOUT)
+
+
+def get_cached_fragments(tasks, kind, sources):
+    '''
+    Returns {task pk: rendered fragment} of cached fragments of the tasks.
+
+    :param sources: {task pk: source of the formulation template}
+    '''
+    cache = _get_cache()
+    if cache is None:
+        return {}
+    tasks = dict((get_fragment_key(task, kind), task) for task in tasks if task.pk is not None)
+    res = {}
+    for key, entry in cache.get_many(list(tasks)).items():
+        task = tasks[key]
+        html = _get_html(entry, get_template_digest(task, sources[task.pk]))
+        if html is not None:
+            res[task.pk] = html
+    return res
+
+
+def set_cached_fragments(fragments, kind, sources):
+    '''Stores {task: rendered fragment} to the cache.'''
+    cache = _get_cache()
+    if cache is None:
+        return
+    cache.set_many(dict((get_fragment_key(task, kind),
+                         (get_template_digest(task, sources[task.pk]), html))
+                        for task, html in fragments.items() if task.pk is not None),
+                   settings.DJSOLVER_FRAGMENT_CACHE_TIMEOUT)
+
+
+def _jsonable(value):
+    # numpy arrays and scalars have tolist(); str() of big arrays is abridged
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+def get_solution_key(task, source, outputs):
+    revision = task.updated.isoformat() if task.updated else ''
+    data = json.dumps(outputs, sort_keys=True, default=_jsonable)
+    digest = hashlib.sha1(source.encode('utf-8') + b'\0' + data.encode('utf-8'))
+    return 'djsolver:solution:%s:%s:%s' % (task.pk, revision, digest.hexdigest())
+
+
+def get_cached_solution(task, source, outputs):
+    '''Returns the solution rendered from the source for outputs or None.'''
+    cache = _get_cache()
+    if cache is None or task.pk is None:
+        return None
+    return cache.get(get_solution_key(task, source, outputs))
+
+
+def set_cached_solution(task, source, outputs, html):
+    cache = _get_cache()
+    if cache is None or task.pk is None:
+        return
+    cache.set(get_solution_key(task, source, outputs), html,
+              settings.DJSOLVER_FRAGMENT_CACHE_TIMEOUT)
+
+
+def invalidate_task(task):
+    '''Deletes all rendered fragments of the task.'''
+    cache = _get_cache()
+    if cache is None:
+        return
+    cache.delete_many([get_fragment_key(task, kind) for kind in FRAGMENT_KINDS])
@@ -0,0 +1,74 @@
+'''
+Execution metrics of jobs.
+
+Each solution run by the job engine is recorded as JobMetricsModel:
+time spent in the task stack, wall-clock and CPU time of the sandboxed
+process and its peak RSS. Percentiles of the recent
+DJSOLVER_METRICS_WINDOW runs show which tasks are expensive; older runs
+are deleted.
+'''
+
+import math
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from .models import JobMetricsModel
+
+
+METRICS = ('queue_wait', 'wall_time', 'cpu_time', 'max_rss')
+
+PERCENTILES = (50, 95, 99)
+
+
+def record_job_metrics(task_id, status, queue_wait, usage):
+    '''Stores metrics of a solution run; usage is returned by run_sandboxed.'''
+    if not settings.DJSOLVER_RECORD_METRICS or not usage:
+        return
+    try:
+        JobMetricsModel.objects.create(task_id=task_id, status=status,
+                                       queue_wait=queue_wait,
+                                       wall_time=usage.get('wall_time'),
+                                       cpu_time=usage.get('cpu_time'),
+                                       max_rss=usage.get('max_rss'))
+        # Runs older than the window aren't used, they are deleted
+        stale = list(JobMetricsModel.objects.filter(task_id=task_id).order_by('-pk')
+                     .values_list('pk', flat=True)[settings.DJSOLVER_METRICS_WINDOW:][:1])
+        if stale:
+            JobMetricsModel.objects.filter(task_id=task_id, pk__lte=stale[0]).delete()
+    except DatabaseError:
+        # Metrics are not worth failing the job (e.g. the task was deleted)
+        pass
+
+
+def percentile(values, p):
+    '''Returns p-th percentile (nearest rank) of sorted values or None.'''
+    if not values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def get_task_metrics(task):
+    '''
+    Returns percentiles of metrics of recent runs of the task::
+
+        {'count': 10, 'wall_time': {'p50': 0.1, 'p95': 0.3, 'p99': 0.3}, ...}
+    '''
+    rows = list(JobMetricsModel.objects.filter(task=task).order_by('-created')
+                .values_list(*METRICS)[:settings.DJSOLVER_METRICS_WINDOW])
+    res = {'count': len(rows)}
+    for index, name in enumerate(METRICS):
+        values = sorted(row[index] for row in rows if row[index] is not None)
+        res[name] = dict(('p%s' % p, percentile(values, p)) for p in PERCENTILES)
+    return res
+
+
+def get_tasks_metrics(tasks):
+    '''
+    Returns {task pk: metrics} (see get_task_metrics) of the tasks, e.g.
+    of a page of the admin changelist; each task is read by a query limited
+    to DJSOLVER_METRICS_WINDOW rows.
+    '''
+    return dict((task.pk, get_task_metrics(task)) for task in tasks)
+
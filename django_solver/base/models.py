@@ -7,13 +7,17 @@ from mptt.models import MPTTModel, TreeForeignKey
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext as _
 from django_solver.base.errors import PYCODE_ERROR, DEFAULT_DICT_ERROR
+from django_solver.base import codecache, filecache, fragmentcache, templatecache
 from django.contrib.auth.models import User
 from django_solver.restrictions import restriction_pool
 
-__all__ = ['TemplateModel', 'PythonCodeModel', 'RegularTask', 'TaskCategory', 'RegularUserModel']
+__all__ = ['TemplateModel', 'PythonCodeModel', 'RegularTask', 'TaskCategory', 'RegularUserModel',
+           'TaskStackItemModel', 'JobStateModel', 'JobMetricsModel']
 
 
 @python_2_unicode_compatible
@@ -71,7 +75,7 @@ class PythonCodeModel(models.Model):
         if self.file:
             if os.path.isfile(self.file.path):
                 try:
-                    ast.parse(self.file.read().decode('utf-8'))
+                    ast.parse(filecache.read_file_content(self.file))
                 except:
                     raise ValidationError(PYCODE_ERROR)
 
@@ -82,6 +86,18 @@ class PythonCodeModel(models.Model):
                 raise ValidationError(PYCODE_ERROR)
 
 
+@receiver(post_save, sender=PythonCodeModel)
+@receiver(post_delete, sender=PythonCodeModel)
+def _invalidate_compiled_code(sender, instance, **kwargs):
+    codecache.invalidate_owner(instance.pk)
+
+
+@receiver(post_save, sender=TemplateModel)
+@receiver(post_delete, sender=TemplateModel)
+def _invalidate_compiled_template(sender, instance, **kwargs):
+    templatecache.invalidate_owner(instance.pk)
+
+
 @python_2_unicode_compatible
 class TaskModel(models.Model):
     formulation_template = models.OneToOneField(
@@ -159,6 +175,19 @@ class RegularTask(TaskModel):
         abstract = False
 
 
+@receiver(post_save, sender=RegularTask)
+@receiver(post_delete, sender=RegularTask)
+def _invalidate_task_fragments(sender, instance, **kwargs):
+    fragmentcache.invalidate_task(instance)
+
+
+@receiver(post_save, sender=TemplateModel)
+@receiver(post_delete, sender=TemplateModel)
+def _invalidate_template_fragments(sender, instance, **kwargs):
+    for task in RegularTask.objects.filter(formulation_template=instance):
+        fragmentcache.invalidate_task(task)
+
+
 @python_2_unicode_compatible
 class TaskCategory(MPTTModel):
     name = models.CharField(max_length=100, unique=True, default='')
@@ -197,3 +226,30 @@ class RegularUserModel(models.Model):
             if item.restriction in restriction_pool.keys():
               res.append(restriction_pool[item.restriction].status(**_kwargs))
         return all(res)
+
+
+class TaskStackItemModel(models.Model):
+    '''Job waiting in the task stack (see DatabaseTaskStack).'''
+    owner = models.CharField(verbose_name=_("Owner"), max_length=100,
+                             blank=True, default='', db_index=True)
+    weight = models.FloatField(verbose_name=_("Weight"), default=1)
+    payload = models.BinaryField(verbose_name=_("Payload"))
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class JobStateModel(models.Model):
+    '''State of a job stored by DatabaseTaskStack.'''
+    job_id = models.CharField(verbose_name=_("Job id"), max_length=32, primary_key=True)
+    state = models.TextField(verbose_name=_("State"))
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+
+class JobMetricsModel(models.Model):
+    '''Resources used by a solution of the task (see base.metrics).'''
+    task = models.ForeignKey(RegularTask, verbose_name=_("Problem"), related_name='metrics')
+    status = models.CharField(verbose_name=_("Status"), max_length=10)
+    queue_wait = models.FloatField(verbose_name=_("Queue wait, s"), null=True)
+    wall_time = models.FloatField(verbose_name=_("Wall time, s"), null=True)
+    cpu_time = models.FloatField(verbose_name=_("CPU time, s"), null=True)
+    max_rss = models.BigIntegerField(verbose_name=_("Peak RSS, bytes"), null=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
@@ -1,33 +1,100 @@
 
+from collections import OrderedDict
+from functools import partial
+
 from django.template.loader import get_template, render_to_string
-from django.template import Context, Template
-from django import forms
-from django.conf import settings
+
+from .engines import get_engine_name, compile_template, render_template, stream_template
+from .filecache import read_file_content
+from .fragmentcache import (get_cached_fragment, set_cached_fragment,
+							get_cached_fragments, set_cached_fragments,
+							get_cached_solution, set_cached_solution)
+from .models import RegularTask, TaskCategory
+from .schema import get_input_schema
+from .templatecache import get_compiled_template
 
 # 
 # simple_template = get_template('djsolver_simple_task.html') 
 # full_tempalte = get_template('djsolver_task.html')
 
 
+def _read_template(templobj):
+	if templobj.file:
+		try:
+			template = read_file_content(templobj.file)
+		except IOError:
+			# TODO: May be additional try to load from body is needed...
+			template = ''
+	elif templobj.body:
+		template = templobj.body
+	else:
+		template = ''
+	return template
+
+
+def _compile(templobj, source):
+	engine = get_engine_name(templobj.type)
+	compile_func = partial(compile_template, engine=engine,
+						   name='djsolver_template_%s' % templobj.pk)
+	return get_compiled_template(templobj.pk, source, compile_func, engine)
+
+
+def _solution_context(outputs):
+	context = dict(outputs) if isinstance(outputs, dict) else {}
+	context['OUTPUTS'] = outputs
+	return context
+
+
 class TaskRenderer:
 
 	def __init__(self, task, user=None, request=None):
 		self.task = task
 
 	def _get_template(self):
-		if self.task.formulation_template.file:
-			try:
-				self.task.formulation_template.file.seek(0)
-				template = self.task.formulation_template.file.read()
-				template = template.decode('utf-8')
-			except IOError:
-				# TODO: May be additional try to load from body is needed...
-				template = ''
-		elif self.task.formulation_template.body:
-			template = self.task.formulation_template.body
-		else:
-			template = ''
-		return template
+		return _read_template(self.task.formulation_template)
+
+	def _get_compiled_template(self, source=None):
+		'''Returns compiled formulation template; it is cached per process.
+
+		The template engine is chosen by the template type.
+		'''
+		if source is None:
+			source = self._get_template()
+		return _compile(self.task.formulation_template, source)
+
+	def render_solution(self, outputs):
+		'''Renders the solution template with outputs of the task code.
+
+		Values of OUTPUTS dictionary are available as template variables
+		as well as OUTPUTS itself. Rendered solutions are cached.
+		Returns None if the task has no solution template.
+		'''
+		templobj = self.task.solution_template
+		if templobj is None:
+			return
+		source = _read_template(templobj)
+		html = get_cached_solution(self.task, source, outputs)
+		if html is None:
+			html = render_template(_compile(templobj, source), _solution_context(outputs))
+			set_cached_solution(self.task, source, outputs, html)
+		return html
+
+	def stream_solution(self, outputs):
+		'''The same as render_solution, but yields rendered html by chunks.
+
+		Cached solutions are streamed as well, but streamed solutions
+		aren't cached, since they aren't kept in memory as a whole.
+		'''
+		templobj = self.task.solution_template
+		if templobj is None:
+			return
+		source = _read_template(templobj)
+		html = get_cached_solution(self.task, source, outputs)
+		if html is not None:
+			yield html
+			return
+		for chunk in stream_template(_compile(templobj, source), _solution_context(outputs)):
+			yield chunk
 
 	def render_simple(self):
 		'''Render the task instance with default values. No ability to input new values.
@@ -35,24 +102,122 @@ class TaskRenderer:
 		# Don't try to render non-public problems
 		if not self.task.public:
 			return
-		template = self._get_template()
-		temp = Template(template)
-		cont = Context(self.task.get_defaults)
-		return temp.render(cont)
+		# Public tasks are rendered the same way for all users
+		source = self._get_template()
+		html = get_cached_fragment(self.task, 'simple', source)
+		if html is None:
+			html = self._render_simple(source)
+			set_cached_fragment(self.task, 'simple', source, html)
+		return html
+
+	def _render_simple(self, source=None):
+		temp = self._get_compiled_template(source)
+		return render_template(temp, self.task.get_defaults)
+
+	def stream_simple(self):
+		'''The same as render_simple, but yields rendered html by chunks.
+
+		It could be passed to StreamingHttpResponse.
+		'''
+		if not self.task.public:
+			return
+		source = self._get_template()
+		html = get_cached_fragment(self.task, 'simple', source)
+		if html is not None:
+			yield html
+			return
+		temp = self._get_compiled_template(source)
+		for chunk in stream_template(temp, self.task.get_defaults):
+			yield chunk
 
 	def render_with_inputs(self):
 		if not self.task.public:
 			return
-		template = self._get_template()
+		source = self._get_template()
+		html = get_cached_fragment(self.task, 'inputs', source)
+		if html is None:
+			html = self._render_with_inputs(source)
+			set_cached_fragment(self.task, 'inputs', source, html)
+		return html
+
+	def _render_with_inputs(self, source=None):
+		return render_template(*self._get_inputs_template(source))
+
+	def stream_with_inputs(self):
+		'''The same as render_with_inputs, but yields rendered html by chunks.'''
+		if not self.task.public:
+			return
+		source = self._get_template()
+		html = get_cached_fragment(self.task, 'inputs', source)
+		if html is not None:
+			yield html
+			return
+		for chunk in stream_template(*self._get_inputs_template(source)):
+			yield chunk
+
+	def _get_inputs_template(self, source=None):
+		'''Returns compiled template and values with input widgets.'''
+		template = source if source is not None else self._get_template()
+		temp = self._get_compiled_template(template)
 		if template and self.task.defaults:
-			cur_fields = self.task.get_defaults
-			render_fields = cur_fields.copy()
-			for item in cur_fields.keys():
-				 field_widget = forms.TextInput(attrs={'id': '%s_%s'%(settings.DJSOLVER_TEXTINPUT_PREFIX, item)})
-				 render_fields[item] = field_widget.render(item, cur_fields[item])
-			cont = Context(render_fields)
+			# Widgets are rendered once per defaults revision
+			cont = dict((name, field.widget) for name, field in
+						get_input_schema(self.task).items())
 		else:
-			cont = Context()
-		temp = Template(template)
-		return temp.render(cont)
+			cont = {}
+		return temp, cont
+
+
+def _read_template_files(templobjs):
+	'''Reads file-backed templates in one pass; returns {template pk: source}.'''
+	res = {}
+	for templobj in templobjs:
+		if not templobj.file:
+			continue
+		try:
+			res[templobj.pk] = read_file_content(templobj.file)
+		except IOError:
+			res[templobj.pk] = ''
+	return res
+
+
+def render_tasks(tasks, with_inputs=False):
+	'''Renders a number of tasks at once.
+
+	:param tasks: queryset of RegularTask or TaskCategory; tasks of
+				  the category and its subcategories are rendered
+	:param with_inputs: render as render_with_inputs (else as render_simple)
 
+	Templates are loaded in the same query as tasks and cached fragments
+	are taken from the cache at once. Returns an ordered mapping
+	task -> html (None for non-public tasks).
+	'''
+	if isinstance(tasks, TaskCategory):
+		categories = tasks.get_descendants(include_self=True)
+		tasks = RegularTask.objects.filter(categories__in=categories).distinct().order_by('pk')
+	tasks = list(tasks.select_related('formulation_template'))
+	kind = 'inputs' if with_inputs else 'simple'
+	public = [task for task in tasks if task.public]
+	# Fragments are validated by template sources (see fragmentcache)
+	files = _read_template_files([task.formulation_template for task in public])
+	sources = dict((task.pk, files.get(task.formulation_template.pk,
+									   task.formulation_template.body or ''))
+				   for task in public)
+	cached = get_cached_fragments(public, kind, sources)
+	res = OrderedDict()
+	rendered = {}
+	for task in tasks:
+		if not task.public:
+			res[task] = None
+			continue
+		html = cached.get(task.pk)
+		if html is None:
+			renderer = TaskRenderer(task)
+			if with_inputs:
+				html = renderer._render_with_inputs(sources[task.pk])
+			else:
+				html = renderer._render_simple(sources[task.pk])
+			rendered[task] = html
+		res[task] = html
+	set_cached_fragments(rendered, kind, sources)
+	return res
@@ -0,0 +1,65 @@
+'''
+Cache of task solutions.
+
+Outputs are stored in Django cache DJSOLVER_RESULT_CACHE and keyed by
+the task pk, the task revision (its `updated` field), checksum of the task
+python sources and canonicalized inputs, so any change of the task or its
+code makes old results unreachable.
+'''
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def _get_cache():
+    alias = getattr(settings, 'DJSOLVER_RESULT_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def _jsonable(value):
+    # numpy arrays are represented by their dtype, shape and checksum of data
+    if hasattr(value, 'tobytes') and hasattr(value, 'dtype'):
+        return [str(value.dtype), list(value.shape),
+                hashlib.sha1(value.tobytes()).hexdigest()]
+    return str(value)
+
+
+def canonicalize_inputs(inputs):
+    '''Returns canonical json representation of input values.'''
+    return json.dumps(inputs, sort_keys=True, separators=(',', ':'), default=_jsonable)
+
+
+def get_result_key(task, inputs, sources):
+    '''Returns the cache key of outputs of the task.
+
+    :param sources: the task sources (see utils.get_task_sources); code
+                    models could be changed without the task revision
+    '''
+    revision = task.updated.isoformat() if task.updated else ''
+    digest = hashlib.sha1()
+    for name in ('preamble', 'code', 'postamble'):
+        digest.update(sources[name].encode('utf-8') + b'\0')
+    digest.update(canonicalize_inputs(inputs).encode('utf-8'))
+    return 'djsolver:result:%s:%s:%s' % (task.pk, revision, digest.hexdigest())
+
+
+def get_cached_result(key):
+    '''Returns cached outputs or None.'''
+    cache = _get_cache()
+    if cache is None:
+        return None
+    return cache.get(key)
+
+
+def set_cached_result(key, outputs):
+    '''Stores outputs to the cache; too big outputs aren't cached.'''
+    cache = _get_cache()
+    if cache is None:
+        return
+    max_size = settings.DJSOLVER_RESULT_CACHE_MAX_SIZE
+    if max_size and len(json.dumps(outputs)) > max_size:
+        return
+    cache.set(key, outputs, settings.DJSOLVER_RESULT_CACHE_TIMEOUT)
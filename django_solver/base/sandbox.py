@@ -0,0 +1,227 @@
+'''
+Sandbox for user code.
+
+Each run happens in a forked child process with limited CPU time (RLIMIT_CPU),
+address space (RLIMIT_AS) and size of created files (RLIMIT_FSIZE).
+The parent process watches the wall-clock time and kills the child
+when it is exceeded. Results are passed back through a pipe as JSON, so
+returned values should be json compatible; the parent doesn't unpickle
+anything the user code could forge.
+'''
+
+import json
+import os
+import re
+import select
+import signal
+import struct
+import sys
+import time
+import traceback
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from django.conf import settings
+
+
+SANDBOX_OK = 'ok'
+SANDBOX_ERROR = 'error'
+SANDBOX_TIMEOUT = 'timeout'
+SANDBOX_MEMORY = 'memory'
+
+_statuses = (SANDBOX_OK, SANDBOX_ERROR, SANDBOX_TIMEOUT, SANDBOX_MEMORY)
+
+# Results are sent by the child with their size, so they are read to the end
+# even if processes started by the user code keep the pipe open
+_header = struct.Struct('!Q')
+
+_size_pat = re.compile(r'^\s*(\d+)\s*([KMG]?)B?\s*$', re.I)
+
+_size_units = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+# ru_maxrss is measured in kilobytes on Linux and in bytes on Mac OS
+_rss_unit = 1 if sys.platform == 'darwin' else 1024
+
+
+def parse_size(value):
+    '''Converts size like 1M, 512K or 1024 to number of bytes.
+
+    Returns None if size could not be parsed.
+    '''
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return value
+    match = _size_pat.match(str(value))
+    if not match:
+        return None
+    return int(match.group(1)) * _size_units[match.group(2).upper()]
+
+
+def get_limits():
+    '''Returns sandbox limits defined by DJSOLVER_RESTRICTIONS_GLOBAL
+    and DJSOLVER_SANDBOX_MAX_FILE_SIZE.'''
+    restrictions = settings.DJSOLVER_RESTRICTIONS_GLOBAL
+    return {'time_limit': restrictions.get('MAX_EXECUTION_TIME'),
+            'memory_limit': parse_size(restrictions.get('MAX_MEMORY')),
+            'file_size_limit': parse_size(settings.DJSOLVER_SANDBOX_MAX_FILE_SIZE),
+            }
+
+
+def _set_limits(time_limit, memory_limit, file_size_limit):
+    if resource is None:
+        return
+    if time_limit:
+        resource.setrlimit(resource.RLIMIT_CPU, (int(time_limit), int(time_limit) + 1))
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    if file_size_limit:
+        resource.setrlimit(resource.RLIMIT_FSIZE, (file_size_limit, file_size_limit))
+
+
+def _child(func, args, limits, wfd):
+    try:
+        try:
+            _set_limits(**limits)
+            res = {'status': SANDBOX_OK, 'result': func(*args), 'error': None}
+        except MemoryError:
+            res = {'status': SANDBOX_MEMORY, 'result': None, 'error': None}
+        except Exception:
+            res = {'status': SANDBOX_ERROR, 'result': None,
+                   'error': traceback.format_exc()}
+        try:
+            data = json.dumps(res)
+        except MemoryError:
+            data = json.dumps({'status': SANDBOX_MEMORY, 'result': None, 'error': None})
+        except Exception:
+            data = json.dumps({'status': SANDBOX_ERROR, 'result': None,
+                               'error': traceback.format_exc()})
+        data = data.encode('utf-8')
+        with os.fdopen(wfd, 'wb') as pipe:
+            pipe.write(_header.pack(len(data)) + data)
+    finally:
+        os._exit(0)
+
+
+def _read_until(rfd, deadline):
+    '''
+    Reads the result sent by the child; returns None if deadline is exceeded
+    and an empty string if the pipe is closed before the whole result is sent.
+    '''
+    data = b''
+    size = None
+    while size is None or len(data) < _header.size + size:
+        timeout = None if deadline is None else deadline - time.time()
+        if timeout is not None and timeout <= 0:
+            return None
+        ready, _, _ = select.select([rfd], [], [], timeout)
+        if not ready:
+            return None
+        chunk = os.read(rfd, 65536)
+        if not chunk:
+            return b''
+        data += chunk
+        if size is None and len(data) >= _header.size:
+            size = _header.unpack(data[:_header.size])[0]
+    return data[_header.size:_header.size + size]
+
+
+def _kill_group(pgid):
+    # The child and processes started by it, unless they left the group
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def _wait_child(pid):
+    '''Waits for the child process; returns its exit status and resource usage.'''
+    if not hasattr(os, 'wait4'):
+        _, status = os.waitpid(pid, 0)
+        return status, {'cpu_time': None, 'max_rss': None}
+    _, status, rusage = os.wait4(pid, 0)
+    return status, {'cpu_time': rusage.ru_utime + rusage.ru_stime,
+                    'max_rss': rusage.ru_maxrss * _rss_unit}
+
+
+def _run_inline(func, args):
+    try:
+        return {'status': SANDBOX_OK, 'result': func(*args), 'error': None}
+    except MemoryError:
+        return {'status': SANDBOX_MEMORY, 'result': None, 'error': None}
+    except Exception:
+        return {'status': SANDBOX_ERROR, 'result': None,
+                'error': traceback.format_exc()}
+
+
+def run_sandboxed(func, args=(), time_limit=None, memory_limit=None, file_size_limit=None):
+    '''
+    Calls func(*args) in a child process with limited resources.
+
+    :param time_limit: CPU and wall-clock time limit, seconds
+    :param memory_limit: address space limit, bytes
+    :param file_size_limit: max size of files created by the code, bytes
+
+    Returns a dictionary with keys: 'status' (one of SANDBOX_OK, SANDBOX_ERROR,
+    SANDBOX_TIMEOUT and SANDBOX_MEMORY), 'result' (returned value of func,
+    it is passed as JSON),
+    'error' (traceback of the error if any) and 'usage' (resources used by
+    the child: 'wall_time' and 'cpu_time' in seconds, peak RSS 'max_rss'
+    in bytes; None if unknown).
+    '''
+    start = time.time()
+    if not hasattr(os, 'fork'):
+        # No way to isolate the code; limits aren't applied here.
+        res = _run_inline(func, args)
+        res['usage'] = {'wall_time': time.time() - start, 'cpu_time': None, 'max_rss': None}
+        return res
+
+    limits = {'time_limit': time_limit, 'memory_limit': memory_limit,
+              'file_size_limit': file_size_limit}
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        # The child leads a new process group, that is killed as a whole
+        os.setpgid(0, 0)
+        _child(func, args, limits, wfd)
+    try:
+        # The same in the parent, so the group exists before it is killed
+        os.setpgid(pid, pid)
+    except OSError:
+        pass
+    os.close(wfd)
+    deadline = time.time() + time_limit if time_limit else None
+    try:
+        data = _read_until(rfd, deadline)
+    finally:
+        os.close(rfd)
+    # Processes left by the code are killed too; the group id isn't reused
+    # until the child is waited for
+    _kill_group(pid)
+    status, usage = _wait_child(pid)
+    usage['wall_time'] = time.time() - start
+    res = _get_result(data, status)
+    res['usage'] = usage
+    return res
+
+
+def _get_result(data, status):
+    '''Returns the result sent by the child process with the exit status.'''
+    if data is None:
+        return {'status': SANDBOX_TIMEOUT, 'result': None, 'error': None}
+    if data:
+        try:
+            res = json.loads(data.decode('utf-8'))
+        except ValueError:
+            res = None
+        if isinstance(res, dict) and res.get('status') in _statuses:
+            return {'status': res['status'], 'result': res.get('result'),
+                    'error': res.get('error')}
+    if os.WIFSIGNALED(status) and os.WTERMSIG(status) in (signal.SIGXCPU, signal.SIGKILL):
+        return {'status': SANDBOX_TIMEOUT, 'result': None, 'error': None}
+    return {'status': SANDBOX_ERROR, 'result': None,
+            'error': 'Process terminated with status %s' % status}
@@ -0,0 +1,96 @@
+'''
+Fair-share scheduling of the task stack.
+
+Jobs are queued per owner (user). Owners are served by weighted fair
+queuing: each owner has a virtual time which grows by 1/weight on each
+dispatched job, and the owner with the least virtual time is served first.
+So a user flooding the stack doesn't delay jobs of other users,
+and users of a higher priority class get a bigger share of workers.
+'''
+
+from .stack import MemoryTaskStack
+
+
+class FairScheduler(object):
+    '''
+    Per-owner job queues with weighted fair queuing.
+
+    Queues are kept in the task stack storage (see :mod:`django_solver.base.stack`);
+    virtual times are local to the scheduler, so when the storage is shared,
+    each process serves owners fairly among the jobs it takes.
+
+    :param max_running_per_owner: max number of simultaneously running jobs
+                                  of the same owner (unlimited if None)
+    :param storage: task stack backend, MemoryTaskStack by default
+    '''
+
+    def __init__(self, max_running_per_owner=None, storage=None):
+        self.max_running_per_owner = max_running_per_owner
+        self.storage = storage if storage is not None else MemoryTaskStack()
+        self._vtime = {}
+        self._running = {}
+        self._active = set()
+
+    def push(self, owner, item, weight=1):
+        '''Appends the item to the queue of the owner.'''
+        if weight <= 0:
+            raise ValueError('weight should be positive')
+        self.storage.push(owner, weight, item)
+
+    def pop(self):
+        '''Returns (owner, item) of the next job to run or None.
+
+        The returned job is counted as running until release(owner) is called.
+        '''
+        heads = self.storage.heads()
+        self._update_vtime(heads)
+        while heads:
+            best = None
+            for owner, (order, weight) in heads.items():
+                if not self._can_run(owner):
+                    continue
+                key = (self._vtime[owner], order)
+                if best is None or key < best[0]:
+                    best = (key, owner)
+            if best is None:
+                return None
+            owner = best[1]
+            weight = heads.pop(owner)[1]
+            item = self.storage.pop(owner)
+            if item is None:
+                # The queue was emptied by another process
+                continue
+            self._vtime[owner] += 1.0 / weight
+            self._running[owner] = self._running.get(owner, 0) + 1
+            return owner, item
+        return None
+
+    def release(self, owner):
+        '''Marks a running job of the owner as finished.'''
+        count = self._running.get(owner, 0) - 1
+        if count > 0:
+            self._running[owner] = count
+        else:
+            self._running.pop(owner, None)
+
+    def running(self, owner):
+        return self._running.get(owner, 0)
+
+    def _can_run(self, owner):
+        return self.max_running_per_owner is None \
+            or self._running.get(owner, 0) < self.max_running_per_owner
+
+    def _update_vtime(self, heads):
+        active = [self._vtime[owner] for owner in heads if owner in self._active]
+        min_vtime = min(active) if active else 0.0
+        for owner in heads:
+            if owner not in self._active:
+                # Returning owners don't get credit for the time they were idle
+                self._vtime[owner] = max(self._vtime.get(owner, 0.0), min_vtime)
+        for owner in list(self._vtime):
+            if owner not in heads and owner not in self._running:
+                del self._vtime[owner]
+        self._active = set(heads)
+
+    def __len__(self):
+        return len(self.storage)
@@ -0,0 +1,109 @@
+'''
+Input schema of tasks.
+
+The schema is inferred from task defaults: each input field has a name,
+a type (one of utils.allowed_input_types or 'other'), a shape (scalar,
+1D or 2D array) and pre-rendered html of its widget. Array fields are
+edited in textareas, their values are separated by DJSOLVER_DATA_DELIMITER
+and DJSOLVER_DATA_ROW_DELIMITER.
+
+Schemas are cached per process (LRU, DJSOLVER_SCHEMA_CACHE_SIZE items) and
+keyed by the task pk and SHA1 of its defaults, so changed defaults
+produce a new schema.
+'''
+
+import hashlib
+from collections import OrderedDict, namedtuple
+
+from django import forms
+from django.conf import settings
+from django.utils import six
+
+from .caches import LRUCache
+
+
+SCALAR = 'scalar'
+ARRAY_1D = '1d'
+ARRAY_2D = '2d'
+
+# shape: () for scalars, (n,) for 1D and (rows, columns) for 2D arrays
+InputField = namedtuple('InputField', ['name', 'type', 'kind', 'shape', 'widget'])
+
+_cache = LRUCache(maxsize=settings.DJSOLVER_SCHEMA_CACHE_SIZE)
+
+
+def _scalar_type(value):
+    if isinstance(value, bool):
+        return 'other'
+    if isinstance(value, six.integer_types):
+        return 'integer'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, six.string_types):
+        return 'string'
+    return 'other'
+
+
+def _common_type(values):
+    types = set(_scalar_type(value) for value in values)
+    if not types or types == set(['integer']):
+        return 'integer'
+    if types <= set(['integer', 'float']):
+        return 'float'
+    if len(types) == 1:
+        return types.pop()
+    return 'other'
+
+
+def infer_field(value):
+    '''Returns (type, kind, shape) of the default value.'''
+    if not isinstance(value, (list, tuple)):
+        return _scalar_type(value), SCALAR, ()
+    if value and all(isinstance(row, (list, tuple)) for row in value):
+        cells = [cell for row in value for cell in row]
+        columns = max(len(row) for row in value)
+        return _common_type(cells), ARRAY_2D, (len(value), columns)
+    return _common_type(value), ARRAY_1D, (len(value),)
+
+
+def _array_to_text(value, kind):
+    delimiter = settings.DJSOLVER_DATA_DELIMITER
+    if kind == ARRAY_1D:
+        return delimiter.join(six.text_type(cell) for cell in value)
+    return settings.DJSOLVER_DATA_ROW_DELIMITER.join(
+        delimiter.join(six.text_type(cell) for cell in row) for row in value)
+
+
+def _render_widget(name, value, kind):
+    attrs = {'id': '%s_%s' % (settings.DJSOLVER_TEXTINPUT_PREFIX, name)}
+    if kind == SCALAR:
+        return forms.TextInput(attrs=attrs).render(name, value)
+    return forms.Textarea(attrs=attrs).render(name, _array_to_text(value, kind))
+
+
+def build_input_schema(defaults):
+    '''Returns OrderedDict name -> InputField for the defaults dictionary.'''
+    schema = OrderedDict()
+    if not isinstance(defaults, dict):
+        return schema
+    for name in sorted(defaults, key=six.text_type):
+        value = defaults[name]
+        dtype, kind, shape = infer_field(value)
+        schema[name] = InputField(name, dtype, kind, shape, _render_widget(name, value, kind))
+    return schema
+
+
+def get_input_schema(task):
+    '''Returns the input schema of the task; it is cached per process.'''
+    if task.pk is None:
+        return build_input_schema(task.get_defaults)
+    key = (task.pk, hashlib.sha1(task.defaults.encode('utf-8')).hexdigest())
+    schema = _cache.get(key)
+    if schema is None:
+        schema = build_input_schema(task.get_defaults)
+        _cache.set(key, schema)
+    return schema
+
+
+def clear():
+    _cache.clear()
@@ -16,9 +16,94 @@ DJSOLVER_RESTRICTIONS_GLOBAL = {
                                 'MAX_EXECUTION_TIME': 600,
                                 'MAX_FIELD_LENGTH': 10000,
                                 'MAX_FILE_SIZE': '1M',
+                                'MAX_MEMORY': '512M',
+                                # Max running jobs of a single user (None is unlimited)
+                                'MAX_PROCESSES_PER_USER': None,
                                 }
 
+# Max size of files created by task code in the sandbox (RLIMIT_FSIZE,
+# None is unlimited); MAX_FILE_SIZE restriction limits uploaded input data
+DJSOLVER_SANDBOX_MAX_FILE_SIZE = '1M'
+
+# Priority classes of users: (name, weight). Users get a share
+# of workers proportional to the weight of their class.
+DJSOLVER_PRIORITY_CLASSES = (('normal', 1),
+                             ('high', 4),
+                             ('low', 0.25),
+                             )
+
+DJSOLVER_DEFAULT_PRIORITY_CLASS = 'normal'
+
 DJSOLVER_TEXTINPUT_PREFIX = 'djs_inputs'
 
 DJSOLVER_DATA_DELIMITER = ','
-DJSOLVER_DATA_ROW_DELIMITER = '\n'
\ No newline at end of file
+DJSOLVER_DATA_ROW_DELIMITER = '\n'
+
+# Finished jobs are kept in the task stack during this time (seconds)
+DJSOLVER_JOB_LIFETIME = 3600
+
+# Compiled task code: max number of code objects kept in each process
+# and a directory to store them on disk (disabled if None)
+DJSOLVER_CODE_CACHE_SIZE = 256
+DJSOLVER_CODE_CACHE_DIR = None
+
+# Cache of solutions: alias of Django cache (disabled if None), lifetime
+# of cached results (seconds) and max size of cached outputs (json, bytes).
+# Number of entries is limited by the cache backend (e.g. MAX_ENTRIES option).
+DJSOLVER_RESULT_CACHE = 'default'
+DJSOLVER_RESULT_CACHE_TIMEOUT = 3600
+DJSOLVER_RESULT_CACHE_MAX_SIZE = 65536
+
+# Max number of input sets in a batch job
+DJSOLVER_MAX_BATCH_SIZE = 1000
+
+# Max time a status request waits for the job state change (seconds)
+DJSOLVER_STATUS_WAIT_TIMEOUT = 30
+
+# Modules imported by every worker process at its start. Jobs are forked
+# from workers, so these imports are not repeated for every solution.
+DJSOLVER_WORKER_PRELOAD = ()
+
+# Storage of the task stack: django_solver.base.stack.MemoryTaskStack (a single
+# process), DatabaseTaskStack or RedisTaskStack (shared between processes).
+DJSOLVER_TASK_STACK = {
+    'BACKEND': 'django_solver.base.stack.MemoryTaskStack',
+    'OPTIONS': {},
+}
+
+# How often (seconds) shared task stacks are checked for new jobs and states.
+# Shared stacks don't notify about changes of job states: every waiting status
+# request and every batch stream polls the storage at this interval, so each
+# open client costs one storage read per interval.
+DJSOLVER_TASK_STACK_POLL_INTERVAL = 0.5
+
+# Record execution metrics of jobs (see django_solver.base.metrics)
+DJSOLVER_RECORD_METRICS = True
+
+# Number of recent runs of a task used to compute metrics percentiles
+DJSOLVER_METRICS_WINDOW = 1000
+
+# Max number of compiled templates kept by each process
+DJSOLVER_TEMPLATE_CACHE_SIZE = 256
+
+# Directory of compiled Jinja2 templates (bytecode isn't stored if None)
+DJSOLVER_JINJA_BYTECODE_CACHE_DIR = None
+
+# Django cache of rendered formulations of public tasks (disabled if None)
+DJSOLVER_FRAGMENT_CACHE = 'default'
+
+DJSOLVER_FRAGMENT_CACHE_TIMEOUT = 3600
+
+# Approximate size (characters) of chunks yielded by streaming rendering
+DJSOLVER_STREAM_CHUNK_SIZE = 8192
+
+# Size (bytes) of chunks of uploaded input data converted at once
+DJSOLVER_UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Max number of task input schemas kept by each process
+DJSOLVER_SCHEMA_CACHE_SIZE = 256
+
+# Cache of template and code files: max total size of cached contents
+# (characters) and min size of files read through mmap (bytes, None to disable)
+DJSOLVER_FILE_CACHE_MAX_SIZE = 16 * 1024 ** 2
+DJSOLVER_FILE_CACHE_MMAP_THRESHOLD = 1024 ** 2
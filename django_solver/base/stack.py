@@ -0,0 +1,309 @@
+'''
+Storage backends of the task stack.
+
+The task stack keeps queued jobs in per-owner queues (the order in which
+owners are served is decided by :class:`~django_solver.base.scheduler.FairScheduler`)
+and, for backends shared between processes, states of jobs, so a job
+could be queried from any process. The backend is chosen by
+DJSOLVER_TASK_STACK setting::
+
+    DJSOLVER_TASK_STACK = {
+        'BACKEND': 'django_solver.base.stack.RedisTaskStack',
+        'OPTIONS': {'host': 'localhost', 'port': 6379},
+    }
+'''
+
+import json
+import pickle
+import socket
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min, Max
+from django.utils import six, timezone
+from django.utils.module_loading import import_string
+
+
+class BaseTaskStack(object):
+    '''
+    Interface of task stack backends.
+
+    Items are pushed to queues of their owners; each item has
+    an order (items pushed earlier have lower order) and the weight
+    of the owner.
+    '''
+
+    # Whether the stack is shared between processes
+    shared = False
+
+    def push(self, owner, weight, item):
+        '''Appends the item to the queue of the owner.'''
+        raise NotImplementedError
+
+    def pop(self, owner):
+        '''Removes and returns the first item of the owner or None.'''
+        raise NotImplementedError
+
+    def heads(self):
+        '''Returns {owner: (order, weight)} of first items of non-empty queues.'''
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def save_state(self, job_id, state):
+        '''Stores the job state (json compatible dictionary).'''
+
+    def load_state(self, job_id):
+        '''Returns the stored job state or None.'''
+        return None
+
+
+class MemoryTaskStack(BaseTaskStack):
+    '''Task stack of a single process; used by default and in tests.'''
+
+    def __init__(self, **options):
+        self._queues = {}
+        self._order = 0
+
+    def push(self, owner, weight, item):
+        self._order += 1
+        self._queues.setdefault(owner, deque()).append((self._order, weight, item))
+
+    def pop(self, owner):
+        queue = self._queues.get(owner)
+        if not queue:
+            return None
+        item = queue.popleft()[2]
+        if not queue:
+            del self._queues[owner]
+        return item
+
+    def heads(self):
+        return dict((owner, queue[0][:2]) for owner, queue in self._queues.items())
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+
+class DatabaseTaskStack(BaseTaskStack):
+    '''
+    Task stack stored in the database.
+
+    Items are taken with row locking; if the database supports
+    SELECT ... FOR UPDATE SKIP LOCKED, locked rows are skipped,
+    so processes don't wait for each other. Job states expire after
+    DJSOLVER_JOB_LIFETIME seconds.
+    '''
+
+    shared = True
+
+    # Min time between deletions of expired job states (seconds)
+    purge_interval = 60
+
+    def __init__(self, **options):
+        from .models import TaskStackItemModel, JobStateModel
+        self.item_model = TaskStackItemModel
+        self.state_model = JobStateModel
+        self._purged = 0
+
+    def push(self, owner, weight, item):
+        self.item_model.objects.create(owner=owner, weight=weight,
+                                       payload=pickle.dumps(item, protocol=2))
+
+    def pop(self, owner):
+        while True:
+            with transaction.atomic():
+                queryset = self.item_model.objects.filter(owner=owner).order_by('pk')
+                if getattr(connection.features, 'has_select_for_update_skip_locked', False):
+                    queryset = queryset.select_for_update(skip_locked=True)
+                elif connection.features.has_select_for_update:
+                    queryset = queryset.select_for_update()
+                rows = list(queryset[:1])
+                if not rows:
+                    return None
+                # Without row locking (e.g. SQLite) the item could be taken
+                # by another process meanwhile; the next one is tried then.
+                deleted = self.item_model.objects.filter(pk=rows[0].pk).delete()[0]
+            if deleted:
+                return pickle.loads(bytes(rows[0].payload))
+
+    def heads(self):
+        rows = self.item_model.objects.values('owner').annotate(order=Min('pk'),
+                                                                weight=Max('weight'))
+        return dict((row['owner'], (row['order'], row['weight'])) for row in rows)
+
+    def __len__(self):
+        return self.item_model.objects.count()
+
+    def save_state(self, job_id, state):
+        self.state_model.objects.update_or_create(job_id=job_id,
+                                                  defaults={'state': json.dumps(state)})
+        # States of jobs expire after DJSOLVER_JOB_LIFETIME, like in Redis;
+        # expired rows are deleted from time to time
+        now = time.time()
+        if now - self._purged > self.purge_interval:
+            self._purged = now
+            self.state_model.objects.filter(updated__lt=self._expiry()).delete()
+
+    def load_state(self, job_id):
+        try:
+            row = self.state_model.objects.get(job_id=job_id, updated__gte=self._expiry())
+        except self.state_model.DoesNotExist:
+            return None
+        return json.loads(row.state)
+
+    def _expiry(self):
+        return timezone.now() - timedelta(seconds=settings.DJSOLVER_JOB_LIFETIME)
+
+
+class RedisError(IOError):
+    pass
+
+
+class RedisConnection(object):
+    '''Minimal thread safe client of the Redis protocol (RESP).'''
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, timeout=None):
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection(self.address, self.timeout)
+        self._file = self._sock.makefile('rb')
+        if self.password:
+            self._execute('AUTH', self.password)
+        if self.db:
+            self._execute('SELECT', self.db)
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._file.close()
+                self._sock.close()
+                self._sock = self._file = None
+
+    def execute(self, *args):
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            try:
+                return self._execute(*args)
+            except (socket.error, IOError) as e:
+                if isinstance(e, RedisError):
+                    raise
+                self._sock = self._file = None
+                raise
+
+    def _execute(self, *args):
+        parts = [b'*' + str(len(args)).encode('ascii') + b'\r\n']
+        for arg in args:
+            if isinstance(arg, six.text_type):
+                arg = arg.encode('utf-8')
+            elif not isinstance(arg, bytes):
+                arg = str(arg).encode('ascii')
+            parts.append(b'$' + str(len(arg)).encode('ascii') + b'\r\n' + arg + b'\r\n')
+        self._sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise socket.error('Connection closed')
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body
+        if kind == b'-':
+            raise RedisError(body.decode('utf-8'))
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            length = int(body)
+            if length < 0:
+                return None
+            return self._file.read(length + 2)[:-2]
+        if kind == b'*':
+            length = int(body)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError('Unknown reply: %r' % line)
+
+
+class RedisTaskStack(BaseTaskStack):
+    '''
+    Task stack stored in Redis (or any server speaking its protocol).
+
+    Options: host, port, db, password, timeout and prefix of keys.
+    '''
+
+    shared = True
+
+    def __init__(self, prefix='djsolver', **options):
+        self.prefix = prefix
+        self.connection = RedisConnection(**options)
+
+    def _key(self, *parts):
+        return ':'.join((self.prefix,) + parts)
+
+    def push(self, owner, weight, item):
+        order = self.connection.execute('INCR', self._key('seq'))
+        # Queues hold only orders and weights, so heads() doesn't read payloads
+        self.connection.execute('SET', self._key('item', str(order)),
+                                pickle.dumps(item, protocol=2))
+        self.connection.execute('RPUSH', self._key('queue', owner), json.dumps([order, weight]))
+        self.connection.execute('SADD', self._key('owners'), owner)
+
+    def pop(self, owner):
+        head = self.connection.execute('LPOP', self._key('queue', owner))
+        if head is None or not self.connection.execute('LLEN', self._key('queue', owner)):
+            self._forget_owner(owner)
+        if head is None:
+            return None
+        key = self._key('item', str(json.loads(head.decode('utf-8'))[0]))
+        data = self.connection.execute('GET', key)
+        self.connection.execute('DEL', key)
+        return pickle.loads(data)
+
+    def _forget_owner(self, owner):
+        # Owner is re-added if an item was pushed concurrently
+        self.connection.execute('SREM', self._key('owners'), owner)
+        if self.connection.execute('LLEN', self._key('queue', owner)):
+            self.connection.execute('SADD', self._key('owners'), owner)
+
+    def heads(self):
+        res = {}
+        for owner in self.connection.execute('SMEMBERS', self._key('owners')):
+            owner = owner.decode('utf-8')
+            head = self.connection.execute('LINDEX', self._key('queue', owner), 0)
+            if head is not None:
+                res[owner] = tuple(json.loads(head.decode('utf-8')))
+        return res
+
+    def __len__(self):
+        owners = self.connection.execute('SMEMBERS', self._key('owners'))
+        return sum(self.connection.execute('LLEN', self._key('queue', owner.decode('utf-8')))
+                   for owner in owners)
+
+    def save_state(self, job_id, state):
+        self.connection.execute('SET', self._key('job', job_id), json.dumps(state),
+                                'EX', int(settings.DJSOLVER_JOB_LIFETIME))
+
+    def load_state(self, job_id):
+        data = self.connection.execute('GET', self._key('job', job_id))
+        return json.loads(data.decode('utf-8')) if data is not None else None
+
+
+def get_task_stack():
+    '''Creates the task stack backend defined by DJSOLVER_TASK_STACK.'''
+    config = settings.DJSOLVER_TASK_STACK
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
@@ -0,0 +1,59 @@
+'''
+Cache of compiled (parsed) templates of tasks.
+
+Template objects are kept in-process (LRU, DJSOLVER_TEMPLATE_CACHE_SIZE items)
+and keyed by the TemplateModel pk, the template engine and SHA1 of
+the template source, so a changed template is never taken from the cache.
+Entries of a TemplateModel are evicted when the instance is saved or deleted.
+'''
+
+import hashlib
+import threading
+
+from django.conf import settings
+
+from .caches import LRUCache
+
+
+_cache = LRUCache(maxsize=settings.DJSOLVER_TEMPLATE_CACHE_SIZE)
+
+# TemplateModel pk -> keys of the templates compiled for it
+_owners = {}
+_owners_lock = threading.Lock()
+
+
+def get_template_key(owner, source, engine):
+    digest = hashlib.sha1(source.encode('utf-8')).hexdigest()
+    return (owner, engine, digest)
+
+
+def get_compiled_template(owner, source, compile_func, engine='django'):
+    '''
+    Returns the template compiled from the source by compile_func(source).
+
+    :param owner: pk of the TemplateModel instance the source belongs to
+    :param engine: name of the template engine, a part of the key
+    '''
+    key = get_template_key(owner, source, engine)
+    template = _cache.get(key)
+    if template is None:
+        template = compile_func(source)
+        _cache.set(key, template)
+        if owner is not None:
+            with _owners_lock:
+                _owners.setdefault(owner, set()).add(key)
+    return template
+
+
+def invalidate_owner(owner):
+    '''Evicts entries compiled for the TemplateModel instance.'''
+    with _owners_lock:
+        keys = _owners.pop(owner, ())
+    for key in keys:
+        _cache.pop(key)
+
+
+def clear():
+    _cache.clear()
+    with _owners_lock:
+        _owners.clear()
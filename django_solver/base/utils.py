@@ -2,14 +2,34 @@ try:
     from solver.base import Solver, Task
 except ImportError:
     pass
+try:
+    import numpy as np
+except ImportError:
+    np = None
 import ast
+import codecs
+import io
+import itertools
+import json
+import math
 import re
+import struct
+from collections import namedtuple
+from functools import partial
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
 from django.db import transaction
+from django.http import QueryDict
+from django.utils import six
+from django.utils.datastructures import MultiValueDict
 
+from . import errors
+from .filecache import read_file_content
 from .models import RegularTask, TemplateModel, PythonCodeModel
+from .sandbox import parse_size
 
 
 
@@ -61,20 +81,24 @@ def regtask_from_solver(task_solver, store_template_to_file=False, store_code_to
     return rt
 
 
-def solver_from_regtask(regtask, silent=True):
+def _get_content(obj):
+    '''Return the content of a template or python code model instance.'''
+    if obj.file and not obj.body:
+        return read_file_content(obj.file)
+    return obj.body
+
+
+def get_task_sources(regtask, silent=True):
+    '''
+    Collects all sources of a regular task into a dictionary.
+
+    The dictionary holds the task formulation ('content'), 'solution_template',
+    parsed 'defaults', python sources: 'preamble', 'code' and 'postamble',
+    and 'ids' of PythonCodeModel instances these sources come from.
+    '''
     if not isinstance(regtask, RegularTask):
         raise TypeError("task should be an instance of the RegularTask class") 
 
-    # try to create a solvertask from body based inputs
-    
-    if regtask.formulation_template:
-        if regtask.formulation_template.file and not regtask.formulation_template.body:
-            task_content = regtask.formulation_template.file.read().decode('utf-8')
-        else:
-            task_content = regtask.formulation_template.body
-    else:
-        task_content = ''
-
     if regtask.defaults:
         if silent:
             try:
@@ -86,49 +110,63 @@ def solver_from_regtask(regtask, silent=True):
     else:
         task_defvals = None
 
-    if regtask.code:
-        if regtask.code.file and not regtask.code.body:
-            task_code = regtask.code.file.read().decode('utf-8')
-        else:
-            task_code = regtask.code.body
-    else:
-        task_code = ''
-
-    if regtask.solution_template:
-        if regtask.solution_template.file and not regtask.solution_template.body:
-            task_soltempl = regtask.solution_template.file.read().decode('utf-8')
-        else:
-            task_soltempl = regtask.solution_template.body
-    else:
-        task_soltempl = None
+    return {
+        'content': _get_content(regtask.formulation_template) if regtask.formulation_template else '',
+        'solution_template': _get_content(regtask.solution_template) if regtask.solution_template else None,
+        'defaults': task_defvals,
+        'code': _get_content(regtask.code) if regtask.code else '',
+        'preamble': _get_content(regtask.code_preamble) if regtask.code_preamble else '',
+        'postamble': _get_content(regtask.code_postamble) if regtask.code_postamble else '',
+        'ids': {'code': regtask.code_id,
+                'preamble': regtask.code_preamble_id,
+                'postamble': regtask.code_postamble_id,
+                },
+    }
 
-    if regtask.code_preamble:
-        if regtask.code_preamble.file and not regtask.code_preamble.body:
-            solver_preamble = regtask.code_preamble.file.read().decode('utf-8')
-        else:
-            solver_preamble = regtask.code_preamble.body
-    else:
-        solver_preamble = ''
 
-    if regtask.code_postamble:
-        if regtask.code_postamble.file and not regtask.code_postamble.body:
-            solver_postamble = regtask.code_postamble.file.read().decode('utf-8')
-        else:
-            solver_postamble = regtask.code_postamble.body
-    else:
-        solver_postamble = ''
-
-    atask = Task(task_content, solution_template=task_soltempl,
-                 default_vals=task_defvals,
-                 code=task_code
+def solver_from_regtask(regtask, silent=True):
+    sources = get_task_sources(regtask, silent=silent)
+    atask = Task(sources['content'],
+                 solution_template=sources['solution_template'],
+                 default_vals=sources['defaults'],
+                 code=sources['code']
                  )
     asolver = Solver(atask,
-                     preamble=solver_preamble,
-                     postamble=solver_postamble
+                     preamble=sources['preamble'],
+                     postamble=sources['postamble']
                      )
     return atask, asolver
 
 
+def validate_inputs(regtask, inputs):
+    '''
+    Validates input values sent for the task.
+
+    Inputs should be a dictionary with keys from the task defaults;
+    length of each value is limited by MAX_FIELD_LENGTH restriction.
+    Returns task defaults updated by inputs or None if inputs are not valid.
+    '''
+    if not isinstance(inputs, dict):
+        return None
+    defaults = regtask.get_defaults
+    if not isinstance(defaults, dict):
+        return None
+    if any(key not in defaults for key in inputs):
+        return None
+    max_length = settings.DJSOLVER_RESTRICTIONS_GLOBAL['MAX_FIELD_LENGTH']
+    for value in inputs.values():
+        if np is not None and isinstance(value, np.ndarray):
+            # Arrays are read by read_input_data and limited by MAX_FILE_SIZE
+            continue
+        if not isinstance(value, six.string_types):
+            value = json.dumps(value, default=str)
+        if len(value) > max_length:
+            return None
+    res = defaults.copy()
+    res.update(inputs)
+    return res
+
+
 
 
 # ---------- Input data validation and conversion -------------------
@@ -139,80 +177,905 @@ integer_value_pat = re.compile(r'[+-]?\d+')
 
 allowed_input_types = ['float', 'integer', 'string']
 
+# float64 represents integers exactly up to this value
+_MAX_EXACT_INTEGER = 2 ** 53
 
-def validate(input_data, input_type):
-    pass
 
+def _in_range(value, input_type):
+    '''
+    Whether the number (text) could be converted to the type: floats
+    shouldn't overflow float64, integers should be exact in float64.
+    '''
+    number = float(value)
+    if input_type == 'integer':
+        return abs(number) < _MAX_EXACT_INTEGER
+    return not math.isinf(number)
 
-def  _strictly_validate_numericals(input_data, dtype):
 
-    if dtype == 'integer':
-        cpat = integer_value_pat
-    elif dtype == 'float':
-        cpat = float_value_pat
-    else:
-        return False
-    
-    def _single_integer_check(single):
-        # empty input data not allowed in strictly validation
-        if len(single) == 0:
-            return False
-        if cpat.match(single):
-            return True
+def validate(input_data, input_type=None):
+    '''
+    Validates input data by smart_validate and converts them.
+
+    Returns numpy array (see convert_to_array) or None if data are invalid.
+    '''
+    return convert_to_array(input_data, smart_validate(input_data, input_type))
+
+
+# Non-empty quoted string or unquoted text without quotes
+string_value_pat = re.compile(r''''[^']+'|"[^"]+"|[^'"\s][^'"]*''')
+
+_value_pats = {'integer': integer_value_pat,
+               'float': float_value_pat,
+               'string': string_value_pat}
+
+_token_pats = {}
+
+
+class ValidationResult(namedtuple('ValidationResult', ['valid', 'shape', 'row', 'col'])):
+    '''
+    Result of input data validation; it is true if the data are valid.
+
+    shape is () for single values, (n,) for rows and (rows, columns) for
+    matrices; row and col are positions of the first bad value (counted
+    from 0, blank rows are counted too).
+    '''
+
+    def __bool__(self):
+        return self.valid
+
+    __nonzero__ = __bool__
+
+    @property
+    def error(self):
+        if self.valid:
+            return None
+        return errors.INPUT_VALUE_ERROR % {'row': self.row + 1, 'col': self.col + 1}
+
+
+def _get_token_pat(input_type):
+    delimiter = re.escape(settings.DJSOLVER_DATA_DELIMITER)
+    row_delimiter = re.escape(settings.DJSOLVER_DATA_ROW_DELIMITER)
+    key = (input_type, delimiter, row_delimiter)
+    if key not in _token_pats:
+        separator = '%s|%s' % (row_delimiter, delimiter)
+        value_pat = _value_pats[input_type].pattern
+        if input_type == 'string':
+            # Unquoted strings end at delimiters
+            value_pat = value_pat.replace('[^\'"]*', '(?:(?!%s)[^\'"])*' % separator)
+        _token_pats[key] = re.compile(
+            r'(?P<row>%s)|(?P<delimiter>%s)|(?P<space>(?:(?!%s)\s)+)'
+            r'|(?P<value>%s)|(?P<bad>(?:(?!%s).)+)' % (row_delimiter, delimiter, row_delimiter,
+                                                    value_pat, separator), re.S)
+    return _token_pats[key]
+
+
+def _tokenize_validate(input_data, input_type):
+    # Tokens are scanned once; the state is the current position and
+    # the number of columns in the first row
+    row, col, columns, rows = 0, 0, None, 0
+    has_value = has_delimiter = False
+    for match in _get_token_pat(input_type).finditer(input_data):
+        kind = match.lastgroup
+        if kind == 'space':
+            continue
+        if kind == 'value':
+            if has_value or (columns is not None and col >= columns):
+                return ValidationResult(False, None, row, col)
+            if input_type != 'string' and not _in_range(match.group(kind), input_type):
+                return ValidationResult(False, None, row, col)
+            has_value = True
+        elif kind == 'delimiter':
+            if not has_value:
+                return ValidationResult(False, None, row, col)
+            has_delimiter = True
+            col += 1
+            has_value = False
+        elif kind == 'row':
+            if has_value:
+                if columns is None:
+                    columns = col + 1
+                elif col + 1 != columns:
+                    return ValidationResult(False, None, row, col + 1)
+                rows += 1
+            elif col:
+                return ValidationResult(False, None, row, col)
+            row += 1
+            col = 0
+            has_value = False
         else:
-            return False
-    
-    def _integer_row_validation(row):
-        datalist = row.split(settings.DJSOLVER_DATA_DELIMITER)
-        return True if all(map(_single_integer_check, datalist)) else False
-    
-    if input_data.count(settings.DJSOLVER_DATA_DELIMITER) == 0\
-        and input_data.count(settings.DJSOLVER_DATA_ROW_DELIMITER) == 0:
-        return _single_integer_check(input_data)
-
-    # 1D array checking ... It is just a row
-    elif input_data.count(settings.DJSOLVER_DATA_DELIMITER) > 0\
-        and input_data.count(settings.DJSOLVER_DATA_ROW_DELIMITER) == 0:
-        return _integer_row_validation(input_data)
-
-    # 2d array checking ... It is just few rows
-    elif input_data.count(settings.DJSOLVER_DATA_DELIMITER) > 0\
-        and input_data.count(settings.DJSOLVER_DATA_ROW_DELIMITER) > 0:
-        rows = input_data.split(settings.DJSOLVER_DATA_ROW_DELIMITER)
-        return True if all(map(_integer_row_validation, rows)) else False
+            return ValidationResult(False, None, row, col)
+    if has_value:
+        if columns is None:
+            columns = col + 1
+        elif col + 1 != columns:
+            return ValidationResult(False, None, row, col + 1)
+        rows += 1
+    elif col or not rows:
+        return ValidationResult(False, None, row, col)
+    if rows > 1:
+        shape = (rows, columns)
+    elif has_delimiter:
+        shape = (columns,)
     else:
-        return False
-
+        shape = ()
+    return ValidationResult(True, shape, None, None)
 
 
 def strict_validate(input_data, input_type):
-    if input_type == 'string':
-        return True if input_data else False
-    elif input_type == 'float':
-        return _strictly_validate_integers(input_data, 'float')
-    elif input_type == 'integer':
-        return _strictly_validate_integers(input_data, 'integer')
+    '''
+    Validates input data of the type: 'integer', 'float' or 'string'.
+
+    Data are a single value, a row of values separated by
+    DJSOLVER_DATA_DELIMITER or rows separated by DJSOLVER_DATA_ROW_DELIMITER.
+    Values are stripped, blank rows are skipped; all rows should have the same
+    number of values and empty values aren't allowed. Numbers should be
+    in range of the type (see _in_range). Strings in arrays could be quoted.
+
+    Returns ValidationResult.
+    '''
+    if input_type not in _value_pats:
+        return ValidationResult(False, None, 0, 0)
+    return _tokenize_validate(input_data, input_type)
+
+
+class DataDescriptor(namedtuple('DataDescriptor',
+                                  ['valid', 'shape', 'dtype', 'columns', 'missing', 'bad'])):
+    '''
+    Description of input data made by smart_validate; it is true if the data
+    are valid.
+
+    dtype is the type of values: 'integer', 'float' or 'string'; columns
+    are types of columns of 2D data (None for columns without values) or
+    (dtype,) for single values and 1D data. missing is the number of empty
+    cells (short rows are completed by empty cells), bad is the number of
+    values not of the requested type and numbers out of range (outside
+    string columns). The descriptor could be passed to
+    convert_to_array instead of input_type.
+    '''
+
+    def __bool__(self):
+        return self.valid
+
+    __nonzero__ = __bool__
+
+
+_smart_token_pats = {}
+
+# Kinds of cells; None is a missing cell, 'overflow' is a number out of
+# float64 range, 'inexact' is a whole number which isn't exact in float64
+_cell_kinds = ('integer', 'float', 'string', None, 'overflow', 'inexact')
+
+
+def _get_smart_token_pat():
+    delimiter = re.escape(settings.DJSOLVER_DATA_DELIMITER)
+    row_delimiter = re.escape(settings.DJSOLVER_DATA_ROW_DELIMITER)
+    key = (delimiter, row_delimiter)
+    if key not in _smart_token_pats:
+        space = r'(?:(?!%s)\s)' % row_delimiter
+        # Values are numbers only if they fill the whole cell, so values
+        # are always separated by delimiters
+        end = r'(?=%s*(?:%s|%s|\Z))' % (space, row_delimiter, delimiter)
+        _smart_token_pats[key] = re.compile(
+            r'(?P<row>%s)|(?P<delimiter>%s)|(?P<space>%s+)'
+            r'|(?P<integer>%s)%s|(?P<float>%s)%s|(?P<quoted>\'[^\']*\'|"[^"]*")%s'
+            r'|(?P<string>(?:(?!%s|%s).)+)' % (row_delimiter, delimiter, space,
+                                               integer_value_pat.pattern, end,
+                                               float_value_pat.pattern, end, end,
+                                               row_delimiter, delimiter), re.S)
+    return _smart_token_pats[key]
+
+
+def _scan_rows(input_data):
+    '''
+    Yields rows of input data as lists of (kind, value) cells.
+
+    kind is 'integer' (floats without fractional part too), 'float',
+    'string', None for missing cells or, by the same range rules as of
+    conversion (see _in_range), 'overflow' for numbers out of float64 range
+    and 'inexact' for whole numbers which aren't exact in float64; values of
+    quoted strings are unquoted. Blank rows are skipped.
+    '''
+    row, cell = [], None
+    for match in itertools.chain(_get_smart_token_pat().finditer(input_data), [None]):
+        kind = match.lastgroup if match is not None else 'row'
+        if kind == 'space':
+            continue
+        if kind == 'delimiter' or kind == 'row':
+            if kind == 'row' and not row and cell is None:
+                continue  # blank row
+            row.append(cell or (None, ''))
+            cell = None
+            if kind == 'row':
+                yield row
+                row = []
+            continue
+        value = match.group(kind)
+        if kind in ('integer', 'float'):
+            if not _in_range(value, 'float'):
+                kind = 'overflow'
+            elif float(value).is_integer():
+                kind = 'integer' if _in_range(value, 'integer') else 'inexact'
+        elif kind == 'quoted':
+            value = value[1:-1]
+            if not value:
+                continue  # empty string is a missing cell
+            kind = 'string'
+        elif kind == 'string':
+            value = value.strip()
+        cell = (kind, value)
+
+
+def smart_validate(input_data, input_type=None):
+    '''
+    Infers types of values, the shape and missing cells of input data in one scan.
+
+    Values are integers (floats without fractional part too), floats or
+    strings (quoted or not); the type of a column is the narrowest type of its
+    values. Blank rows are skipped.
+
+    :param input_type: 'integer', 'float' or 'string'; if it is defined, data
+                       are valid if less than half of values are bad, i.e.
+                       not of the type (they are excluded from 1D arrays and
+                       are nan in 2D arrays by convert_to_array)
+    Numbers out of range of the type (see _in_range) are bad values too, but
+    they make data invalid, unless they are in string columns.
+    Returns DataDescriptor.
+    '''
+    # Counts of cells of each kind (see _cell_kinds) by columns
+    counts = []
+    rows = cells = columns = 0
+    for row in _scan_rows(input_data):
+        for col, (kind, _) in enumerate(row):
+            if col == len(counts):
+                counts.append([0, 0, 0, 0, 0, 0])
+            counts[col][_cell_kinds.index(kind)] += 1
+        rows += 1
+        cells += len(row)
+        columns = max(columns, len(row))
+        has_delimiter = len(row) > 1
+    # Inexact whole numbers are floats
+    types = [_column_type(column[0], column[1] + column[5], column[2])
+             for column in counts[:columns]]
+    totals = [sum(column[i] for column in counts) for i in range(6)]
+    present = sum(totals) - totals[3]
+    missing = totals[3] + rows * columns - cells
+    dtype = _column_type(totals[0], totals[1] + totals[5], totals[2]) or 'integer'
+    if rows > 1:
+        shape = (rows, columns)
+    elif rows == 1 and has_delimiter:
+        shape = (columns,)
     else:
-        return False
-    
+        shape = () if rows else (0,)
+    if input_type is None:
+        bad = 0
+    elif input_type in _value_pats:
+        bad = {'integer': totals[1] + totals[2], 'float': totals[2], 'string': 0}[input_type]
+        dtype = input_type
+        types = [input_type if column_type is not None else None for column_type in types]
+    else:
+        return DataDescriptor(False, shape, None, None, missing, present)
+    # Numbers out of range of the column type are bad unless they are kept
+    # as strings
+    column_types = types if rows > 1 else [dtype] * len(counts)
+    overflows = sum(column[4] + (column[5] if column_type == 'integer' else 0)
+                    for column, column_type in zip(counts, column_types)
+                    if column_type != 'string')
+    bad += overflows
+    valid = (bad * 2 < present or not rows) and not overflows
+    return DataDescriptor(valid, shape, dtype, tuple(types) if rows > 1 else (dtype,),
+                          missing, bad)
+
+
+def _column_type(integers, floats, strings):
+    if strings:
+        return 'string'
+    if floats:
+        return 'float'
+    if integers:
+        return 'integer'
+    return None
+
+# Numerical cell with optional spaces around it
+_float_cell_pat = re.compile(r'\s*(?:%s)\s*\Z' % float_value_pat.pattern)
+
+
+def _parse_cells(cells, fast=True):
+    '''
+    Parses string cells to float64 array in bulk.
+
+    Returns the array and a mask of numerical cells (None if all cells are
+    numerical). Empty cells are removed, values of other bad cells are nan,
+    numbers out of float64 range are inf.
+    '''
+    if fast:
+        try:
+            values = np.array(cells, dtype=np.float64)
+        except ValueError:
+            pass
+        else:
+            # float() also accepts nan and inf, they aren't valid values
+            if np.isfinite(values).all():
+                return values, None
+    cells = [cell for cell in cells if cell.strip()]
+    mask = np.array([_float_cell_pat.match(cell) is not None for cell in cells], dtype=bool)
+    values = np.full(len(cells), np.nan)
+    if mask.any():
+        values[mask] = np.array([cell for cell, valid in zip(cells, mask) if valid],
+                                dtype=np.float64)
+    return values, mask
+
+
+def _integral(values):
+    return (values == np.floor(values)) & (np.abs(values) < _MAX_EXACT_INTEGER)
+
+
+def _split_2d(rows, fast):
+    delimiter = settings.DJSOLVER_DATA_DELIMITER
+    columns = rows[0].count(delimiter) + 1
+    if fast and all(row.count(delimiter) + 1 == columns for row in rows):
+        # All rows are parsed at once
+        values, mask = _parse_cells(delimiter.join(rows).split(delimiter))
+        if mask is None:
+            return values.reshape(len(rows), columns), None
+    parsed = [_parse_cells(row.split(delimiter), fast=False) for row in rows]
+    if len(set(len(values) for values, _ in parsed)) != 1:
+        return None, None
+    return np.vstack([values for values, _ in parsed]), np.vstack([mask for _, mask in parsed])
+
+
+def convert_to_array(input_data, input_type=None):
+    '''
+    Converts delimited input data to numpy array.
+
+    Single values are converted to 0-d arrays, rows of values separated by
+    DJSOLVER_DATA_DELIMITER to 1D arrays and rows separated by
+    DJSOLVER_DATA_ROW_DELIMITER to 2D arrays, so the shape and dtype of the
+    data are the shape and dtype of the array. Values are parsed in bulk.
+
+    :param input_type: 'integer' or 'float'; if it isn't defined, values are
+                       integers if at least most of them are integral. It
+                       could be DataDescriptor made by smart_validate, then
+                       strings and 2D data with missing cells are converted
+                       too (see _convert_described).
+    Returns int64 or float64 array or None if data could not be converted
+    or any number is out of range (see _in_range). In 1D arrays bad and
+    non-integral (for integers) values are excluded, in 2D arrays of floats
+    bad values are nan.
+    '''
+    if np is None:
+        raise ImproperlyConfigured('numpy is required to convert input data')
+    if isinstance(input_type, DataDescriptor):
+        return _convert_described(input_data, input_type)
+    # float() accepts underscores in numbers, so such data are parsed by cells
+    fast = '_' not in input_data
+    rows = [row for row in input_data.split(settings.DJSOLVER_DATA_ROW_DELIMITER) if row.strip()]
+    if not rows:
+        return np.array([], dtype=np.float64)
+    if len(rows) > 1:
+        values, mask = _split_2d(rows, fast)
+        if values is None or np.isinf(values).any():
+            return None
+        valid = values if mask is None else values[mask]
+        if not valid.size:
+            return None
+        integral = mask is None and _integral(values).all()
+        if input_type == 'integer' and not integral:
+            return None
+        if input_type != 'float' and integral:
+            return values.astype(np.int64)
+        return values
+    values, mask = _parse_cells(rows[0].split(settings.DJSOLVER_DATA_DELIMITER), fast)
+    if np.isinf(values).any():
+        return None
+    if mask is not None:
+        values = values[mask]
+        if not values.size:
+            return None
+    integral = _integral(values)
+    if input_type == 'integer' or (input_type is None and (~integral).sum() * 2 < values.size):
+        if (np.abs(values[values == np.floor(values)]) >= _MAX_EXACT_INTEGER).any():
+            # Integers which aren't exact in float64
+            return None
+        values = values[integral].astype(np.int64)
+    if settings.DJSOLVER_DATA_DELIMITER not in rows[0]:
+        return values.reshape(()) if values.size == 1 else None
+    return values
+
+
+def _convert_column(cells, column_type):
+    if column_type == 'string':
+        return np.array([value for _, value in cells])
+    values = np.array([float(value) if kind in ('integer', 'float', 'inexact') else np.nan
+                       for kind, value in cells])
+    if column_type == 'integer':
+        values[~_integral(values)] = np.nan
+        if not np.isnan(values).any():
+            return values.astype(np.int64)
+    return values
+
+
+def _convert_described(input_data, descriptor):
+    '''
+    Converts input data by their descriptor.
+
+    Numbers without missing and bad cells are converted by convert_to_array
+    in bulk. Other data are split into cells by the same scan as
+    smart_validate does: strings are converted to arrays of strings, missing
+    and bad values are excluded from 1D arrays; 2D data are converted by
+    columns: missing and bad cells of numerical columns are nan, string
+    columns make a structured array with a field per column.
+    '''
+    if not descriptor.valid:
+        return None
+    shape = descriptor.shape
+    if shape == (0,):
+        return np.array([], dtype=np.float64)
+    if descriptor.dtype != 'string' and not (descriptor.missing or descriptor.bad):
+        return convert_to_array(input_data, descriptor.dtype)
+    rows = list(_scan_rows(input_data))
+    if len(shape) < 2:
+        kinds = {'integer': ('integer',), 'float': ('integer', 'float', 'inexact'),
+                 'string': ('integer', 'float', 'string', 'overflow', 'inexact')}[descriptor.dtype]
+        values = _convert_column([cell for cell in rows[0] if cell[0] in kinds], descriptor.dtype)
+        return values.reshape(()) if shape == () else values
+    arrays = []
+    for index, column_type in enumerate(descriptor.columns):
+        cells = [row[index] if index < len(row) else (None, '') for row in rows]
+        arrays.append(_convert_column(cells, column_type or 'float'))
+    if 'string' not in descriptor.columns:
+        return np.column_stack(arrays)
+    res = np.empty(len(rows), dtype=[('f%s' % i, array.dtype) for i, array in enumerate(arrays)])
+    for i, array in enumerate(arrays):
+        res['f%s' % i] = array
+    return res
 
-def smart_validate(input_data, input_type):
-    pass
 
 def convert(input_data):
-    ''' Performs smart data conversion procedure. '''
-    
-    pass
+    ''' Performs smart data conversion procedure.
+
+    Returns a number, a list or a list of lists of numbers (see
+    convert_to_array) or None.
+    '''
+    array = convert_to_array(input_data)
+    return None if array is None else array.tolist()
 # -------------------------------------------------------------------
 
+
+class InputDataError(ValueError):
+    '''Input data are invalid or too large; the message is shown to the user.'''
+
+    def __init__(self, message, row=None, col=None):
+        super(InputDataError, self).__init__(message)
+        self.message = message
+        self.row = row
+        self.col = col
+
+
+def _value_error(row, col):
+    return InputDataError(errors.INPUT_VALUE_ERROR % {'row': row + 1, 'col': col + 1}, row, col)
+
+
+def _columns(shape):
+    return shape[-1] if shape else 1
+
+
+class DataStreamConverter(object):
+    '''
+    Validates and converts input data fed by chunks.
+
+    Complete rows of each chunk are validated by strict_validate and
+    converted at once; complete cells of the incomplete last row are
+    converted too, so only the incomplete last cell and converted values
+    are kept. The result is the same as of convert_to_array for valid data.
+
+    :param input_type: 'integer', 'float' or None (integers if all values
+                       are integral, floats otherwise)
+    :param max_size: max size of data (bytes or characters)
+    '''
+
+    def __init__(self, input_type=None, max_size=None):
+        if input_type not in ('integer', 'float', None):
+            raise InputDataError(errors.INPUT_TYPE_ERROR)
+        if np is None:
+            raise ImproperlyConfigured('numpy is required to convert input data')
+        self.input_type = input_type
+        self.max_size = max_size
+        self.size = 0
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._dtype = np.int64 if input_type == 'integer' else np.float64
+        self._tail = ''
+        self._row = 0  # the first row of the tail; blank rows are counted too
+        self._rows = 0
+        self._shape = None
+        self._values = []
+        # Converted cells of the incomplete row
+        self._cells = []
+        self._cells_count = 0
+
+    def feed(self, chunk):
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            raise InputDataError(errors.INPUT_SIZE_ERROR)
+        if isinstance(chunk, bytes):
+            try:
+                chunk = self._decoder.decode(chunk)
+            except UnicodeDecodeError:
+                raise _value_error(self._row, 0)
+        data = self._tail + chunk
+        row_delimiter = settings.DJSOLVER_DATA_ROW_DELIMITER
+        end = data.rfind(row_delimiter)
+        if end >= 0:
+            self._convert(data[:end])
+            data = data[end + len(row_delimiter):]
+        delimiter = settings.DJSOLVER_DATA_DELIMITER
+        end = data.rfind(delimiter)
+        if end >= 0:
+            self._convert_cells(data[:end])
+            data = data[end + len(delimiter):]
+        self._tail = data
+
+    def _convert_cells(self, text):
+        # Converts complete cells of the incomplete row
+        result = strict_validate(text, self.input_type or 'float')
+        if not result:
+            raise _value_error(self._row, self._cells_count + result.col)
+        cells = text.split(settings.DJSOLVER_DATA_DELIMITER)
+        values, index = self._parse(cells)
+        if values is None:
+            raise _value_error(self._row, self._cells_count + index)
+        self._cells.append(values)
+        self._cells_count += len(cells)
+
+    def _finish_row(self, text):
+        # Converts the rest of the row whose first cells are converted
+        self._convert_cells(text)
+        columns = self._cells_count
+        if self._shape is None:
+            self._shape = (columns,)
+        elif columns != _columns(self._shape):
+            raise _value_error(self._row, min(columns, _columns(self._shape)))
+        self._values.extend(self._cells)
+        self._rows += 1
+        self._row += 1
+        self._cells = []
+        self._cells_count = 0
+
+    def _convert(self, block):
+        row_delimiter = settings.DJSOLVER_DATA_ROW_DELIMITER
+        if self._cells:
+            text, delimiter, block = block.partition(row_delimiter)
+            self._finish_row(text)
+            if not delimiter:
+                return
+        first_row, self._row = self._row, self._row + block.count(row_delimiter) + 1
+        if not block.strip():
+            return
+        result = strict_validate(block, self.input_type or 'float')
+        if not result:
+            raise _value_error(first_row + result.row, result.col)
+        rows = [row for row in block.split(row_delimiter) if row.strip()]
+        if self._shape is None:
+            self._shape = result.shape
+        elif _columns(result.shape) != _columns(self._shape):
+            # The first row of the block differs from previous rows
+            first_row += next(i for i, row in enumerate(block.split(row_delimiter)) if row.strip())
+            raise _value_error(first_row, min(_columns(result.shape), _columns(self._shape)))
+        delimiter = settings.DJSOLVER_DATA_DELIMITER
+        cells = delimiter.join(rows).split(delimiter)
+        values, index = self._parse(cells)
+        if values is None:
+            lines = [i for i, row in enumerate(block.split(row_delimiter)) if row.strip()]
+            columns = _columns(result.shape)
+            raise _value_error(first_row + lines[index // columns], index % columns)
+        self._values.append(values)
+        self._rows += len(rows)
+
+    def _parse(self, cells):
+        # Returns values of cells or None and the index of the first cell
+        # out of range: integers out of int64 range, floats parsed as inf
+        try:
+            values = np.array(cells, dtype=self._dtype)
+        except (OverflowError, ValueError):
+            return None, next(i for i, cell in enumerate(cells) if not self._is_convertible(cell))
+        finite = np.isfinite(values)
+        if finite.all():
+            return values, None
+        return None, int(np.argmin(finite))
+
+    def _is_convertible(self, cell):
+        try:
+            np.array([cell], dtype=self._dtype)
+        except (OverflowError, ValueError):
+            return False
+        return True
+
+    def close(self):
+        '''Converts the rest of data and returns numpy array.'''
+        try:
+            self._tail += self._decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            raise _value_error(self._row, 0)
+        self._convert(self._tail)
+        self._tail = ''
+        if not self._rows:
+            raise _value_error(0, 0)
+        values = np.concatenate(self._values)
+        self._values = []
+        if self.input_type is None and _integral(values).all():
+            values = values.astype(np.int64)
+        if self._rows > 1:
+            return values.reshape(self._rows, -1)
+        return values.reshape(self._shape)
+
+
+# Content types of binary input data
+NPY_CONTENT_TYPE = 'application/x-npy'
+RAW_CONTENT_TYPE = 'application/octet-stream'
+
+# dtypes of raw buffers: little-endian integers and floats
+RAW_DTYPES = {'int32': '<i4', 'int64': '<i8', 'float32': '<f4', 'float64': '<f8'}
+
+_npy_magic = b'\x93NUMPY'
+
+
+class BinaryDataReader(object):
+    '''
+    Reads numpy array from .npy data or a raw buffer fed by chunks.
+
+    The buffer is allocated once for the shape and dtype declared for
+    a raw buffer or read from the .npy header; the array is a view of it
+    (np.frombuffer), so data aren't parsed or copied again. Arrays of more than
+    two dimensions, non-numeric dtypes and not finite values are rejected
+    as well as text data.
+
+    :param dtype: one of RAW_DTYPES; None for .npy data
+    :param shape: shape of a raw buffer
+    :param max_size: max size of data (bytes)
+    '''
+
+    def __init__(self, dtype=None, shape=None, max_size=None):
+        if np is None:
+            raise ImproperlyConfigured('numpy is required to convert input data')
+        self.max_size = max_size
+        self.size = 0
+        self._header = b''
+        self._buffer = None
+        self._pos = 0
+        if dtype is not None:
+            if dtype not in RAW_DTYPES:
+                raise InputDataError(errors.INPUT_TYPE_ERROR)
+            self._allocate(np.dtype(RAW_DTYPES[dtype]), shape, False)
+
+    def _allocate(self, dtype, shape, fortran_order):
+        if dtype.hasobject or dtype.kind not in 'iuf' or len(shape) > 2 or min(shape or (0,)) < 0:
+            raise InputDataError(errors.INPUT_TYPE_ERROR)
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        if self.max_size is not None and nbytes > self.max_size:
+            raise InputDataError(errors.INPUT_SIZE_ERROR)
+        self.dtype, self.shape, self.fortran_order = dtype, tuple(shape), fortran_order
+        self._buffer = bytearray(nbytes)
+
+    def _read_header(self):
+        # Returns data following the .npy header if it is complete
+        header = self._header
+        if len(header) < 12:
+            return None
+        if not header.startswith(_npy_magic) or header[6:7] not in (b'\x01', b'\x02'):
+            raise InputDataError(errors.INPUT_TYPE_ERROR)
+        if header[6:7] == b'\x01':
+            start = 10 + struct.unpack('<H', header[8:10])[0]
+            read_header = np.lib.format.read_array_header_1_0
+        else:
+            start = 12 + struct.unpack('<I', header[8:12])[0]
+            read_header = np.lib.format.read_array_header_2_0
+        if len(header) < start:
+            return None
+        fp = io.BytesIO(header[:start])
+        np.lib.format.read_magic(fp)
+        try:
+            shape, fortran_order, dtype = read_header(fp)
+        except ValueError:
+            raise InputDataError(errors.INPUT_TYPE_ERROR)
+        self._allocate(dtype, shape, fortran_order)
+        self._header = b''
+        return header[start:]
+
+    def feed(self, chunk):
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            raise InputDataError(errors.INPUT_SIZE_ERROR)
+        if self._buffer is None:
+            self._header += chunk
+            chunk = self._read_header()
+            if chunk is None:
+                return
+        end = self._pos + len(chunk)
+        if end > len(self._buffer):
+            raise InputDataError(errors.INPUT_SIZE_ERROR)
+        memoryview(self._buffer)[self._pos:end] = chunk
+        self._pos = end
+
+    def close(self):
+        '''Returns numpy array of the data.'''
+        if self._buffer is None or self._pos != len(self._buffer):
+            raise InputDataError(errors.INPUT_TYPE_ERROR)
+        array = np.frombuffer(self._buffer, dtype=self.dtype)
+        array = array.reshape(self.shape, order='F' if self.fortran_order else 'C')
+        if array.dtype.kind == 'f' and not np.isfinite(array).all():
+            raise InputDataError(errors.INPUT_TYPE_ERROR)
+        return array
+
+
+def _parse_shape(value):
+    try:
+        return tuple(int(size) for size in value.split(',') if size.strip())
+    except ValueError:
+        raise InputDataError(errors.INPUT_TYPE_ERROR)
+
+
+def _get_reader(params, max_size, content_type=None, file_name=None):
+    '''Returns a reader (converter) of input data: .npy, raw buffer or text.'''
+    if content_type == NPY_CONTENT_TYPE or (file_name or '').endswith('.npy'):
+        return BinaryDataReader(max_size=max_size)
+    if params.get('dtype'):
+        return BinaryDataReader(params['dtype'], _parse_shape(params.get('shape', '')), max_size)
+    return DataStreamConverter(params.get('input-type') or None, max_size)
+
+
+class DataUploadHandler(FileUploadHandler):
+    '''
+    Converts uploaded 'input-data' file while it is received.
+
+    The reader is chosen by the file type (see read_input_data).
+    The file isn't stored; the result is kept in the data attribute, errors
+    (too large or invalid data) stop the upload and are kept in error.
+    '''
+
+    def __init__(self, request=None, params=None, max_size=None):
+        super(DataUploadHandler, self).__init__(request)
+        self.params = params or {}
+        self.max_size = max_size
+        self.converter = None
+        self.data = None
+        self.error = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if self.max_size is not None and content_length and content_length > self.max_size:
+            # The request isn't read at all
+            self.error = InputDataError(errors.INPUT_SIZE_ERROR)
+            return QueryDict(encoding=encoding), MultiValueDict()
+
+    def new_file(self, field_name, *args, **kwargs):
+        super(DataUploadHandler, self).new_file(field_name, *args, **kwargs)
+        if field_name == 'input-data':
+            try:
+                self.converter = _get_reader(self.params, self.max_size,
+                                             self.content_type, self.file_name)
+            except InputDataError as e:
+                self.error = e
+                raise StopUpload(connection_reset=True)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.field_name != 'input-data':
+            return None
+        try:
+            self.converter.feed(raw_data)
+        except InputDataError as e:
+            self.error = e
+            raise StopUpload(connection_reset=True)
+        return None
+
+    def file_complete(self, file_size):
+        if self.field_name == 'input-data':
+            try:
+                self.data = self.converter.close()
+            except InputDataError as e:
+                self.error = e
+        return None
+
+
+def set_upload_handler(request):
+    '''
+    Makes the 'input-data' file of a multipart request be converted while
+    it is received (see DataUploadHandler).
+
+    It should be called before request.POST is read, e.g. before CSRF checks
+    (see views.load_data). Returns the handler or None if the request isn't
+    multipart or has been already parsed.
+    '''
+    if get_content_type(request) != 'multipart/form-data':
+        return None
+    max_size = parse_size(settings.DJSOLVER_RESTRICTIONS_GLOBAL.get('MAX_FILE_SIZE'))
+    handler = DataUploadHandler(request, request.GET, max_size)
+    try:
+        request.upload_handlers = [handler]
+    except AttributeError:
+        # The upload has been already processed (by CSRF middleware)
+        return None
+    return handler
+
+
+def _convert_chunks(chunks, converter):
+    for chunk in chunks:
+        converter.feed(chunk)
+    return converter.close()
+
+
+def get_content_type(request):
+    return request.META.get('CONTENT_TYPE', '').split(';')[0].strip().lower()
+
+
+def read_input_data(request):
+    '''
+    Returns the task id and input data of the request as numpy array.
+
+    Input data are sent as:
+
+    * 'input-data' form field, up to MAX_FIELD_LENGTH characters;
+    * 'input-data' file of a multipart request or the request body
+      of text/plain (text/csv), application/x-npy or application/octet-stream
+      type, up to MAX_FILE_SIZE bytes. They are converted by chunks while
+      they are received and rejected as soon as the size limit is exceeded.
+
+    Text data are converted by DataStreamConverter. .npy files (and bodies)
+    and raw little-endian buffers are read by BinaryDataReader; raw buffers
+    require 'dtype' (see RAW_DTYPES) and 'shape' (sizes separated by commas)
+    query parameters.
+
+    'task-id' and 'input-type' ('integer' or 'float') are taken from the query
+    string or the form. Raises InputDataError if input data are invalid
+    or too large. Multipart files are converted while they are received only
+    if the form isn't read before (see set_upload_handler), otherwise they
+    are converted after the upload.
+    '''
+    restrictions = settings.DJSOLVER_RESTRICTIONS_GLOBAL
+    max_size = parse_size(restrictions.get('MAX_FILE_SIZE'))
+    chunk_size = settings.DJSOLVER_UPLOAD_CHUNK_SIZE
+
+    content_type = get_content_type(request)
+    if content_type in ('text/plain', 'text/csv', NPY_CONTENT_TYPE, RAW_CONTENT_TYPE):
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if max_size is not None and content_length > max_size:
+            raise InputDataError(errors.INPUT_SIZE_ERROR)
+        if content_type == RAW_CONTENT_TYPE and not request.GET.get('dtype'):
+            raise InputDataError(errors.INPUT_TYPE_ERROR)
+        reader = _get_reader(request.GET, max_size, content_type)
+        chunks = iter(partial(request.read, chunk_size), b'')
+        return request.GET.get('task-id'), _convert_chunks(chunks, reader)
+
+    handler = None
+    if content_type == 'multipart/form-data':
+        handler = next((handler for handler in request.upload_handlers
+                        if isinstance(handler, DataUploadHandler)), None)
+        if handler is None:
+            handler = set_upload_handler(request)
+    post = request.POST  # it is parsed here, unless it was done before
+    taskid = request.GET.get('task-id') or post.get('task-id')
+    if handler is not None:
+        if handler.error is not None:
+            raise handler.error
+        if handler.converter is not None:
+            return taskid, handler.data
+    upload = request.FILES.get('input-data')
+    if upload is not None:
+        if max_size is not None and upload.size > max_size:
+            raise InputDataError(errors.INPUT_SIZE_ERROR)
+        reader = _get_reader(request.GET, max_size, upload.content_type, upload.name)
+        return taskid, _convert_chunks(upload.chunks(chunk_size), reader)
+    input_data_str = post.get('input-data', '')
+    if len(input_data_str) > restrictions['MAX_FIELD_LENGTH']:
+        raise InputDataError(errors.INPUT_SIZE_ERROR)
+    input_type = request.GET.get('input-type') or post.get('input-type') or None
+    return taskid, _convert_chunks([input_data_str], DataStreamConverter(input_type))
+
+
 def get_data_form_request(request):
+    '''
+    Returns the task id and input data of the ajax request (see read_input_data).
+
+    Returns None if the request isn't ajax.
+    '''
     # request should be ajax only
     if not request.is_ajax():
         return None
-
-    taskid = request.POST.get('task-id', None)
-    input_data_str = request.POST.get('input-data', None)
-    
-    
-    
-    
\ No newline at end of file
+    return read_input_data(request)
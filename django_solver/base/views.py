@@ -1,4 +1,17 @@
 
+import json
+
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+from .engine import get_engine
+from .errors import (TASK_NOT_FOUND_ERROR, INPUTS_ERROR, BATCH_SIZE_ERROR,
+                     BATCH_TIMEOUT_ERROR, JOB_NOT_FOUND_ERROR, REQUEST_METHOD_ERROR)
+from .models import RegularTask, RegularUserModel
+from .utils import (validate_inputs, read_input_data, set_upload_handler, get_content_type,
+                    InputDataError, NPY_CONTENT_TYPE, RAW_CONTENT_TYPE)
+from django_solver.restrictions.models import PriorityModel
 
 
 # -------------------- TASK STACK -------------------------
@@ -7,20 +20,234 @@
 # 3) In order to put to task-stack, the problem should pass validation process
 
 
+_FORM_CONTENT_TYPES = ('multipart/form-data', 'application/x-www-form-urlencoded')
+
+
+def _error_response(message, status=200):
+    return JsonResponse({'error': 1, 'message': message}, status=status)
 
 
-    
-def load_data():
-    pass
+def _get_payload(request):
+    '''Returns request data: json encoded body or POST dictionary.
+
+    Bodies of forms aren't read as json, so uploaded files aren't buffered.
+    '''
+    payload = None
+    if get_content_type(request) not in _FORM_CONTENT_TYPES:
+        try:
+            payload = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            pass
+    if isinstance(payload, dict):
+        return payload
+    payload = request.POST.dict()
+    if 'inputs' in payload:
+        try:
+            payload['inputs'] = json.loads(payload['inputs'])
+        except ValueError:
+            payload['inputs'] = None
+    return payload
+
 
+def _get_task(payload):
+    try:
+        return RegularTask.objects.get(pk=payload.get('task-id'))
+    except (RegularTask.DoesNotExist, ValueError, TypeError):
+        return None
+
+
+def _get_owner(request):
+    '''Returns the job owner (RegularUserModel pk) and its weight.
+
+    All anonymous users share the same owner None.
+    '''
+    default_weight = dict(settings.DJSOLVER_PRIORITY_CLASSES)[settings.DJSOLVER_DEFAULT_PRIORITY_CLASS]
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated():
+        return None, default_weight
+    try:
+        reguser = RegularUserModel.objects.get(user=user)
+    except RegularUserModel.DoesNotExist:
+        return None, default_weight
+    try:
+        return reguser.pk, reguser.priority.weight
+    except PriorityModel.DoesNotExist:
+        return reguser.pk, default_weight
+
+
+def _get_data_payload(request):
+    '''Returns payload of a request with input data (see utils.read_input_data).
+
+    The array is the value of the 'input-name' (query parameter or form
+    field) input.
+    '''
+    taskid, data = read_input_data(request)
+    name = request.GET.get('input-name') or request.POST.get('input-name')
+    return {'task-id': taskid, 'inputs': {name: data}}
+
+
+@csrf_exempt
+def load_data(request):
+    '''
+    Convert uploaded input data, load and append to solution stack a task.
+
+    Input data are sent as the request body or 'input-data' file or field
+    (see utils.read_input_data). Uploaded files are converted while they are
+    received, so the upload handler is installed before the CSRF check reads
+    the form; the check is made by _load_data.
+    '''
+    if request.method != 'POST':
+        return _error_response(REQUEST_METHOD_ERROR, status=405)
+    set_upload_handler(request)
+    return _load_data(request)
+
+
+@csrf_protect
+def _load_data(request):
+    try:
+        payload = _get_data_payload(request)
+    except InputDataError as e:
+        return _error_response(e.message)
+    return _submit(request, payload)
 
 
 def load_task(request):
     '''
     Validate, load and append to solution stack a task
     '''
-    
-    
+    if request.method != 'POST':
+        return _error_response(REQUEST_METHOD_ERROR, status=405)
+    if get_content_type(request) in (NPY_CONTENT_TYPE, RAW_CONTENT_TYPE):
+        try:
+            payload = _get_data_payload(request)
+        except InputDataError as e:
+            return _error_response(e.message)
+    else:
+        payload = _get_payload(request)
+    return _submit(request, payload)
+
+
+def _submit(request, payload):
+    task = _get_task(payload)
+    if task is None:
+        return _error_response(TASK_NOT_FOUND_ERROR)
+    inputs = validate_inputs(task, payload.get('inputs', {}))
+    if inputs is None:
+        return _error_response(INPUTS_ERROR)
+    engine = get_engine()
+    owner, weight = _get_owner(request)
+    state = engine.status(engine.submit(task, inputs, owner=owner, weight=weight))
+    state['error'] = 0
+    return JsonResponse(state)
+
+
+def _batch_timeout(size):
+    '''Max time (seconds) to stream results of a batch job or None.
+
+    Items are solved one by one, each within MAX_EXECUTION_TIME; the job
+    could also wait in the task stack for DJSOLVER_STATUS_WAIT_TIMEOUT.
+    '''
+    time_limit = settings.DJSOLVER_RESTRICTIONS_GLOBAL.get('MAX_EXECUTION_TIME')
+    if time_limit is None:
+        return None
+    return time_limit * size + settings.DJSOLVER_STATUS_WAIT_TIMEOUT
+
+
+def load_batch(request):
+    '''
+    Solve a task for a list of inputs.
+
+    Results are streamed back as json lines: the first line is the job state,
+    the following ones are states of items as soon as they are solved.
+    If the job isn't solved in time, the last line is an error.
+    '''
+    if request.method != 'POST':
+        return _error_response(REQUEST_METHOD_ERROR, status=405)
+    payload = _get_payload(request)
+    task = _get_task(payload)
+    if task is None:
+        return _error_response(TASK_NOT_FOUND_ERROR)
+    inputs_list = payload.get('inputs')
+    if not isinstance(inputs_list, list):
+        return _error_response(INPUTS_ERROR)
+    if len(inputs_list) > settings.DJSOLVER_MAX_BATCH_SIZE:
+        return _error_response(BATCH_SIZE_ERROR)
+    validated = [validate_inputs(task, inputs) for inputs in inputs_list]
+    if any(inputs is None for inputs in validated):
+        return _error_response(INPUTS_ERROR)
+    engine = get_engine()
+    owner, weight = _get_owner(request)
+    job_id = engine.submit_batch(task, validated, owner=owner, weight=weight)
+    state = engine.status(job_id)
+    state['error'] = 0
+    del state['items']
+
+    def _stream():
+        yield json.dumps(state) + '\n'
+        sent = 0
+        for item in engine.iter_items(job_id, timeout=_batch_timeout(len(validated))):
+            yield json.dumps(item) + '\n'
+            sent += 1
+        if sent < len(validated):
+            yield json.dumps({'error': 1, 'message': BATCH_TIMEOUT_ERROR}) + '\n'
+
+    return StreamingHttpResponse(_stream(), content_type='application/x-ndjson')
+
 
 def check_status(request):
-    pass
+    '''
+    Returns state of the job: queued, running, done or failed,
+    and its outputs when the job is done.
+    '''
+    if request.method != 'POST':
+        return _error_response(REQUEST_METHOD_ERROR, status=405)
+    payload = _get_payload(request)
+    state = get_engine().status(payload.get('hash'))
+    if state is None:
+        return _error_response(JOB_NOT_FOUND_ERROR)
+    state['error'] = 0
+    return JsonResponse(state)
+
+
+def wait_status(request):
+    '''
+    Long-poll variant of check_status.
+
+    The response is held until the job state version becomes greater than
+    the 'version' sent by the client, the job is finished or
+    DJSOLVER_STATUS_WAIT_TIMEOUT is exceeded.
+    '''
+    if request.method != 'POST':
+        return _error_response(REQUEST_METHOD_ERROR, status=405)
+    payload = _get_payload(request)
+    try:
+        version = int(payload.get('version', 0))
+    except (ValueError, TypeError):
+        version = 0
+    state = get_engine().wait(payload.get('hash'), version,
+                              timeout=settings.DJSOLVER_STATUS_WAIT_TIMEOUT)
+    if state is None:
+        return _error_response(JOB_NOT_FOUND_ERROR)
+    state['error'] = 0
+    return JsonResponse(state)
+
+
+def status_events(request):
+    '''
+    Job states as server-sent events, one event on every change of the job.
+
+    The stream is closed when the job is finished or
+    DJSOLVER_STATUS_WAIT_TIMEOUT is exceeded.
+    '''
+    job_id = request.GET.get('hash')
+    engine = get_engine()
+    if engine.status(job_id) is None:
+        return _error_response(JOB_NOT_FOUND_ERROR)
+
+    def _stream():
+        for state in engine.iter_states(job_id, timeout=settings.DJSOLVER_STATUS_WAIT_TIMEOUT):
+            yield 'id: %s\nevent: status\ndata: %s\n\n' % (state['version'], json.dumps(state))
+
+    response = StreamingHttpResponse(_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
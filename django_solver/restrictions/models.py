@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 
 from django_solver.restrictions import restriction_pool
@@ -24,4 +25,20 @@ class RestrictionModel(models.Model):
             return restriction_pool[self.restriction].status(**_kwargs)
         else:
             return False
-        
\ No newline at end of file
+
+
+@python_2_unicode_compatible
+class PriorityModel(models.Model):
+    '''Priority class of the user; it defines user's share of workers.'''
+    CHOICES = [(x, x) for x, _ in settings.DJSOLVER_PRIORITY_CLASSES]
+    priority_class = models.CharField(choices=CHOICES,
+                                      default=settings.DJSOLVER_DEFAULT_PRIORITY_CLASS,
+                                      max_length=100)
+    user = models.OneToOneField(RegularUserModel, related_name='priority')
+
+    def __str__(self):
+        return self.priority_class
+
+    @property
+    def weight(self):
+        return dict(settings.DJSOLVER_PRIORITY_CLASSES).get(self.priority_class, 1)
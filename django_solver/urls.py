@@ -14,9 +14,14 @@ Including another URLconf
     2. Add a URL to urlpatterns:  url(r'^blog/', include(blog_urls))
 """
 from django.conf.urls import include, url
-from .base.views import load_task, check_status
+from .base.views import (load_task, load_data, load_batch, check_status,
+                         wait_status, status_events)
 
 urlpatterns = [
     url(r'^load/', load_task),
+    url(r'^data/', load_data),
+    url(r'^batch/', load_batch),
+    url(r'^status/wait/', wait_status),
+    url(r'^status/events/', status_events),
     url(r'^status/', check_status)
 ]
@@ -0,0 +1,220 @@
+'''
+Benchmarks of task rendering.
+
+TaskRenderer.render_simple and TaskRenderer.render_with_inputs are measured
+for body and file backed templates of different sizes, different numbers of
+task defaults and states of caches:
+
+* cold: all caches are cleared before each call;
+* local: only the Django cache (rendered fragments and results) is cleared
+  before each call, caches of the process are warm;
+* warm: no caches are cleared.
+
+Each case reports calls per second and memory allocated by one call
+(peak of traced memory, Python 3 only). The best of several rounds is
+reported.
+
+Results are compared with the baseline stored in tests/data/bench_baseline.json;
+a case is reported as a regression if it became slower or allocates more than
+the tolerances allow. Timings are noisy, so the default tolerance of
+allocations is much smaller. Timings also depend on the machine: regenerate
+the stored baseline after intended changes of performance, or store a baseline
+of your machine before comparing with it:
+
+    python -m tests.benchmarks --save-baseline
+    python -m tests.benchmarks --baseline my_baseline.json --save-baseline
+    python -m tests.benchmarks --output bench_output.txt
+'''
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import django
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'bench_baseline.json')
+
+SOURCES = ('body', 'file')
+TEMPLATE_SIZES = (10, 100, 1000)  # lines of the template
+DEFAULTS_SIZES = (5, 50, 500)  # number of task defaults
+METHODS = ('render_simple', 'render_with_inputs')
+CACHES = ('cold', 'local', 'warm')
+ROUNDS = 5
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def make_template(lines, defaults_size):
+    return '\n'.join('<p>Value %s is {{v%s}}.</p>' % (i, i % defaults_size)
+                     for i in range(lines))
+
+
+def make_defaults(size):
+    return repr(dict(('v%s' % i, i * 1.5) for i in range(size)))
+
+
+def clear_django_cache():
+    from django.core.cache import cache
+    cache.clear()
+
+
+def clear_caches():
+    from django_solver.base import filecache, schema, templatecache
+    templatecache.clear()
+    schema.clear()
+    filecache.clear()
+    clear_django_cache()
+
+
+CLEARERS = {'cold': clear_caches, 'local': clear_django_cache, 'warm': None}
+
+
+def create_task(source, lines, defaults_size, code):
+    from django.core.files.base import ContentFile
+    from django_solver.models import RegularTask, TemplateModel
+    body = make_template(lines, defaults_size)
+    if source == 'file':
+        tempobj = TemplateModel()
+        tempobj.file.save('bench.html', ContentFile(body.encode('utf-8')))
+    else:
+        tempobj = TemplateModel.objects.create(body=body)
+    return RegularTask.objects.create(formulation_template=tempobj, code=code,
+                                      defaults=make_defaults(defaults_size),
+                                      public=True)
+
+
+def run_case(task, method, state, min_time):
+    from django_solver.base.renderer import TaskRenderer
+    clear = CLEARERS[state]
+
+    def call():
+        if clear is not None:
+            clear()
+        start = timer()
+        getattr(TaskRenderer(task), method)()
+        return timer() - start
+
+    clear_caches()
+    call()  # warm up imports and caches
+    allocated = None
+    if tracemalloc is not None:
+        if clear is not None:
+            clear()
+        tracemalloc.start()
+        try:
+            getattr(TaskRenderer(task), method)()
+            allocated = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    # The best of rounds is the least affected by other processes
+    best = 0.0
+    for _ in range(ROUNDS):
+        calls, elapsed = 0, 0.0
+        while elapsed < min_time / ROUNDS or calls < 3:
+            elapsed += call()
+            calls += 1
+        best = max(best, calls / elapsed)
+    return {'ops': best, 'allocated': allocated}
+
+
+def run(min_time):
+    from django_solver.models import PythonCodeModel
+    code = PythonCodeModel.objects.create(body='OUTPUTS = dict()')
+    results = {}
+    for source in SOURCES:
+        for lines in TEMPLATE_SIZES:
+            for defaults_size in DEFAULTS_SIZES:
+                task = create_task(source, lines, defaults_size, code)
+                for method in METHODS:
+                    for state in CACHES:
+                        name = '%s:%s:lines=%s:defaults=%s:%s' % (method, source, lines,
+                                                                defaults_size, state)
+                        results[name] = run_case(task, method, state, min_time)
+    return results
+
+
+def compare(results, baseline, tolerance, alloc_tolerance):
+    '''Returns report lines and names of regressed cases.'''
+    lines, regressions = [], []
+    for name in sorted(results):
+        result, base = results[name], baseline.get(name)
+        line = '%-60s %12.1f ops/s' % (name, result['ops'])
+        if result['allocated'] is not None:
+            line += ' %10d B' % result['allocated']
+        if base is not None:
+            ratio = result['ops'] / base['ops']
+            line += '  x%.2f' % ratio
+            slower = ratio < 1 - tolerance
+            bigger = (result['allocated'] is not None and base.get('allocated') and
+                      result['allocated'] > base['allocated'] * (1 + alloc_tolerance))
+            if slower or bigger:
+                line += '  REGRESSION'
+                regressions.append(name)
+        lines.append(line)
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of task rendering.')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='json file of results to compare with (or to save results to)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed relative slowdown')
+    parser.add_argument('--alloc-tolerance', type=float, default=0.1,
+                        help='allowed relative growth of allocations')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimal measured time of each case, seconds')
+    parser.add_argument('--output', help='also write the report to the file')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+    django.setup()
+    from django.test.utils import get_runner, override_settings
+    from django.conf import settings
+
+    media_root = tempfile.mkdtemp()
+    runner = get_runner(settings)(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        with override_settings(MEDIA_ROOT=media_root, DEBUG=False):
+            results = run(args.min_time)
+    finally:
+        runner.teardown_databases(old_config)
+        shutil.rmtree(media_root, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    lines, regressions = compare(results, baseline, args.tolerance,
+                                 args.alloc_tolerance)
+    if regressions:
+        lines.append('%s regression(s)' % len(regressions))
+    report = '\n'.join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        return 0
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,26 @@
 from __future__ import print_function
 
+import atexit
+import io
 import os
 import shutil
 import sys
 import tempfile
+import threading
+import time
 import unittest
 import json
 
+import numpy as np
 from django.core.urlresolvers import reverse
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User, Group
 from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.core.files.base import ContentFile
-from django.test import TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.test.client import Client
 from django_solver.base.renderer import TaskRenderer
 from django_solver.base.utils import regtask_from_solver, solver_from_regtask
@@ -22,8 +29,15 @@ from django_solver.models import (RegularTask,
                                   TaskCategory, RegularUserModel,
                                   )
 from django_solver.restrictions import Restriction, restriction_pool
-from django_solver.restrictions.models import RestrictionModel
+from django_solver.restrictions.models import RestrictionModel, PriorityModel
 import django_solver.base.views as djviews 
+from django_solver.base.engine import JobEngine, JOB_DONE, JOB_FAILED, _init_worker
+from django_solver.base.sandbox import (run_sandboxed, parse_size, get_limits, SANDBOX_OK,
+                                        SANDBOX_ERROR, SANDBOX_TIMEOUT, SANDBOX_MEMORY)
+from django_solver.base import codecache
+from django_solver.base.scheduler import FairScheduler
+from django_solver.base.metrics import (get_task_metrics, get_tasks_metrics, percentile,
+                                        record_job_metrics)
 
 from .data import (template_data, solver_task_example,
                    category_data, restrictions)
@@ -42,6 +56,7 @@ sys.path.append(current_dir)
 
 MROOT = os.path.abspath(getattr(settings, 'MEDIA_ROOT', ''))
 NEWMROOT = tempfile.mkdtemp(dir=MROOT)
+atexit.register(shutil.rmtree, NEWMROOT, True)
 
 
 def _safely_create(model, filepath, filefield='file'):
@@ -540,3 +555,530 @@ class SendTaskView_TestCase(TestCase):
         self.assertEqual(status_data['status'], 0)
 
     
+
+
+def _wait_for_job(engine, job_id, timeout=10.0):
+    deadline = time.time() + timeout
+    state = engine.status(job_id)
+    while state['status'] not in (JOB_DONE, JOB_FAILED) and time.time() < deadline:
+        time.sleep(0.01)
+        state = engine.status(job_id)
+    return state
+
+
+class JobEngine_TestCase(TestCase):
+
+    def setUp(self):
+        tempobj = TemplateModel.objects.create(body=template_data.VALID_TEMPLATE_BODY_JINJA)
+        pyobj = PythonCodeModel.objects.create(body=solver_task_example.task_code)
+        self.regtask = RegularTask.objects.create(formulation_template=tempobj,
+                                 code=pyobj,
+                                 defaults=str(solver_task_example.task_defaults)
+                                 )
+        self.engine = JobEngine(processes=1)
+        cache.clear()
+
+    def tearDown(self):
+        self.engine.shutdown()
+
+    def test_solve_defaults(self):
+        job_id = self.engine.submit(self.regtask, self.regtask.get_defaults)
+        self.assertEqual(len(job_id), 32)
+        state = _wait_for_job(self.engine, job_id)
+        self.assertEqual(state['status'], JOB_DONE)
+        self.assertEqual(state['result']['result'], 5)
+        self.assertGreater(state['elapsed_time'], 0.0)
+
+    def test_cached_result(self):
+        state = _wait_for_job(self.engine, self.engine.submit(self.regtask, self.regtask.get_defaults))
+        self.assertFalse(state['cached'])
+        state = self.engine.status(self.engine.submit(self.regtask, self.regtask.get_defaults))
+        self.assertEqual(state['status'], JOB_DONE)
+        self.assertTrue(state['cached'])
+        self.assertEqual(state['result']['result'], 5)
+
+    def test_cache_invalidated_by_task_change(self):
+        _wait_for_job(self.engine, self.engine.submit(self.regtask, self.regtask.get_defaults))
+        self.regtask.save()
+        state = self.engine.status(self.engine.submit(self.regtask, self.regtask.get_defaults))
+        self.assertFalse(state['cached'])
+
+    def test_cache_invalidated_by_code_change(self):
+        _wait_for_job(self.engine, self.engine.submit(self.regtask, self.regtask.get_defaults))
+        pyobj = PythonCodeModel.objects.get(pk=self.regtask.code_id)
+        pyobj.body = "OUTPUTS['result'] = 7"
+        pyobj.save()
+        regtask = RegularTask.objects.get(pk=self.regtask.pk)
+        state = _wait_for_job(self.engine, self.engine.submit(regtask, regtask.get_defaults))
+        self.assertFalse(state['cached'])
+        self.assertEqual(state['result']['result'], 7)
+
+    def test_failed_job_not_cached(self):
+        inputs = {'total': 1, 'paper_cost': 0}
+        _wait_for_job(self.engine, self.engine.submit(self.regtask, inputs))
+        state = self.engine.status(self.engine.submit(self.regtask, inputs))
+        self.assertFalse(state['cached'])
+
+    def test_batch(self):
+        inputs_list = [{'total': 100, 'paper_cost': 20},
+                       {'total': 1, 'paper_cost': 0},
+                       {'total': 30, 'paper_cost': 10}]
+        job_id = self.engine.submit_batch(self.regtask, inputs_list)
+        items = sorted(self.engine.iter_items(job_id, timeout=10), key=lambda x: x['index'])
+        self.assertEqual([item['status'] for item in items], [JOB_DONE, JOB_FAILED, JOB_DONE])
+        self.assertEqual(items[0]['result']['result'], 5)
+        self.assertEqual(items[2]['result']['result'], 3)
+        state = self.engine.status(job_id)
+        self.assertEqual(state['status'], JOB_DONE)
+        self.assertEqual(state['total'], 3)
+
+    def test_batch_cached_items(self):
+        inputs = {'total': 100, 'paper_cost': 20}
+        _wait_for_job(self.engine, self.engine.submit(self.regtask, inputs))
+        job_id = self.engine.submit_batch(self.regtask, [inputs, inputs])
+        items = list(self.engine.iter_items(job_id, timeout=10))
+        self.assertTrue(all(item['cached'] for item in items))
+        self.assertEqual(self.engine.status(job_id)['status'], JOB_DONE)
+
+    def test_load_batch_view(self):
+        url = reverse(djviews.load_batch)
+        response = self.client.post(url, json.dumps({'task-id': self.regtask.pk,
+                                                     'inputs': [{'total': 60}, {'total': 80}]}),
+                                    content_type='application/json')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])['total'], 2)
+        results = set(json.loads(line)['result']['result'] for line in lines[1:])
+        self.assertEqual(results, set([3, 4]))
+
+    def test_load_batch_view_timeout(self):
+        restrictions = dict(settings.DJSOLVER_RESTRICTIONS_GLOBAL, MAX_EXECUTION_TIME=0)
+        with self.settings(DJSOLVER_RESTRICTIONS_GLOBAL=restrictions,
+                           DJSOLVER_STATUS_WAIT_TIMEOUT=0):
+            response = self.client.post(reverse(djviews.load_batch),
+                                        json.dumps({'task-id': self.regtask.pk,
+                                                    'inputs': [{'total': 60}]}),
+                                        content_type='application/json')
+            lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[-1])['error'], 1)
+
+    def test_wait_for_change(self):
+        job_id = self.engine.submit(self.regtask, self.regtask.get_defaults)
+        state = self.engine.wait(job_id, 0, timeout=10)
+        self.assertGreater(state['version'], 0)
+        while state['status'] not in (JOB_DONE, JOB_FAILED):
+            state = self.engine.wait(job_id, state['version'], timeout=10)
+        self.assertEqual(state['result']['result'], 5)
+        self.assertEqual(self.engine.wait(job_id, state['version'], timeout=0.1), state)
+
+    def test_wait_status_view(self):
+        engine = djviews.get_engine()
+        job_id = engine.submit(self.regtask, self.regtask.get_defaults)
+        state = _wait_for_job(engine, job_id)
+        response = self.client.post(reverse(djviews.wait_status),
+                                    json.dumps({'hash': job_id, 'version': 0}),
+                                    content_type='application/json')
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['version'], state['version'])
+        self.assertEqual(data['status'], JOB_DONE)
+
+    def test_status_events_view(self):
+        job_id = djviews.get_engine().submit(self.regtask, self.regtask.get_defaults)
+        response = self.client.get(reverse(djviews.status_events), {'hash': job_id})
+        content = b''.join(response.streaming_content).decode('utf-8')
+        events = [json.loads(line[len('data: '):]) for line in content.splitlines()
+                  if line.startswith('data: ')]
+        self.assertEqual(events[-1]['status'], JOB_DONE)
+        versions = [event['version'] for event in events]
+        self.assertEqual(versions, sorted(set(versions)))
+
+    def test_preloaded_modules(self):
+        self.assertNotIn('colorsys', sys.modules)
+        pyobj = PythonCodeModel.objects.create(body="import sys\nOUTPUTS['loaded'] = 'colorsys' in sys.modules")
+        self.regtask.code = pyobj
+        self.regtask.save()
+        with self.settings(DJSOLVER_WORKER_PRELOAD=('colorsys', 'not_existing_module')):
+            state = _wait_for_job(self.engine, self.engine.submit(self.regtask, {}))
+        self.assertTrue(state['result']['loaded'])
+
+    def test_failed_preload(self):
+        with self.assertLogs('django_solver.base.engine', 'ERROR') as cm:
+            _init_worker(None, ('tests.data.invalid_code', 'not_existing_module'))
+        self.assertEqual(len(cm.output), 2)
+        self.assertIn('tests.data.invalid_code', cm.output[0])
+        self.assertIn('SyntaxError', cm.output[0])
+        self.assertIn('not_existing_module', cm.output[1])
+
+    def test_failed_job(self):
+        job_id = self.engine.submit(self.regtask, {'total': 1, 'paper_cost': 0})
+        state = _wait_for_job(self.engine, job_id)
+        self.assertEqual(state['status'], JOB_FAILED)
+        self.assertIn('ZeroDivisionError', state['message'])
+
+    def test_unpicklable_inputs(self):
+        job_id = self.engine.submit(self.regtask, {'total': threading.Lock()})
+        state = _wait_for_job(self.engine, job_id)
+        self.assertEqual(state['status'], JOB_FAILED)
+        # The worker slot is released
+        state = _wait_for_job(self.engine, self.engine.submit(self.regtask, self.regtask.get_defaults))
+        self.assertEqual(state['status'], JOB_DONE)
+
+    def test_unknown_job(self):
+        self.assertIsNone(self.engine.status('0' * 32))
+
+    def test_load_task_view(self):
+        url = reverse(djviews.load_task)
+        response = self.client.post(url, json.dumps({'task-id': self.regtask.pk,
+                                                     'inputs': {'total': 60}}),
+                                    content_type='application/json')
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['error'], 0)
+        state = _wait_for_job(djviews.get_engine(), data['hash'])
+        self.assertEqual(state['result']['result'], 3)
+        response = self.client.post(reverse(djviews.check_status),
+                                    json.dumps({'hash': data['hash']}),
+                                    content_type='application/json')
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['status'], JOB_DONE)
+
+    def test_load_task_invalid_inputs(self):
+        url = reverse(djviews.load_task)
+        response = self.client.post(url, json.dumps({'task-id': self.regtask.pk,
+                                                     'inputs': {'unknown': 1}}),
+                                    content_type='application/json')
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['error'], 1)
+
+    def test_load_task_too_long_field(self):
+        url = reverse(djviews.load_task)
+        max_length = settings.DJSOLVER_RESTRICTIONS_GLOBAL['MAX_FIELD_LENGTH']
+        response = self.client.post(url, json.dumps({'task-id': self.regtask.pk,
+                                                     'inputs': {'username': 'a' * (max_length + 1)}}),
+                                    content_type='application/json')
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['error'], 1)
+
+    def test_load_task_npy(self):
+        buf = io.BytesIO()
+        np.save(buf, np.array(60.0))
+        url = '%s?task-id=%s&input-name=total' % (reverse(djviews.load_task), self.regtask.pk)
+        response = self.client.post(url, buf.getvalue(), content_type='application/x-npy')
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['error'], 0)
+        state = _wait_for_job(djviews.get_engine(), data['hash'])
+        self.assertEqual(state['result']['result'], 3)
+        response = self.client.post(url, b'not npy', content_type='application/x-npy')
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['error'], 1)
+
+    def test_load_data_view(self):
+        # Requests pass the full middleware stack with CSRF checks
+        client = Client(enforce_csrf_checks=True)
+        token = 'a' * 32
+        client.cookies['csrftoken'] = token
+        url = '%s?task-id=%s&input-name=total' % (reverse(djviews.load_data), self.regtask.pk)
+        upload = SimpleUploadedFile('data.csv', b'60', content_type='text/csv')
+        response = client.post(url, {'input-data': upload}, HTTP_X_CSRFTOKEN=token)
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['error'], 0)
+        # The file is converted by the upload handler while it is received
+        self.assertNotIn('input-data', response.wsgi_request.FILES)
+        state = _wait_for_job(djviews.get_engine(), data['hash'])
+        self.assertEqual(state['result']['result'], 3)
+        response = client.post(url, '80', content_type='text/plain', HTTP_X_CSRFTOKEN=token)
+        data = json.loads(response.content.decode('utf-8'))
+        state = _wait_for_job(djviews.get_engine(), data['hash'])
+        self.assertEqual(state['result']['result'], 4)
+        response = client.post(url, '1,x', content_type='text/plain', HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['error'], 1)
+        upload = SimpleUploadedFile('data.csv', b'60', content_type='text/csv')
+        response = client.post(url, {'input-data': upload})
+        self.assertEqual(response.status_code, 403)
+
+    def test_runaway_job(self):
+        pyobj = PythonCodeModel.objects.create(body='while True: pass')
+        self.regtask.code = pyobj
+        self.regtask.save()
+        restrictions = dict(settings.DJSOLVER_RESTRICTIONS_GLOBAL, MAX_EXECUTION_TIME=1)
+        with self.settings(DJSOLVER_RESTRICTIONS_GLOBAL=restrictions):
+            job_id = self.engine.submit(self.regtask, self.regtask.get_defaults)
+            state = _wait_for_job(self.engine, job_id)
+        self.assertEqual(state['status'], JOB_FAILED)
+        self.assertEqual(state['reason'], SANDBOX_TIMEOUT)
+
+
+class JobMetrics_TestCase(TransactionTestCase):
+    '''Metrics are stored by the engine threads, so they should be committed.'''
+
+    def setUp(self):
+        tempobj = TemplateModel.objects.create(body=template_data.VALID_TEMPLATE_BODY_JINJA)
+        pyobj = PythonCodeModel.objects.create(body=solver_task_example.task_code)
+        self.regtask = RegularTask.objects.create(formulation_template=tempobj,
+                                 code=pyobj,
+                                 defaults=str(solver_task_example.task_defaults)
+                                 )
+        self.engine = JobEngine(processes=1)
+        cache.clear()
+
+    def tearDown(self):
+        self.engine.shutdown()
+
+    def test_metrics(self):
+        for i in range(3):
+            inputs = dict(self.regtask.get_defaults, total=100 + i)
+            _wait_for_job(self.engine, self.engine.submit(self.regtask, inputs))
+        metrics = self.regtask.metrics.all()
+        self.assertEqual(len(metrics), 3)
+        for item in metrics:
+            self.assertEqual(item.status, SANDBOX_OK)
+            self.assertGreaterEqual(item.queue_wait, 0.0)
+            self.assertGreater(item.wall_time, 0.0)
+            self.assertIsNotNone(item.cpu_time)
+            self.assertGreater(item.max_rss, 0)
+        summary = get_task_metrics(self.regtask)
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['wall_time']['p99'], max(item.wall_time for item in metrics))
+
+    def test_tasks_metrics(self):
+        _wait_for_job(self.engine, self.engine.submit(self.regtask, self.regtask.get_defaults))
+        other = RegularTask.objects.create(
+            formulation_template=TemplateModel.objects.create(body=template_data.VALID_TEMPLATE_BODY_JINJA),
+            code=PythonCodeModel.objects.create(body=solver_task_example.task_code))
+        with self.assertNumQueries(2):
+            metrics = get_tasks_metrics([self.regtask, other])
+        self.assertEqual(metrics[self.regtask.pk], get_task_metrics(self.regtask))
+        self.assertEqual(metrics[other.pk]['count'], 0)
+
+    def test_metrics_retention(self):
+        usage = {'wall_time': 0.1, 'cpu_time': 0.1, 'max_rss': 1}
+        with self.settings(DJSOLVER_METRICS_WINDOW=2):
+            for i in range(3):
+                record_job_metrics(self.regtask.pk, SANDBOX_OK, float(i), usage)
+        self.assertEqual(sorted(self.regtask.metrics.values_list('queue_wait', flat=True)),
+                         [1.0, 2.0])
+
+    def test_cached_result_has_no_metrics(self):
+        _wait_for_job(self.engine, self.engine.submit(self.regtask, self.regtask.get_defaults))
+        _wait_for_job(self.engine, self.engine.submit(self.regtask, self.regtask.get_defaults))
+        self.assertEqual(self.regtask.metrics.count(), 1)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 50), 7)
+        self.assertIsNone(percentile([], 50))
+
+
+def _endless_loop():
+    while True:
+        pass
+
+
+def _allocate_memory(size):
+    return len(' ' * size)
+
+
+def _raise_error():
+    raise ValueError('sandboxed error')
+
+
+def _leave_process(pid_path, loop=False):
+    # The process keeps the result pipe open
+    pid = os.fork()
+    if pid == 0:
+        time.sleep(30)
+        os._exit(0)
+    with open(pid_path, 'w') as f:
+        f.write(str(pid))
+    while loop:
+        pass
+    return pid
+
+
+def _is_running(pid):
+    # Killed processes could remain zombies until they are reaped by init
+    try:
+        with open('/proc/%s/stat' % pid) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except IOError:
+        return False
+
+
+class Sandbox_TestCase(TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('1M'), 1024 ** 2)
+        self.assertEqual(parse_size('512K'), 512 * 1024)
+        self.assertEqual(parse_size(100), 100)
+        self.assertIsNone(parse_size('one mb'))
+
+    def test_file_size_limit(self):
+        restrictions = dict(settings.DJSOLVER_RESTRICTIONS_GLOBAL, MAX_FILE_SIZE='1K')
+        with self.settings(DJSOLVER_RESTRICTIONS_GLOBAL=restrictions,
+                           DJSOLVER_SANDBOX_MAX_FILE_SIZE='2M'):
+            self.assertEqual(get_limits()['file_size_limit'], 2 * 1024 ** 2)
+
+    def test_result(self):
+        res = run_sandboxed(sum, ([1, 2, 3],), time_limit=5)
+        self.assertEqual(res['status'], SANDBOX_OK)
+        self.assertEqual(res['result'], 6)
+
+    def test_json_result(self):
+        res = run_sandboxed(tuple, ([1, 'a'],))
+        self.assertEqual(res['result'], [1, 'a'])
+        res = run_sandboxed(object)
+        self.assertEqual(res['status'], SANDBOX_ERROR)
+        self.assertIn('JSON serializable', res['error'])
+
+    def test_usage(self):
+        res = run_sandboxed(_endless_loop, time_limit=1)
+        self.assertGreaterEqual(res['usage']['wall_time'], 1.0)
+        self.assertGreater(res['usage']['cpu_time'], 0.5)
+        self.assertGreater(res['usage']['max_rss'], 0)
+
+    def test_error(self):
+        res = run_sandboxed(_raise_error)
+        self.assertEqual(res['status'], SANDBOX_ERROR)
+        self.assertIn('sandboxed error', res['error'])
+
+    def test_cpu_timeout(self):
+        start = time.time()
+        res = run_sandboxed(_endless_loop, time_limit=1)
+        self.assertEqual(res['status'], SANDBOX_TIMEOUT)
+        self.assertLess(time.time() - start, 5)
+
+    def test_wallclock_timeout(self):
+        res = run_sandboxed(time.sleep, (10,), time_limit=1)
+        self.assertEqual(res['status'], SANDBOX_TIMEOUT)
+
+    def test_memory_limit(self):
+        res = run_sandboxed(_allocate_memory, (8 * 1024 ** 3,),
+                            memory_limit=parse_size('4G'))
+        self.assertEqual(res['status'], SANDBOX_MEMORY)
+
+    @unittest.skipUnless(os.path.isdir('/proc/self'), 'procfs is required')
+    def test_process_group(self):
+        fd, pid_path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, pid_path)
+        start = time.time()
+        res = run_sandboxed(_leave_process, (pid_path,), time_limit=10)
+        # The result is read without waiting for the pipe to be closed
+        self.assertEqual(res['status'], SANDBOX_OK)
+        self.assertLess(time.time() - start, 5)
+        time.sleep(0.1)
+        self.assertFalse(_is_running(res['result']))
+        res = run_sandboxed(_leave_process, (pid_path, True), time_limit=1)
+        self.assertEqual(res['status'], SANDBOX_TIMEOUT)
+        with open(pid_path) as f:
+            pid = int(f.read())
+        time.sleep(0.1)
+        self.assertFalse(_is_running(pid))
+
+
+class CodeCache_TestCase(TestCase):
+
+    def setUp(self):
+        codecache.clear()
+
+    def tearDown(self):
+        codecache.clear()
+
+    def test_compiled_once(self):
+        code = codecache.compile_code(template_data.VALID_PYTHON_CODE)
+        self.assertIs(code, codecache.compile_code(template_data.VALID_PYTHON_CODE))
+        namespace = {}
+        exec(code, namespace)
+        self.assertEqual(namespace['OUTPUTS']['result'], 3)
+
+    def test_disk_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with self.settings(DJSOLVER_CODE_CACHE_DIR=cache_dir):
+                code = codecache.compile_code(template_data.VALID_PYTHON_CODE)
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+                codecache.clear()
+                cached = codecache.compile_code(template_data.VALID_PYTHON_CODE)
+            self.assertIsNot(code, cached)
+            self.assertEqual(code.co_code, cached.co_code)
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def test_invalidation_on_save(self):
+        pyobj = PythonCodeModel.objects.create(body=template_data.VALID_PYTHON_CODE)
+        code = codecache.compile_code(pyobj.body, owner=pyobj.pk)
+        pyobj.body = 'x = 1'
+        pyobj.save()
+        self.assertIsNot(code, codecache.compile_code(template_data.VALID_PYTHON_CODE))
+
+    def test_owners_bounded(self):
+        maxsize = codecache._cache.maxsize
+        for owner in range(maxsize + 10):
+            codecache.compile_code('x = %s' % owner, owner=owner)
+        self.assertEqual(len(codecache._owners), maxsize)
+        self.assertIsNone(codecache._owners.get(0))
+        # Keys of evicted entries aren't kept
+        for i in range(maxsize + 10):
+            codecache.compile_code('y = %s' % i, owner='edited')
+        self.assertEqual(len(codecache._owners.get('edited')), maxsize)
+
+
+class FairScheduler_TestCase(TestCase):
+
+    def _pop_owners(self, scheduler, release=True):
+        res = []
+        entry = scheduler.pop()
+        while entry is not None:
+            res.append(entry[0])
+            if release:
+                scheduler.release(entry[0])
+            entry = scheduler.pop()
+        return res
+
+    def test_round_robin(self):
+        scheduler = FairScheduler()
+        for i in range(4):
+            scheduler.push('flood', i)
+        scheduler.push('user', 0)
+        scheduler.push('user', 1)
+        self.assertEqual(len(scheduler), 6)
+        self.assertEqual(self._pop_owners(scheduler),
+                         ['flood', 'user', 'flood', 'user', 'flood', 'flood'])
+
+    def test_weights(self):
+        scheduler = FairScheduler()
+        for i in range(3):
+            scheduler.push('grader', i, weight=0.5)
+            scheduler.push('student', i, weight=1)
+        self.assertEqual(self._pop_owners(scheduler),
+                         ['grader', 'student', 'student', 'grader', 'student', 'grader'])
+
+    def test_returning_owner(self):
+        scheduler = FairScheduler()
+        scheduler.push('first', 0)
+        scheduler.push('first', 1)
+        self.assertEqual(scheduler.pop()[0], 'first')
+        scheduler.release('first')
+        self.assertEqual(scheduler.pop()[0], 'first')
+        scheduler.release('first')
+        scheduler.push('first', 2)
+        scheduler.push('late', 0)
+        scheduler.push('late', 1)
+        self.assertEqual(self._pop_owners(scheduler), ['first', 'late', 'late'])
+
+    def test_max_running_per_owner(self):
+        scheduler = FairScheduler(max_running_per_owner=1)
+        scheduler.push('user', 0)
+        scheduler.push('user', 1)
+        self.assertEqual(scheduler.pop(), ('user', 0))
+        self.assertIsNone(scheduler.pop())
+        scheduler.release('user')
+        self.assertEqual(scheduler.pop(), ('user', 1))
+
+    def test_priority_model(self):
+        user = User.objects.create(username='grader')
+        reguser = RegularUserModel.objects.create(user=user)
+        priority = PriorityModel.objects.create(user=reguser, priority_class='high')
+        self.assertEqual(reguser.priority.weight, dict(settings.DJSOLVER_PRIORITY_CLASSES)['high'])
@@ -2,12 +2,17 @@
 Tests for data loading and validation process.
 '''
 
+import io
 
 from django_solver.base.utils import (get_data_form_request, strict_validate,
                                       smart_validate, convert,
-                                      validate)
+                                      convert_to_array, validate,
+                                      DataStreamConverter, BinaryDataReader,
+                                      DataDescriptor, InputDataError)
                 
-from django.test import TestCase
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, RequestFactory, override_settings
 import numpy as np 
 
 class strict_validation_TestCase(TestCase):
@@ -93,6 +98,46 @@ class strict_validation_TestCase(TestCase):
         self.assertFalse(strict_validate(sample_inv_strs, 'string'))
         
         
+class strict_validation_result_TestCase(TestCase):
+    '''Tests for shapes and error positions returned by strict_validate'''
+
+    def test_shape(self):
+        self.assertEqual(strict_validate(' 3 ', 'integer').shape, ())
+        self.assertEqual(strict_validate('1.,2', 'float').shape, (2,))
+        self.assertEqual(strict_validate('1,2\n\n3,4\n5,6\n', 'integer').shape, (3, 2))
+        self.assertEqual(strict_validate("'a,b', 'c'", 'string').shape, (2,))
+
+    def test_error_position(self):
+        result = strict_validate('1,2\n\n3,x', 'integer')
+        self.assertFalse(result)
+        self.assertEqual((result.row, result.col), (2, 1))
+        self.assertEqual(strict_validate('1,2\n3', 'integer')[2:], (1, 1))
+        self.assertEqual(strict_validate('1,2\n3,4,5', 'integer')[2:], (1, 2))
+        self.assertEqual(strict_validate('1,2,', 'integer')[2:], (0, 2))
+        self.assertEqual(strict_validate('1 2', 'integer')[2:], (0, 0))
+        self.assertEqual(strict_validate('', 'float')[2:], (0, 0))
+        self.assertIn('row 3, column 2', strict_validate('1,2\n\n3,x', 'integer').error)
+        self.assertIsNone(strict_validate('1', 'integer').error)
+
+    def test_out_of_range(self):
+        self.assertEqual(strict_validate('1,2\n3,1e400', 'float')[2:], (1, 1))
+        self.assertEqual(strict_validate('-9007199254740992', 'integer')[2:], (0, 0))
+        self.assertTrue(strict_validate('9007199254740991', 'integer'))
+        self.assertTrue(strict_validate('1e300', 'float'))
+        # Validation agrees with conversion
+        for data, input_type in (('1e400', 'float'), ('1e400', 'integer'),
+                                 ('99999999999999999999', 'integer'),
+                                 ('9007199254740991', 'integer'), ('1e300', 'float')):
+            self.assertEqual(bool(strict_validate(data, input_type)),
+                             convert_to_array(data, input_type) is not None)
+
+    def test_full_match(self):
+        self.assertFalse(strict_validate('3.0sjk', 'float'))
+        self.assertFalse(strict_validate('12e', 'float'))
+        self.assertFalse(strict_validate("'a' b", 'string'))
+        self.assertFalse(strict_validate('1', 'complex'))
+
+
 class smart_validation_TestCase(TestCase):
     '''Tests for smart_validate function'''
     
@@ -157,6 +202,64 @@ class smart_validation_TestCase(TestCase):
         self.assertFalse(smart_validate(sample_2D_bad_floats, 'float'))
 
 
+class smart_descriptor_TestCase(TestCase):
+    '''Tests for descriptors made by smart_validate and their conversion'''
+
+    def test_inference(self):
+        descriptor = smart_validate('1, 2.5, a\n\n3, 4.0, \'b\'\n5')
+        self.assertEqual(descriptor, DataDescriptor(True, (3, 3), 'string',
+                                                    ('integer', 'float', 'string'), 2, 0))
+        self.assertEqual(smart_validate('1,2.0').columns, ('integer',))
+        self.assertEqual(smart_validate("'one', '', 2").missing, 1)
+        self.assertEqual(smart_validate(' 3.5 ').shape, ())
+        self.assertEqual(smart_validate('3.5e').dtype, 'string')
+        self.assertEqual(smart_validate('').shape, (0,))
+
+    def test_input_type(self):
+        descriptor = smart_validate('1.5,2\n3,x', 'integer')
+        self.assertFalse(descriptor)
+        self.assertEqual(descriptor.bad, 2)
+        descriptor = smart_validate('1.5,2\n3,4', 'float')
+        self.assertTrue(descriptor)
+        self.assertEqual(descriptor.columns, ('float', 'float'))
+        self.assertFalse(smart_validate('1', 'complex'))
+
+    def test_conversion(self):
+        array = convert_to_array('1,,3\n4,5,6', smart_validate('1,,3\n4,5,6'))
+        self.assertEqual(array.shape, (2, 3))
+        self.assertTrue(np.isnan(array[0, 1]))
+        data = 'a, 1\n b, 2.5\n\nc'
+        array = convert_to_array(data, smart_validate(data))
+        self.assertEqual(array['f0'].tolist(), ['a', 'b', 'c'])
+        self.assertEqual(array['f1'][:2].tolist(), [1.0, 2.5])
+        self.assertEqual(convert_to_array("'x', \"y\"", smart_validate("'x', \"y\"")).tolist(),
+                         ['x', 'y'])
+        self.assertEqual(convert_to_array('1,2.5,3', smart_validate('1,2.5,3', 'integer')).tolist(),
+                         [1, 3])
+        self.assertIsNone(convert_to_array('a,b', smart_validate('a,b', 'float')))
+
+    def test_validate(self):
+        self.assertEqual(validate('1, 2.0\n3, 4').tolist(), [[1, 2], [3, 4]])
+        self.assertEqual(validate('1,2.5,3', 'integer').tolist(), [1, 3])
+        self.assertIsNone(validate('one, two, 1', 'integer'))
+
+    def test_quoted_delimiter(self):
+        data = "'a,b', 'c'"
+        descriptor = smart_validate(data)
+        self.assertEqual(descriptor.shape, (2,))
+        self.assertEqual(convert_to_array(data, descriptor).tolist(), ['a,b', 'c'])
+        data = "'a,b', 1\n'c', 2"
+        array = convert_to_array(data, smart_validate(data))
+        self.assertEqual(array.shape, (2,))
+        self.assertEqual(array['f0'].tolist(), ['a,b', 'c'])
+        self.assertEqual(array['f1'].tolist(), [1, 2])
+        data = "'x,y', 1.5\n3, 4"
+        array = convert_to_array(data, smart_validate(data, 'float'))
+        self.assertEqual(array.shape, (2, 2))
+        self.assertTrue(np.isnan(array[0, 0]))
+        self.assertEqual(array[:, 1].tolist(), [1.5, 4.0])
+
+
 class smart_conversion_TestCase(TestCase):
     ''' Test for data input conversion process'''
    
@@ -224,12 +327,259 @@ class smart_conversion_TestCase(TestCase):
         t1 = np.linalg.norm(np.array(convert(simple_floats))-np.array([1.0, 2.4, 3.3, 5.5]))
         self.assertLess(t1, 1.0e-14)
         self.assertEqual(convert(floats_with_error), [[1.0, np.nan], [3.0, 4.0]])
-        
-        
-        
-        
-        
-    
-        
-        
-    
\ No newline at end of file
+
+
+class array_conversion_TestCase(TestCase):
+    '''Tests for convert_to_array function'''
+
+    def test_shape_and_dtype(self):
+        self.assertEqual(convert_to_array('3').shape, ())
+        self.assertEqual(convert_to_array('3').dtype, np.int64)
+        self.assertEqual(convert_to_array('1, 2.5, 3.5').dtype, np.float64)
+        array = convert_to_array('1,2,3\n4,5,6\n')
+        self.assertEqual(array.shape, (2, 3))
+        self.assertEqual(array.dtype, np.int64)
+        self.assertEqual(convert_to_array('').shape, (0,))
+
+    def test_input_type(self):
+        self.assertEqual(convert_to_array('1,2,3', 'float').dtype, np.float64)
+        self.assertEqual(convert_to_array('1,2.5,3.5', 'integer').tolist(), [1])
+        self.assertIsNone(convert_to_array('1,2\n3,4.5', 'integer'))
+
+    def test_bad_values(self):
+        self.assertIsNone(convert_to_array('nan'))
+        self.assertIsNone(convert_to_array('1_0'))
+        self.assertIsNone(convert_to_array('1,2\n3'))
+        array = convert_to_array('1,inf\n3,4')
+        self.assertTrue(np.isnan(array[0, 1]))
+        self.assertEqual(array[1].tolist(), [3.0, 4.0])
+
+    def test_out_of_range(self):
+        # Floats overflowing float64
+        self.assertIsNone(convert_to_array('1e400,2'))
+        self.assertIsNone(convert_to_array('1e400'))
+        self.assertIsNone(convert_to_array('1,2\n-1e400,4'))
+        self.assertIsNone(convert_to_array('1,x,1e400'))
+        # Integers which aren't exact in float64
+        self.assertIsNone(convert_to_array('9999999999999999999999,1,2'))
+        self.assertIsNone(convert_to_array('9999999999999999999999,1', 'integer'))
+        self.assertIsNone(convert_to_array('1,2\n9999999999999999999999,4', 'integer'))
+        self.assertEqual(convert_to_array('9999999999999999999999,1').tolist(), [1e22, 1.0])
+        self.assertEqual(convert_to_array('1,2.5,3.5', 'integer').tolist(), [1])
+        # Data with such numbers are rejected unless they are strings
+        self.assertIsNone(validate('a,1e400\nb,2'))
+        self.assertIsNone(validate('1e400, 2'))
+        self.assertIsNone(validate('1e400,"",2.5'))
+        self.assertIsNone(validate('1,2,9999999999999999999999', 'integer'))
+        self.assertEqual(validate('9999999999999999999999, 1').tolist(), [1e22, 1.0])
+        self.assertEqual(validate('"a",1e400,2').tolist(), ['a', '1e400', '2'])
+        self.assertEqual(validate('a,1e400\nb,2', 'string')['f1'].tolist(), ['1e400', '2'])
+        # Bad cells are counted by the same rules
+        descriptor = smart_validate('1e400, 2')
+        self.assertFalse(descriptor)
+        self.assertEqual(descriptor.bad, 1)
+        descriptor = smart_validate('9999999999999999999999, 1')
+        self.assertEqual((descriptor.dtype, descriptor.bad), ('float', 0))
+        self.assertEqual(smart_validate('1,2,9999999999999999999999', 'integer').bad, 1)
+
+    def test_big_data(self):
+        data = np.arange(40000, dtype=np.float64).reshape(200, 200) / 7
+        text = '\n'.join(','.join(repr(float(value)) for value in row) for row in data)
+        array = convert_to_array(text)
+        self.assertEqual(array.shape, (200, 200))
+        self.assertTrue((array == data).all())
+
+
+def _restrictions(**kwargs):
+    restrictions = dict(settings.DJSOLVER_RESTRICTIONS_GLOBAL)
+    restrictions.update(kwargs)
+    return restrictions
+
+
+class stream_conversion_TestCase(TestCase):
+    '''Tests for DataStreamConverter and get_data_form_request'''
+
+    data = '\n'.join(','.join(str(i * 10 + j) for j in range(10)) for i in range(100)) + '\n'
+
+    def _convert(self, data, chunk_size, **kwargs):
+        converter = DataStreamConverter(**kwargs)
+        for i in range(0, len(data), chunk_size):
+            converter.feed(data[i:i + chunk_size])
+        return converter.close()
+
+    def test_chunks(self):
+        for chunk_size in (1, 7, 100, 10000):
+            array = self._convert(self.data.encode('utf-8'), chunk_size)
+            self.assertEqual(array.shape, (100, 10))
+            self.assertEqual(array.dtype, np.int64)
+            self.assertTrue((array == convert_to_array(self.data)).all())
+        self.assertEqual(self._convert('1.5, 2\n\n', 3).tolist(), [1.5, 2.0])
+        self.assertEqual(self._convert('3', 1).shape, ())
+        self.assertEqual(self._convert('1\n2', 2, input_type='float').dtype, np.float64)
+
+    def test_errors(self):
+        data = self.data + '1,2\n'
+        with self.assertRaises(InputDataError) as cm:
+            self._convert(data, 64)
+        self.assertEqual((cm.exception.row, cm.exception.col), (100, 2))
+        with self.assertRaises(InputDataError) as cm:
+            self._convert('1,2\n\n3,x\n', 4)
+        self.assertEqual((cm.exception.row, cm.exception.col), (2, 1))
+        with self.assertRaises(InputDataError):
+            self._convert('1.5,2', 2, input_type='integer')
+        with self.assertRaises(InputDataError):
+            self._convert(' \n', 2)
+        with self.assertRaises(InputDataError):
+            DataStreamConverter('string')
+
+    def test_long_row(self):
+        row = ','.join(str(i) for i in range(10000))
+        converter = DataStreamConverter()
+        for i in range(0, len(row), 100):
+            converter.feed(row[i:i + 100])
+            # Only the incomplete cell is kept
+            self.assertLess(len(converter._tail), 5)
+        array = converter.close()
+        self.assertEqual(array.tolist(), list(range(10000)))
+        for chunk_size in (1, 3, 5, 100):
+            array = self._convert('1,2,3\n4,5,6\n7,8,9', chunk_size)
+            self.assertEqual(array.tolist(), [[1, 2, 3], [4, 5, 6], [7, 8, 9]])
+            self.assertEqual(self._convert('1.5,2', chunk_size).tolist(), [1.5, 2.0])
+            with self.assertRaises(InputDataError) as cm:
+                self._convert('1,2,3\n4,x,6,7', chunk_size)
+            self.assertEqual((cm.exception.row, cm.exception.col), (1, 1))
+            with self.assertRaises(InputDataError) as cm:
+                self._convert('1,2,3\n\n4,5,6,7\n', chunk_size)
+            self.assertEqual((cm.exception.row, cm.exception.col), (2, 3))
+            with self.assertRaises(InputDataError) as cm:
+                self._convert('1,2,', chunk_size)
+            self.assertEqual((cm.exception.row, cm.exception.col), (0, 2))
+
+    def test_out_of_range(self):
+        with self.assertRaises(InputDataError) as cm:
+            self._convert('1,2\n\n3,99999999999999999999\n', 5, input_type='integer')
+        self.assertEqual((cm.exception.row, cm.exception.col), (2, 1))
+        with self.assertRaises(InputDataError) as cm:
+            self._convert('1,2\n1e400,4', 100)
+        self.assertEqual((cm.exception.row, cm.exception.col), (1, 0))
+        request = RequestFactory().post('/?input-type=integer', data='99999999999999999999',
+                                        content_type='text/plain',
+                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertRaises(InputDataError, get_data_form_request, request)
+
+    def test_max_size(self):
+        converter = DataStreamConverter(max_size=100)
+        converter.feed(self.data[:100])
+        with self.assertRaises(InputDataError):
+            converter.feed('1')
+
+    def test_request_body(self):
+        request = RequestFactory().post('/?task-id=1', data=self.data, content_type='text/plain',
+                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        taskid, array = get_data_form_request(request)
+        self.assertEqual(taskid, '1')
+        self.assertEqual(array.shape, (100, 10))
+        request = RequestFactory().post('/', data=self.data, content_type='text/plain')
+        self.assertIsNone(get_data_form_request(request))
+
+    def test_request_file(self):
+        upload = SimpleUploadedFile('data.csv', self.data.encode('utf-8'))
+        request = RequestFactory().post('/?input-type=float', {'task-id': 2, 'input-data': upload},
+                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        taskid, array = get_data_form_request(request)
+        self.assertEqual(taskid, '2')
+        self.assertEqual(array.dtype, np.float64)
+        self.assertEqual(array.shape, (100, 10))
+
+    def test_request_field(self):
+        request = RequestFactory().post('/', {'task-id': 3, 'input-data': '1,2\n3,4'},
+                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(get_data_form_request(request)[1].tolist(), [[1, 2], [3, 4]])
+        request = RequestFactory().post('/', {'task-id': 3, 'input-data': self.data},
+                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        with override_settings(DJSOLVER_RESTRICTIONS_GLOBAL=_restrictions(MAX_FIELD_LENGTH=100)):
+            self.assertRaises(InputDataError, get_data_form_request, request)
+
+    @override_settings(DJSOLVER_RESTRICTIONS_GLOBAL=_restrictions(MAX_FILE_SIZE='1K'))
+    def test_request_too_large(self):
+        request = RequestFactory().post('/?task-id=1', data=self.data, content_type='text/plain',
+                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertRaises(InputDataError, get_data_form_request, request)
+        upload = SimpleUploadedFile('data.csv', self.data.encode('utf-8'))
+        request = RequestFactory().post('/', {'task-id': 2, 'input-data': upload},
+                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertRaises(InputDataError, get_data_form_request, request)
+
+
+class binary_data_TestCase(TestCase):
+    '''Tests for reading of .npy and raw buffer input data'''
+
+    array = np.arange(60, dtype=np.float64).reshape(6, 10) / 3
+
+    def _npy(self, array):
+        buf = io.BytesIO()
+        np.save(buf, array)
+        return buf.getvalue()
+
+    def _read(self, data, chunk_size, **kwargs):
+        reader = BinaryDataReader(**kwargs)
+        for i in range(0, len(data), chunk_size):
+            reader.feed(data[i:i + chunk_size])
+        return reader.close()
+
+    def test_npy(self):
+        data = self._npy(self.array)
+        for chunk_size in (1, 50, 10000):
+            array = self._read(data, chunk_size)
+            self.assertEqual(array.dtype, np.float64)
+            self.assertTrue((array == self.array).all())
+        array = self._read(self._npy(np.asfortranarray(self.array.astype(np.int32))), 7)
+        self.assertTrue((array == self.array.astype(np.int32)).all())
+        self.assertEqual(self._read(self._npy(np.array(5)), 3).shape, ())
+
+    def test_raw(self):
+        data = self.array.astype('<f4').tobytes()
+        array = self._read(data, 16, dtype='float32', shape=(6, 10))
+        self.assertTrue((array == self.array.astype(np.float32)).all())
+        self.assertFalse(array.flags.owndata)
+
+    def test_invalid(self):
+        with self.assertRaises(InputDataError):
+            self._read(b'1,2,3\n4,5,6\n', 4)
+        with self.assertRaises(InputDataError):
+            self._read(self._npy(np.array(['a', 'b'])), 100)
+        with self.assertRaises(InputDataError):
+            self._read(self._npy(np.zeros((2, 2, 2))), 100)
+        with self.assertRaises(InputDataError):
+            self._read(self._npy(np.array([1.0, np.nan])), 100)
+        with self.assertRaises(InputDataError):
+            self._read(self._npy(self.array)[:-8], 100)
+        with self.assertRaises(InputDataError):
+            self._read(b'\0' * 16, 16, dtype='float64', shape=(1,))
+        with self.assertRaises(InputDataError):
+            BinaryDataReader('complex128', (1,))
+
+    def test_max_size(self):
+        # The declared size is checked before data are read
+        with self.assertRaises(InputDataError):
+            BinaryDataReader('float64', (100,), max_size=100)
+        reader = BinaryDataReader(max_size=1000)
+        with self.assertRaises(InputDataError):
+            reader.feed(self._npy(np.zeros(200))[:200])
+
+    def test_request(self):
+        data = self.array.astype('<i8').tobytes()
+        request = RequestFactory().post('/?task-id=1&dtype=int64&shape=6,10', data=data,
+                                        content_type='application/octet-stream',
+                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        taskid, array = get_data_form_request(request)
+        self.assertEqual(array.shape, (6, 10))
+        self.assertEqual(array.dtype, np.int64)
+        upload = SimpleUploadedFile('data.npy', self._npy(self.array))
+        request = RequestFactory().post('/', {'task-id': 2, 'input-data': upload},
+                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        taskid, array = get_data_form_request(request)
+        self.assertTrue((array == self.array).all())
+        request = RequestFactory().post('/', data=data, content_type='application/octet-stream',
+                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertRaises(InputDataError, get_data_form_request, request)
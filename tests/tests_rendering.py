@@ -0,0 +1,436 @@
+'''
+Tests for task rendering and its caches.
+'''
+
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.http import StreamingHttpResponse
+from django.test import TestCase, override_settings
+
+from django_solver.base import engines, filecache, fragmentcache, schema, templatecache
+from django_solver.base.renderer import TaskRenderer, render_tasks
+from django_solver.models import RegularTask, PythonCodeModel, TemplateModel, TaskCategory
+
+from .data import template_data
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RenderingTestCase(TestCase):
+
+    def setUp(self):
+        templatecache.clear()
+        schema.clear()
+        filecache.clear()
+        cache.clear()
+        self.pyobj = PythonCodeModel.objects.create(body=template_data.VALID_PYTHON_CODE)
+        self.task = self.create_task(template_data.VALID_TEMPLATE_BODY_JINJA)
+
+    def tearDown(self):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def create_task(self, body, defaults=template_data.VALID_DEFAULT_DICT, public=True,
+                    in_file=False, **kwargs):
+        if in_file:
+            tempobj = TemplateModel(**kwargs)
+            tempobj.file.save('template.html', ContentFile(body.encode('utf-8')))
+        else:
+            tempobj = TemplateModel.objects.create(body=body, **kwargs)
+        return RegularTask.objects.create(formulation_template=tempobj,
+                                          code=self.pyobj,
+                                          defaults=defaults,
+                                          public=public
+                                          )
+
+
+class CompiledTemplateCache_TestCase(RenderingTestCase):
+
+    def test_compiled_template_cached(self):
+        renderer = TaskRenderer(self.task)
+        template = renderer._get_compiled_template()
+        self.assertIs(renderer._get_compiled_template(), template)
+        self.assertIs(TaskRenderer(self.task)._get_compiled_template(), template)
+        self.assertEqual(renderer.render_simple(), template_data.RENDERED_ANSWER)
+
+    def test_compiled_template_invalidated(self):
+        renderer = TaskRenderer(self.task)
+        renderer.render_simple()
+        tempobj = self.task.formulation_template
+        key = templatecache.get_template_key(tempobj.pk, tempobj.body,
+                                            engines.get_engine_name(tempobj.type))
+        self.assertIn(key, templatecache._cache)
+        tempobj.body = 'Hello, {{username}}!'
+        tempobj.save()
+        self.assertNotIn(key, templatecache._cache)
+        self.assertEqual(renderer.render_simple(), 'Hello, dmitry!')
+
+
+class JinjaTemplates_TestCase(RenderingTestCase):
+
+    def setUp(self):
+        super(JinjaTemplates_TestCase, self).setUp()
+        if engines.jinja2 is None:
+            self.skipTest('jinja2 is not installed')
+
+    def test_jinja_syntax(self):
+        task = self.create_task("{% for i in range(3) %}{{ i }}{% endfor %} {{ username|upper }}")
+        self.assertEqual(TaskRenderer(task).render_simple(), '012 DMITRY')
+
+    def test_autoescape(self):
+        task = self.create_task('{{ username }}', defaults="{'username': '<b>'}")
+        self.assertEqual(TaskRenderer(task).render_simple(), '&lt;b&gt;')
+        self.assertIn('<input', TaskRenderer(task).render_with_inputs())
+
+    def test_bytecode_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with self.settings(DJSOLVER_JINJA_BYTECODE_CACHE_DIR=cache_dir):
+                engines._jinja_env = None
+                template = engines.compile_template('{{ 1 + 1 }}', engines.JINJA_ENGINE, name='t')
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+                engines._jinja_env = None
+                cached = engines.compile_template('{{ 1 + 1 }}', engines.JINJA_ENGINE, name='t')
+                self.assertEqual(cached.render(), template.render())
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+        finally:
+            engines._jinja_env = None
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def test_engine_by_type(self):
+        self.assertEqual(engines.get_engine_name('J'), engines.JINJA_ENGINE)
+        self.assertEqual(engines.get_engine_name('X'), engines.DJANGO_ENGINE)
+
+
+class EngineFallback_TestCase(TestCase):
+
+    def setUp(self):
+        self.jinja2 = engines.jinja2
+        engines.jinja2 = None
+        engines._fallback_types.clear()
+
+    def tearDown(self):
+        engines.jinja2 = self.jinja2
+        engines._fallback_types.clear()
+
+    def test_missing_jinja(self):
+        with self.assertLogs('django_solver.base.engines', 'WARNING') as cm:
+            self.assertEqual(engines.get_engine_name('J'), engines.DJANGO_ENGINE)
+            self.assertEqual(engines.get_engine_name('J'), engines.DJANGO_ENGINE)
+        self.assertEqual(len(cm.output), 1)
+        self.assertIn('jinja2 is not installed', cm.output[0])
+
+
+class MarkdownTemplates_TestCase(RenderingTestCase):
+
+    def setUp(self):
+        super(MarkdownTemplates_TestCase, self).setUp()
+        if engines.markdown is None:
+            self.skipTest('markdown is not installed')
+
+    def test_render_markdown(self):
+        task = self.create_task('# Task\n\nMy name is **{{username}}**.', type='M')
+        self.assertEqual(TaskRenderer(task).render_simple(),
+                         '<h1>Task</h1>\n<p>My name is <strong>dmitry</strong>.</p>')
+
+    def test_template_tags_protected(self):
+        html = engines.markdown_to_template('*{{ my_value }}* and {{ a_b_c }}')
+        self.assertEqual(html, '<p><em>{{ my_value }}</em> and {{ a_b_c }}</p>')
+
+    def test_converted_once_per_revision(self):
+        task = self.create_task('My name is {{username}}', type='M')
+        calls = []
+        original = engines.markdown_to_template
+
+        def _convert(source):
+            calls.append(source)
+            return original(source)
+
+        engines.markdown_to_template = _convert
+        try:
+            TaskRenderer(task).render_simple()
+            TaskRenderer(task).render_simple()
+            self.assertEqual(len(calls), 1)
+            task.formulation_template.body = 'Hi, {{username}}'
+            task.formulation_template.save()
+            self.assertEqual(TaskRenderer(task).render_simple(), '<p>Hi, dmitry</p>')
+            self.assertEqual(len(calls), 2)
+        finally:
+            engines.markdown_to_template = original
+
+
+class FragmentCache_TestCase(RenderingTestCase):
+
+    def test_fragment_cached(self):
+        renderer = TaskRenderer(self.task)
+        html = renderer.render_simple()
+        source = self.task.formulation_template.body
+        self.assertEqual(fragmentcache.get_cached_fragment(self.task, 'simple', source), html)
+        fragmentcache.set_cached_fragment(self.task, 'simple', source, 'cached')
+        self.assertEqual(renderer.render_simple(), 'cached')
+        self.assertIn('input', renderer.render_with_inputs())
+        self.assertIsNotNone(fragmentcache.get_cached_fragment(self.task, 'inputs', source))
+
+    def test_private_task_not_cached(self):
+        task = self.create_task(template_data.VALID_TEMPLATE_BODY_JINJA, public=False)
+        self.assertIsNone(TaskRenderer(task).render_simple())
+        self.assertIsNone(fragmentcache.get_cached_fragment(task, 'simple', 'Private'))
+
+    def test_invalidated_by_task(self):
+        TaskRenderer(self.task).render_simple()
+        self.task.defaults = "{'username': 'ivan', 'age': 20}"
+        self.task.save()
+        self.assertEqual(TaskRenderer(self.task).render_simple(), 'My name is ivan. I am 20 y.o.')
+
+    def test_invalidated_by_template(self):
+        renderer = TaskRenderer(self.task)
+        renderer.render_simple()
+        tempobj = self.task.formulation_template
+        tempobj.body = 'Hello, {{username}}!'
+        tempobj.save()
+        self.assertIsNone(fragmentcache.get_cached_fragment(self.task, 'simple', tempobj.body))
+        self.assertEqual(renderer.render_simple(), 'Hello, dmitry!')
+
+    def test_template_changed_without_save(self):
+        renderer = TaskRenderer(self.task)
+        renderer.render_simple()
+        TemplateModel.objects.filter(pk=self.task.formulation_template.pk).update(
+            body='Hello, {{username}}!')
+        task = RegularTask.objects.get(pk=self.task.pk)
+        self.assertEqual(TaskRenderer(task).render_simple(), 'Hello, dmitry!')
+        self.assertEqual(render_tasks(RegularTask.objects.filter(pk=task.pk))[task],
+                         'Hello, dmitry!')
+
+    def test_file_changed(self):
+        task = self.create_task('Hello, {{username}}!', in_file=True)
+        self.assertEqual(TaskRenderer(task).render_simple(), 'Hello, dmitry!')
+        path = task.formulation_template.file.path
+        with open(path, 'w') as f:
+            f.write('Bye, {{username}}!')
+        # The file is validated by its size and modification time
+        os.utime(path, (0, 0))
+        self.assertEqual(TaskRenderer(task).render_simple(), 'Bye, dmitry!')
+
+    def test_invalidated_by_delete(self):
+        TaskRenderer(self.task).render_simple()
+        key = fragmentcache.get_fragment_key(self.task, 'simple')
+        self.task.delete()
+        self.assertIsNone(cache.get(key))
+
+
+class BulkRenderer_TestCase(RenderingTestCase):
+
+    def setUp(self):
+        super(BulkRenderer_TestCase, self).setUp()
+        self.file_task = self.create_task('Hello, {{username}}!', in_file=True)
+        self.private_task = self.create_task('Private', public=False)
+        self.category = TaskCategory.objects.create(name='base', regtask=self.task)
+        TaskCategory.objects.create(name='child 1', parent=self.category, regtask=self.file_task)
+        child = TaskCategory.objects.create(name='child 2', parent=self.category)
+        TaskCategory.objects.create(name='child 3', parent=child, regtask=self.private_task)
+
+    def test_render_category(self):
+        res = render_tasks(self.category)
+        self.assertEqual(list(res), [self.task, self.file_task, self.private_task])
+        self.assertEqual(list(res.values()),
+                         [template_data.RENDERED_ANSWER, 'Hello, dmitry!', None])
+
+    def test_render_queryset(self):
+        res = render_tasks(RegularTask.objects.filter(public=True).order_by('-pk'), with_inputs=True)
+        self.assertEqual(list(res), [self.file_task, self.task])
+        for html in res.values():
+            self.assertIn('input', html)
+
+    def test_single_query(self):
+        tasks = [self.create_task('Task {{ username }}') for i in range(10)]
+        with self.assertNumQueries(1):
+            res = render_tasks(RegularTask.objects.filter(pk__in=[task.pk for task in tasks]))
+        self.assertEqual(set(res.values()), set(['Task dmitry']))
+
+    def test_cached_fragments(self):
+        render_tasks(self.category)
+        self.assertEqual(fragmentcache.get_cached_fragment(self.file_task, 'simple',
+                                                           'Hello, {{username}}!'),
+                         'Hello, dmitry!')
+        self.assertEqual(TaskRenderer(self.file_task).render_simple(), 'Hello, dmitry!')
+
+
+class SolutionRenderer_TestCase(RenderingTestCase):
+
+    def setUp(self):
+        super(SolutionRenderer_TestCase, self).setUp()
+        self.task.solution_template = TemplateModel.objects.create(
+            body='Answer: {{x}}, {{OUTPUTS.y}}')
+        self.task.save()
+
+    def test_render_solution(self):
+        renderer = TaskRenderer(self.task)
+        self.assertEqual(renderer.render_solution({'x': 1, 'y': 2}), 'Answer: 1, 2')
+        self.assertEqual(renderer.render_solution({'x': 3, 'y': 4}), 'Answer: 3, 4')
+
+    def test_no_solution_template(self):
+        task = self.create_task(template_data.VALID_TEMPLATE_BODY_JINJA)
+        self.assertIsNone(TaskRenderer(task).render_solution({'x': 1}))
+
+    def test_solution_cached(self):
+        outputs = {'x': 1, 'y': 2}
+        source = self.task.solution_template.body
+        TaskRenderer(self.task).render_solution(outputs)
+        key = fragmentcache.get_solution_key(self.task, source, outputs)
+        self.assertEqual(cache.get(key), 'Answer: 1, 2')
+        cache.set(key, 'cached')
+        self.assertEqual(TaskRenderer(self.task).render_solution({'y': 2, 'x': 1}), 'cached')
+
+    def test_invalidated_by_template(self):
+        renderer = TaskRenderer(self.task)
+        renderer.render_solution({'x': 1, 'y': 2})
+        tempobj = self.task.solution_template
+        tempobj.body = 'Solution: {{x}}'
+        tempobj.save()
+        self.assertEqual(renderer.render_solution({'x': 1, 'y': 2}), 'Solution: 1')
+
+    def test_stream_solution(self):
+        tempobj = self.task.solution_template
+        tempobj.body = '{% for row in rows %}<tr><td>{{ row }}</td></tr>{% endfor %}{{ x }}'
+        tempobj.save()
+        outputs = {'rows': list(range(2000)), 'x': 1}
+        renderer = TaskRenderer(self.task)
+        with self.settings(DJSOLVER_STREAM_CHUNK_SIZE=1024):
+            chunks = list(renderer.stream_solution(outputs))
+        if engines.jinja2 is not None:
+            self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), renderer.render_solution(outputs))
+        # Cached solutions are streamed as well
+        self.assertEqual(list(renderer.stream_solution(outputs)), [''.join(chunks)])
+        self.assertEqual(list(TaskRenderer(self.create_task('x')).stream_solution(outputs)), [])
+
+
+class StreamingRenderer_TestCase(RenderingTestCase):
+
+    def _check_streaming(self, body):
+        for engine in (engines.DJANGO_ENGINE, engines.JINJA_ENGINE):
+            if engine == engines.JINJA_ENGINE and engines.jinja2 is None:
+                continue
+            template = engines.compile_template(body, engine)
+            values = {'rows': range(2000), 'username': 'dmitry'}
+            with self.settings(DJSOLVER_STREAM_CHUNK_SIZE=1024):
+                chunks = list(engines.stream_template(template, values))
+            self.assertGreater(len(chunks), 1)
+            self.assertEqual(''.join(chunks), engines.render_template(template, values))
+
+    def test_stream_template(self):
+        self._check_streaming('<table>{% for row in rows %}<tr><td>{{ row }}</td></tr>{% endfor %}'
+                              '</table>{% for row in rows %}{{ username }}{% endfor %}')
+
+    def test_stream_simple(self):
+        renderer = TaskRenderer(self.task)
+        response = StreamingHttpResponse(renderer.stream_simple())
+        self.assertEqual(b''.join(response.streaming_content).decode('utf-8'),
+                         template_data.RENDERED_ANSWER)
+
+    def test_stream_with_inputs(self):
+        renderer = TaskRenderer(self.task)
+        self.assertEqual(''.join(renderer.stream_with_inputs()), renderer.render_with_inputs())
+        # Cached fragments are streamed as well
+        self.assertEqual(''.join(renderer.stream_with_inputs()), renderer.render_with_inputs())
+
+    def test_private_task(self):
+        task = self.create_task('Private', public=False)
+        self.assertEqual(list(TaskRenderer(task).stream_simple()), [])
+
+
+class InputSchema_TestCase(RenderingTestCase):
+
+    def test_infer_field(self):
+        self.assertEqual(schema.infer_field(3), ('integer', schema.SCALAR, ()))
+        self.assertEqual(schema.infer_field('x'), ('string', schema.SCALAR, ()))
+        self.assertEqual(schema.infer_field([1, 2.5, 3]), ('float', schema.ARRAY_1D, (3,)))
+        self.assertEqual(schema.infer_field([]), ('integer', schema.ARRAY_1D, (0,)))
+        self.assertEqual(schema.infer_field([[1, 2], [3, 4], [5, 6]]),
+                         ('integer', schema.ARRAY_2D, (3, 2)))
+        self.assertEqual(schema.infer_field(['a', 1]), ('other', schema.ARRAY_1D, (2,)))
+
+    def test_widgets(self):
+        task = self.create_task('{{ n }} {{ v }} {{ m }}',
+                                defaults="{'n': 2, 'v': [1, 2], 'm': [[1, 2], [3, 4]]}")
+        fields = schema.get_input_schema(task)
+        self.assertEqual(list(fields), ['m', 'n', 'v'])
+        self.assertIn('<input', fields['n'].widget)
+        self.assertIn('value="2"', fields['n'].widget)
+        self.assertIn('<textarea', fields['v'].widget)
+        self.assertIn('1,2</textarea>', fields['v'].widget)
+        self.assertIn('1,2\n3,4</textarea>', fields['m'].widget)
+        html = TaskRenderer(task).render_with_inputs()
+        self.assertIn(fields['m'].widget, html)
+
+    def test_schema_cached(self):
+        fields = schema.get_input_schema(self.task)
+        self.assertIs(schema.get_input_schema(RegularTask.objects.get(pk=self.task.pk)), fields)
+        self.task.defaults = "{'username': 'ivan'}"
+        self.task.save()
+        fields = schema.get_input_schema(self.task)
+        self.assertEqual(list(fields), ['username'])
+        self.assertIn('value="ivan"', TaskRenderer(self.task).render_with_inputs())
+
+
+class FileCache_TestCase(RenderingTestCase):
+
+    def setUp(self):
+        super(FileCache_TestCase, self).setUp()
+        self.file_task = self.create_task('Hello, {{username}}!', in_file=True)
+        self.fieldfile = self.file_task.formulation_template.file
+
+    def test_content_cached(self):
+        self.assertEqual(filecache.read_file_content(self.fieldfile), 'Hello, {{username}}!')
+        self.assertIn(self.fieldfile.path, filecache._cache)
+        opened = []
+        original = filecache._read_path
+
+        def _read_path(path, size):
+            opened.append(path)
+            return original(path, size)
+
+        filecache._read_path = _read_path
+        try:
+            self.assertEqual(TaskRenderer(self.file_task).render_simple(), 'Hello, dmitry!')
+            self.assertEqual(opened, [])
+        finally:
+            filecache._read_path = original
+
+    def test_changed_file(self):
+        self.assertEqual(TaskRenderer(self.file_task).render_simple(), 'Hello, dmitry!')
+        with open(self.fieldfile.path, 'w') as f:
+            f.write('Bye, {{username}}!')
+        cache.clear()
+        self.assertEqual(TaskRenderer(self.file_task).render_simple(), 'Bye, dmitry!')
+
+    def test_missing_file(self):
+        os.remove(self.fieldfile.path)
+        with self.assertRaises(IOError):
+            filecache.read_file_content(self.fieldfile)
+        self.assertEqual(TaskRenderer(self.file_task).render_simple(), '')
+
+    def test_mmap(self):
+        content = 'x' * 4096
+        with open(self.fieldfile.path, 'w') as f:
+            f.write(content)
+        with self.settings(DJSOLVER_FILE_CACHE_MMAP_THRESHOLD=1024):
+            self.assertEqual(filecache.read_file_content(self.fieldfile), content)
+
+    def test_memory_bound(self):
+        cache = filecache.SizedLRUCache(maxsize=10)
+        cache.set('a', 'x' * 6)
+        cache.set('b', 'y' * 4)
+        self.assertEqual(cache.size, 10)
+        cache.get('a')
+        cache.set('c', 'z' * 3)
+        self.assertNotIn('b', cache)
+        self.assertIn('a', cache)
+        cache.set('d', 'w' * 11)
+        self.assertNotIn('d', cache)
+        self.assertEqual(cache.size, 9)
@@ -0,0 +1,230 @@
+'''
+Tests for task stack storage backends.
+'''
+
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from django_solver.base.engine import JobEngine, JOB_DONE, JOB_FAILED
+from django_solver.base.scheduler import FairScheduler
+from django_solver.base.stack import (MemoryTaskStack, DatabaseTaskStack,
+                                      RedisTaskStack, RedisError)
+from django_solver.models import RegularTask, PythonCodeModel, TemplateModel, JobStateModel
+
+from .data import template_data, solver_task_example
+
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+    '''Serves the subset of Redis commands used by RedisTaskStack.'''
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _write(self, reply):
+        if reply is None:
+            self.wfile.write(b'$-1\r\n')
+        elif isinstance(reply, int):
+            self.wfile.write(b':' + str(reply).encode('ascii') + b'\r\n')
+        elif isinstance(reply, list):
+            self.wfile.write(b'*' + str(len(reply)).encode('ascii') + b'\r\n')
+            for item in reply:
+                self._write(item)
+        else:
+            self.wfile.write(b'$' + str(len(reply)).encode('ascii') + b'\r\n' + reply + b'\r\n')
+
+    def handle(self):
+        data = self.server.data
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            name, args = args[0].upper(), args[1:]
+            with self.server.lock:
+                if name == b'INCR':
+                    data[args[0]] = int(data.get(args[0], 0)) + 1
+                    reply = data[args[0]]
+                elif name == b'RPUSH':
+                    data.setdefault(args[0], []).extend(args[1:])
+                    reply = len(data[args[0]])
+                elif name == b'LPOP':
+                    items = data.get(args[0])
+                    reply = items.pop(0) if items else None
+                elif name == b'LLEN':
+                    reply = len(data.get(args[0], []))
+                elif name == b'LINDEX':
+                    items = data.get(args[0], [])
+                    reply = items[int(args[1])] if int(args[1]) < len(items) else None
+                elif name == b'SADD':
+                    data.setdefault(args[0], set()).add(args[1])
+                    reply = 1
+                elif name == b'SREM':
+                    data.get(args[0], set()).discard(args[1])
+                    reply = 1
+                elif name == b'SMEMBERS':
+                    reply = sorted(data.get(args[0], set()))
+                elif name == b'SET':
+                    data[args[0]] = args[1]
+                    reply = b'OK'
+                elif name == b'GET':
+                    reply = data.get(args[0])
+                elif name == b'DEL':
+                    reply = int(data.pop(args[0], None) is not None)
+                else:
+                    self.wfile.write(b'-ERR unknown command\r\n')
+                    continue
+            if reply == b'OK':
+                self.wfile.write(b'+OK\r\n')
+            else:
+                self._write(reply)
+
+
+class _RedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), _RedisHandler)
+        self.data = {}
+        self.lock = threading.Lock()
+
+
+class _TaskStackTests(object):
+
+    def create_stack(self):
+        raise NotImplementedError
+
+    def test_fifo_per_owner(self):
+        stack = self.create_stack()
+        stack.push('a', 1, 'a0')
+        stack.push('b', 2, 'b0')
+        stack.push('a', 1, 'a1')
+        self.assertEqual(len(stack), 3)
+        heads = stack.heads()
+        self.assertEqual(sorted(heads), ['a', 'b'])
+        self.assertLess(heads['a'][0], heads['b'][0])
+        self.assertEqual(heads['b'][1], 2)
+        self.assertEqual(stack.pop('a'), 'a0')
+        self.assertEqual(stack.pop('a'), 'a1')
+        self.assertIsNone(stack.pop('a'))
+        self.assertEqual(list(stack.heads()), ['b'])
+        self.assertEqual(len(stack), 1)
+
+    def test_fair_scheduler(self):
+        scheduler = FairScheduler(storage=self.create_stack())
+        for i in range(3):
+            scheduler.push('flood', i)
+        scheduler.push('user', 0)
+        res = []
+        entry = scheduler.pop()
+        while entry is not None:
+            res.append(entry)
+            scheduler.release(entry[0])
+            entry = scheduler.pop()
+        self.assertEqual(res, [('flood', 0), ('user', 0), ('flood', 1), ('flood', 2)])
+
+
+class MemoryTaskStack_TestCase(_TaskStackTests, TestCase):
+
+    def create_stack(self):
+        return MemoryTaskStack()
+
+
+class DatabaseTaskStack_TestCase(_TaskStackTests, TestCase):
+
+    def create_stack(self):
+        return DatabaseTaskStack()
+
+    def test_job_state(self):
+        stack = self.create_stack()
+        self.assertIsNone(stack.load_state('missing'))
+        stack.save_state('job', {'status': 'queued'})
+        stack.save_state('job', {'status': 'done'})
+        self.assertEqual(stack.load_state('job'), {'status': 'done'})
+
+    def test_expired_job_state(self):
+        stack = self.create_stack()
+        stack.purge_interval = 0
+        stack.save_state('old', {'status': 'done'})
+        with override_settings(DJSOLVER_JOB_LIFETIME=-1):
+            self.assertIsNone(stack.load_state('old'))
+            # Expired states are deleted when a state is saved
+            stack.save_state('new', {'status': 'queued'})
+        self.assertFalse(JobStateModel.objects.filter(job_id='old').exists())
+
+
+class RedisTaskStack_TestCase(_TaskStackTests, TestCase):
+
+    def setUp(self):
+        self.server = _RedisServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def create_stack(self):
+        return RedisTaskStack(host='127.0.0.1', port=self.server.server_address[1])
+
+    def test_job_state(self):
+        stack = self.create_stack()
+        self.assertIsNone(stack.load_state('missing'))
+        stack.save_state('job', {'status': 'done'})
+        self.assertEqual(stack.load_state('job'), {'status': 'done'})
+
+    def test_heads_without_payloads(self):
+        stack = self.create_stack()
+        stack.push('a', 2, 'x' * 100000)
+        # Payloads are kept apart from queues
+        self.assertEqual(self.server.data[b'djsolver:queue:a'], [b'[1, 2]'])
+        self.assertEqual(stack.heads(), {'a': (1, 2)})
+        self.assertEqual(stack.pop('a'), 'x' * 100000)
+        self.assertNotIn(b'djsolver:item:1', self.server.data)
+
+    def test_server_error(self):
+        stack = self.create_stack()
+        with self.assertRaises(RedisError):
+            stack.connection.execute('FLUSHALL')
+
+    def test_shared_engines(self):
+        options = {'host': '127.0.0.1', 'port': self.server.server_address[1]}
+        template = TemplateModel.objects.create(body=template_data.VALID_TEMPLATE_BODY_JINJA)
+        code = PythonCodeModel.objects.create(body=solver_task_example.task_code)
+        task = RegularTask.objects.create(formulation_template=template, code=code,
+                                          defaults=str(solver_task_example.task_defaults))
+        cache.clear()
+        with override_settings(DJSOLVER_TASK_STACK={'BACKEND': 'django_solver.base.stack.RedisTaskStack',
+                                                    'OPTIONS': options},
+                               DJSOLVER_TASK_STACK_POLL_INTERVAL=0.05):
+            # The job is submitted by an engine without workers
+            # and solved by another one
+            front = JobEngine(processes=0)
+            worker = JobEngine(processes=1)
+            try:
+                job_id = front.submit(task, task.get_defaults)
+                state = front.wait(job_id, timeout=10)
+                while state['status'] not in (JOB_DONE, JOB_FAILED):
+                    state = front.wait(job_id, state['version'], timeout=10)
+                self.assertEqual(state['status'], JOB_DONE)
+                self.assertEqual(worker.status(job_id), state)
+                # The job is tracked only by the engine which solved it
+                self.assertNotIn(job_id, front._jobs)
+                self.assertIn(job_id, worker._jobs)
+            finally:
+                front.shutdown()
+                worker.shutdown()